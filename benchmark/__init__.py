@@ -0,0 +1,36 @@
+"""Offline-Benchmark des ALKIS-Suchmoduls (siehe benchmark/lauf.py)"""
+import importlib
+import importlib.util
+import os
+import sys
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_PAKET = "alkis_suchmodul"
+
+
+def lade_plugin_modul(name):
+    """Importiert ein Modul des Plugins, das dafür als Paket alkis_suchmodul geladen wird
+
+    Das Plugin-Verzeichnis heißt je nach Installation unterschiedlich und
+    nutzt relative Imports; deshalb wird es hier unter festem Namen
+    registriert.
+    """
+    if PLUGIN_PAKET not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PLUGIN_PAKET, os.path.join(PLUGIN_DIR, "__init__.py"), submodule_search_locations=[PLUGIN_DIR])
+        paket = importlib.util.module_from_spec(spec)
+        sys.modules[PLUGIN_PAKET] = paket
+        spec.loader.exec_module(paket)
+    return importlib.import_module(f"{PLUGIN_PAKET}.{name}")
+
+
+def starte_qgis():
+    """Initialisiert QGIS ohne Oberfläche mit eigenen, vom Benutzerprofil getrennten QSettings"""
+    from qgis.core import QgsApplication
+    from qgis.PyQt.QtCore import QCoreApplication
+
+    app = QgsApplication([], False)
+    app.initQgis()
+    QCoreApplication.setOrganizationName("ALKIS-Suchmodul")
+    QCoreApplication.setApplicationName("Benchmark")
+    return app
@@ -0,0 +1,278 @@
+"""Fixtures für den WFS-Ersatz: aufzeichnen oder synthetisch erzeugen
+
+    python -m benchmark.fixtures               fehlende Fixtures synthetisch erzeugen
+    python -m benchmark.fixtures --aufnehmen   Antworten der Landesdienste aufzeichnen
+
+Synthetische Fixtures enthalten für jeden Fall aus FAELLE ein quadratisches
+Flurstück mit passendem flstkennz (RLP: gemarkung/flur/flstnrzae/flstnrnen),
+damit Sammel-Requests wie beim echten Dienst zugeordnet werden. Beim
+Aufzeichnen wird jeweils das erste Flurstück (einzel) und der erste
+Sammel-Request (sammel) abgerufen; was ein Dienst nicht liefert, wird
+synthetisch ergänzt.
+"""
+from qgis.core import (QgsCoordinateTransformContext, QgsFeature, QgsField, QgsGeometry, QgsPointXY,
+                       QgsVectorFileWriter, QgsVectorLayer)
+from qgis.PyQt.QtCore import QVariant
+from xml.sax.saxutils import escape
+from . import lade_plugin_modul, starte_qgis
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import zipfile
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Gemarkung und Flur je Bundesland; Zähler 1..anzahl, jeder fünfte mit Nenner 2
+FAELLE = {
+    "Nordrhein-Westfalen": {"gemarkung": "Altena", "flur": "1", "anzahl": 60},
+    "Niedersachsen": {"gemarkung": "Norderney", "flur": "2", "anzahl": 60},
+    "Hessen": {"gemarkung": "Astheim", "flur": "1", "anzahl": 60},
+    "Rheinland-Pfalz": {"gemarkung": "Friesenhagen", "flur": "3", "anzahl": 60},
+}
+
+# Lage der synthetischen Flurstücke in EPSG:25832
+URSPRUNG = {
+    "Nordrhein-Westfalen": (400000.0, 5680000.0),
+    "Niedersachsen": (390000.0, 5955000.0),
+    "Hessen": (455000.0, 5535000.0),
+    "Rheinland-Pfalz": (410000.0, 5630000.0),
+}
+
+ZIP_CONTENT_TYPE = "application/x-zip-shapefile"
+GML_CONTENT_TYPE = "text/xml; subtype=gml/3.1.1"
+FELDER = ("flstkennz", "land", "gemarkung", "flur", "flstnrzae", "flstnrnen", "flaeche")
+
+EXCEPTION_REPORT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1" version="2.0.0">'
+    '<ows:Exception exceptionCode="OperationProcessingFailed">'
+    '<ows:ExceptionText>Simulierter Dienstfehler</ows:ExceptionText>'
+    '</ows:Exception></ows:ExceptionReport>'
+)
+
+
+def zeilen(faelle=FAELLE, bundeslaender=None):
+    """Suchzeilen wie aus der Stapelsuche (ohne Zeilennummer)"""
+    ergebnis = []
+    for bundesland, fall in faelle.items():
+        if bundeslaender and bundesland not in bundeslaender:
+            continue
+        for zaehler in range(1, fall["anzahl"] + 1):
+            ergebnis.append({
+                "bundesland": bundesland,
+                "gemarkung": fall["gemarkung"],
+                "flur": fall["flur"],
+                "zaehler": str(zaehler),
+                "nenner": "2" if zaehler % 5 == 0 else "",
+            })
+    return ergebnis
+
+
+def bereite_anfragen_vor(kern, bundesland, faelle=FAELLE):
+    """Vorbereitete Anfragen (bereite_anfrage_vor) aller Fälle eines Bundeslands"""
+    anfragen = []
+    for zeile in zeilen(faelle, [bundesland]):
+        success, anfrage = kern.bereite_anfrage_vor(bundesland, zeile["gemarkung"], zeile["flur"],
+                                                    zeile["zaehler"], zeile["nenner"])
+        if not success:
+            raise ValueError(f"{bundesland}: {anfrage}")
+        anfragen.append(anfrage)
+    return anfragen
+
+
+def synthetische_features(bundesland, anfragen):
+    """Attribute und Umring (25 x 25 m) je Anfrage"""
+    x0, y0 = URSPRUNG[bundesland]
+    features = []
+    for i, anfrage in enumerate(anfragen):
+        x, y = x0 + (i % 10) * 30.0, y0 + (i // 10) * 30.0
+        attribute = {
+            "flstkennz": anfrage["flstkennz"] or "",
+            "land": bundesland,
+            "gemarkung": anfrage["gem_full_name"].split("(")[0].strip(),
+            "flur": anfrage["flur_text"],
+            "flstnrzae": anfrage["zaehler_text"],
+            "flstnrnen": anfrage["nenner_text"] or "",
+            "flaeche": "625",
+        }
+        if anfrage["rlp_filter"]:
+            attribute["gemarkung"], attribute["flur"] = anfrage["rlp_filter"][:2]
+        umring = [(x, y), (x + 25.0, y), (x + 25.0, y + 25.0), (x, y + 25.0), (x, y)]
+        features.append((attribute, umring))
+    return features
+
+
+def schreibe_shapefile_zip(features):
+    """Shapefile-ZIP wie vom WFS (OUTPUTFORMAT=application/x-zip-shapefile)"""
+    layer = QgsVectorLayer("Polygon?crs=EPSG:25832", "Flurstueck", "memory")
+    layer.dataProvider().addAttributes([QgsField(name, QVariant.String) for name in FELDER])
+    layer.updateFields()
+
+    neue = []
+    for attribute, umring in features:
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromPolygonXY([[QgsPointXY(x, y) for x, y in umring]]))
+        for name in FELDER:
+            feature[name] = attribute[name]
+        neue.append(feature)
+    layer.dataProvider().addFeatures(neue)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        optionen = QgsVectorFileWriter.SaveVectorOptions()
+        optionen.driverName = "ESRI Shapefile"
+        optionen.fileEncoding = "UTF-8"
+        fehler = QgsVectorFileWriter.writeAsVectorFormatV2(
+            layer, os.path.join(tmp_dir, "Flurstueck.shp"), QgsCoordinateTransformContext(), optionen)[0]
+        if fehler != QgsVectorFileWriter.NoError:
+            raise RuntimeError("Shapefile konnte nicht geschrieben werden")
+
+        zip_path = os.path.join(tmp_dir, "Flurstueck.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+            for name in sorted(os.listdir(tmp_dir)):
+                if name.startswith("Flurstueck.") and not name.endswith(".zip"):
+                    zip_ref.write(os.path.join(tmp_dir, name), name)
+        with open(zip_path, "rb") as f:
+            return f.read()
+
+
+def schreibe_gml(features, content_type):
+    """GetFeature-Antwort als GML 3.1.1 bzw. 3.2 (nach content_type)"""
+    if "3.2" in content_type:
+        wfs_ns, gml_ns, member = "http://www.opengis.net/wfs/2.0", "http://www.opengis.net/gml/3.2", "wfs:member"
+    else:
+        wfs_ns, gml_ns, member = "http://www.opengis.net/wfs", "http://www.opengis.net/gml", "gml:featureMember"
+    ave_ns = lade_plugin_modul("flurstueck_kern").AVE_NAMESPACE
+
+    teile = [f'<?xml version="1.0" encoding="UTF-8"?>'
+             f'<wfs:FeatureCollection xmlns:wfs="{wfs_ns}" xmlns:gml="{gml_ns}" xmlns:ave="{ave_ns}">']
+    for i, (attribute, umring) in enumerate(features):
+        werte = "".join(f"<ave:{name}>{escape(attribute[name])}</ave:{name}>" for name in FELDER)
+        pos_list = " ".join(f"{x:.3f} {y:.3f}" for x, y in umring)
+        teile.append(
+            f'<{member}><ave:Flurstueck gml:id="Flurstueck.{i + 1}">{werte}'
+            f'<ave:geometrie><gml:Polygon srsName="urn:ogc:def:crs:EPSG::25832">'
+            f'<gml:exterior><gml:LinearRing><gml:posList>{pos_list}</gml:posList></gml:LinearRing></gml:exterior>'
+            f'</gml:Polygon></ave:geometrie></ave:Flurstueck></{member}>'
+        )
+    teile.append("</wfs:FeatureCollection>")
+    return "".join(teile).encode("utf-8")
+
+
+def lese_manifest(verzeichnis):
+    pfad = os.path.join(verzeichnis, "manifest.json")
+    if os.path.exists(pfad):
+        with open(pfad, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"dateien": {}, "quelle": {}}
+
+
+def speichere(verzeichnis, manifest, name, inhalt, content_type, quelle):
+    """Legt eine Fixture-Datei ab und trägt sie im Manifest ein"""
+    with open(os.path.join(verzeichnis, name), "wb") as f:
+        f.write(inhalt)
+    manifest["dateien"][name] = content_type
+    manifest["quelle"][name] = quelle
+
+
+def schreibe_manifest(verzeichnis, manifest):
+    manifest["erstellt"] = datetime.datetime.now().isoformat(timespec="seconds")
+    with open(os.path.join(verzeichnis, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+def erzeuge_synthetisch(kern, ziel_dir=FIXTURES_DIR, bundeslaender=None, ueberschreiben=False):
+    """Erzeugt fehlende (mit ueberschreiben alle) Fixtures synthetisch"""
+    kuerzel_je_land = lade_plugin_modul("flurstueck_kern").BUNDESLAND_KUERZEL
+    for bundesland in bundeslaender or FAELLE:
+        verzeichnis = os.path.join(ziel_dir, kuerzel_je_land[bundesland])
+        os.makedirs(verzeichnis, exist_ok=True)
+        manifest = lese_manifest(verzeichnis)
+
+        features = synthetische_features(bundesland, bereite_anfragen_vor(kern, bundesland))
+        gml_content_type = kern.wfs_config[bundesland]["stream_format"] or GML_CONTENT_TYPE
+        dateien = {
+            "einzel.zip": lambda: (schreibe_shapefile_zip(features[:1]), ZIP_CONTENT_TYPE),
+            "sammel.zip": lambda: (schreibe_shapefile_zip(features), ZIP_CONTENT_TYPE),
+            "einzel.xml": lambda: (schreibe_gml(features[:1], gml_content_type), gml_content_type),
+            "sammel.xml": lambda: (schreibe_gml(features, gml_content_type), gml_content_type),
+            "exception.xml": lambda: (EXCEPTION_REPORT.encode("utf-8"), "text/xml"),
+        }
+        for name, erzeuge in dateien.items():
+            if ueberschreiben or name not in manifest["dateien"]:
+                inhalt, content_type = erzeuge()
+                speichere(verzeichnis, manifest, name, inhalt, content_type, "synthetisch")
+        schreibe_manifest(verzeichnis, manifest)
+        print(f"{bundesland}: {', '.join(sorted(manifest['dateien']))}")
+
+
+def nehme_auf(kern, ziel_dir=FIXTURES_DIR, bundeslaender=None):
+    """Zeichnet einzel/sammel-Antworten der Landesdienste (ZIP und XML) auf"""
+    kuerzel_je_land = lade_plugin_modul("flurstueck_kern").BUNDESLAND_KUERZEL
+    for bundesland in bundeslaender or FAELLE:
+        verzeichnis = os.path.join(ziel_dir, kuerzel_je_land[bundesland])
+        os.makedirs(verzeichnis, exist_ok=True)
+        manifest = lese_manifest(verzeichnis)
+
+        cfg = kern.wfs_config[bundesland]
+        wfs_url = kern.wfs_urls[bundesland]
+        anfragen = bereite_anfragen_vor(kern, bundesland)
+        filter_je_art = {
+            "einzel": kern.erstelle_sammel_filter(anfragen[:1], cfg),
+            "sammel": kern.erstelle_sammel_filter(anfragen[:cfg["max_filter"]], cfg),
+        }
+        formate = {"zip": cfg["output_format"], "xml": cfg["stream_format"]}
+
+        for art, filter_xml in filter_je_art.items():
+            for endung, ausgabeformat in formate.items():
+                if not ausgabeformat:
+                    continue
+                url = kern.erstelle_getfeature_url(wfs_url, cfg, filter_xml, ausgabeformat)
+                daten = None
+                if len(url) > cfg["max_url_laenge"] and cfg["post"]:
+                    url, daten = wfs_url, kern.erstelle_getfeature_post(cfg, filter_xml, ausgabeformat)
+                try:
+                    response = kern.sende_wfs_request(url, daten, bundesland=bundesland)
+                except Exception as e:
+                    print(f"{bundesland} {art}.{endung}: {str(e)}")
+                    continue
+                if response.status_code != 200:
+                    print(f"{bundesland} {art}.{endung}: HTTP {response.status_code}")
+                    continue
+                speichere(verzeichnis, manifest, f"{art}.{endung}", response.content,
+                          response.headers.get("Content-Type", ""), "aufgezeichnet")
+                print(f"{bundesland} {art}.{endung}: {len(response.content)} Bytes")
+        schreibe_manifest(verzeichnis, manifest)
+
+    erzeuge_synthetisch(kern, ziel_dir, bundeslaender)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixtures für den WFS-Ersatz erzeugen oder aufzeichnen")
+    parser.add_argument("--ziel", default=FIXTURES_DIR)
+    parser.add_argument("--laender", help="Kürzel, z.B. NRW,HE (Standard: alle)")
+    parser.add_argument("--aufnehmen", action="store_true", help="Antworten der Landesdienste aufzeichnen")
+    parser.add_argument("--ueberschreiben", action="store_true", help="vorhandene Fixtures neu erzeugen")
+    args = parser.parse_args()
+
+    app = starte_qgis()
+    kern_modul = lade_plugin_modul("flurstueck_kern")
+    kern = kern_modul.FlurstueckKern()
+    bundeslaender = None
+    if args.laender:
+        kuerzel = {k.strip().upper() for k in args.laender.split(",")}
+        bundeslaender = [land for land, k in kern_modul.BUNDESLAND_KUERZEL.items() if k in kuerzel]
+
+    try:
+        if args.aufnehmen:
+            nehme_auf(kern, args.ziel, bundeslaender)
+        else:
+            erzeuge_synthetisch(kern, args.ziel, bundeslaender, args.ueberschreiben)
+    finally:
+        kern.http.schliesse()
+        app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Offline-Benchmark der Flurstückssuche
+
+Startet den lokalen WFS-Ersatz (wfs_stub) mit den Fixtures aus
+benchmark/fixtures, leitet alle Bundesländer darauf um und misst die
+Stufen der Suche (Gemarkung, URL, HTTP, Dekodierung, Entpacken, OGR,
+Layer) für Einzel- und Stapelsuchen. Aufruf mit der Python-Umgebung von
+QGIS aus dem Plugin-Verzeichnis:
+
+    python -m benchmark.lauf
+    python -m benchmark.lauf --latenz-ms 80 --durchsatz-kbs 500 --szenario HE=xml
+    python -m benchmark.lauf --baseline-speichern
+    python -m benchmark.lauf --vergleiche benchmark/baseline.json
+
+Mit --vergleiche endet der Lauf mit Exit-Code 1, wenn der Median einer
+Stufe um mehr als --toleranz über der Baseline liegt.
+"""
+from qgis.PyQt.QtCore import QSettings
+from . import lade_plugin_modul, starte_qgis
+from .fixtures import FIXTURES_DIR, erzeuge_synthetisch, zeilen
+from .messung import StufenMesser, fasse_zusammen, vergleiche
+from .wfs_stub import WfsStub, lese_szenarien
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BASELINE_PFAD = os.path.join(os.path.dirname(__file__), "baseline.json")
+ERGEBNIS_DIR = os.path.join(os.path.dirname(__file__), "ergebnisse")
+
+
+def richte_kern_ein(kern, stub, cache_db, mit_cache, stream, vsimem):
+    """Leitet den Kern auf den WFS-Ersatz um und setzt die Einstellungen des Laufs"""
+    kern_modul = lade_plugin_modul("flurstueck_kern")
+    cache_modul = lade_plugin_modul("flurstueck_cache")
+
+    for bundesland, kuerzel in kern_modul.BUNDESLAND_KUERZEL.items():
+        kern.wfs_urls[bundesland] = stub.url(kuerzel)
+        kern.http.setze_rate(bundesland, 0)
+
+    settings = QSettings()
+    settings.setValue("alkis_suchmodul/cache/aktiv", mit_cache)
+    settings.setValue("alkis_suchmodul/decode/stream", stream)
+    settings.setValue("alkis_suchmodul/decode/vsimem", vsimem)
+    # Der WFS-Ersatz beantwortet kein GetCapabilities; gemessen wird mit der festen Konfiguration
+    settings.setValue("alkis_suchmodul/profil/aktiv", False)
+    kern.cache = cache_modul.FlurstueckCache(cache_db)
+
+
+def einzelsuche(kern, zeile):
+    """Eine Suche wie suche_flurstueck, aber ohne Karte: Anfrage, Abruf, Memory-Layer"""
+    success, anfrage = kern.bereite_anfrage_vor(zeile["bundesland"], zeile["gemarkung"], zeile["flur"],
+                                                zeile["zaehler"], zeile["nenner"])
+    if not success:
+        return False, anfrage
+
+    success, ergebnis = kern.lade_flurstueck(anfrage)
+    if not success:
+        return False, ergebnis
+
+    layer = ergebnis.get("layer")
+    if layer is None:
+        layer_name = kern.erstelle_layer_name(anfrage["bundesland"], anfrage["gem_full_name"], anfrage["flur_text"],
+                                              anfrage["zaehler_text"], anfrage["nenner_text"])
+        layer = kern.erstelle_memory_layer(layer_name, ergebnis)
+    return True, layer.featureCount()
+
+
+def miss_einzel(kern, messer, faelle, durchlaeufe, aufwaermen):
+    """Wiederholt Einzelsuchen über die Fälle eines Bundeslands"""
+    messungen = []
+    fehler = []
+    for nummer in range(aufwaermen + durchlaeufe):
+        zeile = faelle[nummer % len(faelle)]
+        messer.entnehme()
+        start = time.perf_counter()
+        success, meldung = einzelsuche(kern, zeile)
+        gesamt = time.perf_counter() - start
+        zeiten = messer.entnehme()
+        if nummer < aufwaermen:
+            continue
+        if not success:
+            fehler.append(meldung)
+        zeiten["sonstiges"] = max(0.0, gesamt - sum(zeiten.values()))
+        zeiten["gesamt"] = gesamt
+        messungen.append(zeiten)
+    return messungen, fehler
+
+
+def miss_stapel(kern, messer, faelle, durchlaeufe, aufwaermen, worker):
+    """Wiederholt die Stapelsuche über alle Fälle
+
+    Die Stufenzeiten werden über alle Worker-Threads summiert und können
+    daher größer als die Gesamtzeit sein.
+    """
+    batch_modul = lade_plugin_modul("flurstueck_batch")
+    messungen = []
+    fehler = []
+    for nummer in range(aufwaermen + durchlaeufe):
+        batch = batch_modul.FlurstueckBatchSuche(kern, worker, True)
+        messer.umhuelle(batch, "fuehre_treffer_zusammen", "layer")
+        stapel = [dict(zeile, zeile=i) for i, zeile in enumerate(faelle, start=1)]
+        messer.entnehme()
+        start = time.perf_counter()
+        treffer, bericht = batch.fuehre_aus(stapel)
+        if treffer:
+            batch.fuehre_treffer_zusammen(treffer)
+        gesamt = time.perf_counter() - start
+        zeiten = messer.entnehme()
+        if nummer < aufwaermen:
+            continue
+        fehler.extend(eintrag["meldung"] for eintrag in bericht if not eintrag["erfolg"])
+        zeiten["gesamt"] = gesamt
+        messungen.append(zeiten)
+    return messungen, fehler
+
+
+def werte_aus(messungen, fehler, anzahl):
+    ergebnis = {
+        "durchlaeufe": len(messungen),
+        "anfragen": anzahl,
+        "fehler": len(fehler),
+        "stufen": fasse_zusammen(messungen),
+    }
+    if fehler:
+        ergebnis["erster_fehler"] = str(fehler[0])
+    return ergebnis
+
+
+def drucke_tabelle(ergebnis):
+    """Gibt Median und p95 je Workload und Stufe aus"""
+    reihenfolge = ("gemarkung", "url", "http", "dekodierung", "entpacken", "ogr", "layer", "sonstiges", "gesamt")
+    for workload, werte in ergebnis["workloads"].items():
+        print(f"\n{workload}  ({werte['durchlaeufe']} Durchläufe, {werte['fehler']} Fehler)")
+        for stufe in reihenfolge:
+            if stufe in werte["stufen"]:
+                s = werte["stufen"][stufe]
+                print(f"  {stufe:<12} median {s['median_ms']:>10.2f} ms   p95 {s['p95_ms']:>10.2f} ms")
+        if "erster_fehler" in werte:
+            print(f"  Fehler: {werte['erster_fehler']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline-Benchmark der Flurstückssuche")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--laender", help="Kürzel, z.B. NRW,HE (Standard: alle)")
+    parser.add_argument("--durchlaeufe", type=int, default=20, help="Durchläufe je Einzel-Workload")
+    parser.add_argument("--stapel-durchlaeufe", type=int, default=5)
+    parser.add_argument("--aufwaermen", type=int, default=2, help="nicht gewertete Durchläufe vorab")
+    parser.add_argument("--worker", type=int, default=4, help="parallele Abrufe je Bundesland (Stapel)")
+    parser.add_argument("--latenz-ms", type=float, default=0)
+    parser.add_argument("--durchsatz-kbs", type=float, default=0, help="0 = unbegrenzt")
+    parser.add_argument("--szenario", action="append", metavar="LAND=SZENARIO",
+                        help="auto, xml, fehler oder exception je Kürzel")
+    parser.add_argument("--mit-cache", action="store_true", help="Flurstück-Cache eingeschaltet lassen")
+    parser.add_argument("--ohne-stream", action="store_true", help="Shapefile-ZIP statt GML-Stream anfragen")
+    parser.add_argument("--ohne-vsimem", action="store_true", help="Shapefiles über temporäre Dateien lesen")
+    parser.add_argument("--ausgabe", help="Ergebnis-JSON (Standard: benchmark/ergebnisse/<Zeit>.json)")
+    parser.add_argument("--baseline-speichern", action="store_true", help=f"Ergebnis als {BASELINE_PFAD} ablegen")
+    parser.add_argument("--vergleiche", metavar="BASELINE", help="mit gespeicherter Baseline vergleichen")
+    parser.add_argument("--toleranz", type=float, default=0.2, help="erlaubte relative Abweichung des Medians")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="erlaubte absolute Abweichung des Medians")
+    args = parser.parse_args()
+
+    app = starte_qgis()
+    kern_modul = lade_plugin_modul("flurstueck_kern")
+    kern = kern_modul.FlurstueckKern()
+    bundeslaender = list(kern_modul.BUNDESLAND_KUERZEL)
+    if args.laender:
+        kuerzel = {k.strip().upper() for k in args.laender.split(",")}
+        bundeslaender = [land for land in bundeslaender if kern_modul.BUNDESLAND_KUERZEL[land] in kuerzel]
+
+    erzeuge_synthetisch(kern, args.fixtures, bundeslaender)
+
+    stub = WfsStub(args.fixtures, args.latenz_ms, args.durchsatz_kbs, lese_szenarien(args.szenario))
+    stub.starte()
+    messer = StufenMesser()
+    ergebnis = {
+        "meta": {
+            "zeit": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "plattform": platform.platform(),
+            "einstellungen": {k: v for k, v in vars(args).items()
+                              if k not in ("ausgabe", "vergleiche", "baseline_speichern")},
+        },
+        "workloads": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            richte_kern_ein(kern, stub, os.path.join(tmp_dir, "cache.sqlite"), args.mit_cache,
+                            not args.ohne_stream, not args.ohne_vsimem)
+            messer.instrumentiere(kern)
+
+            for bundesland in bundeslaender:
+                faelle = zeilen(bundeslaender=[bundesland])
+                messungen, fehler = miss_einzel(kern, messer, faelle, args.durchlaeufe, args.aufwaermen)
+                name = f"einzel/{kern_modul.BUNDESLAND_KUERZEL[bundesland]}"
+                ergebnis["workloads"][name] = werte_aus(messungen, fehler, 1)
+
+            faelle = zeilen(bundeslaender=bundeslaender)
+            messungen, fehler = miss_stapel(kern, messer, faelle, args.stapel_durchlaeufe,
+                                            min(args.aufwaermen, 1), args.worker)
+            ergebnis["workloads"]["stapel"] = werte_aus(messungen, fehler, len(faelle))
+        finally:
+            stub.stoppe()
+            kern.http.schliesse()
+            kern.cache = None
+
+    ergebnis["meta"]["http_anfragen"] = stub.anfragen
+    ergebnis["meta"]["http_bytes"] = stub.bytes_gesendet
+    drucke_tabelle(ergebnis)
+
+    ausgabe = args.ausgabe
+    if not ausgabe:
+        os.makedirs(ERGEBNIS_DIR, exist_ok=True)
+        ausgabe = os.path.join(ERGEBNIS_DIR, datetime.datetime.now().strftime("%Y%m%d_%H%M%S.json"))
+    with open(ausgabe, "w", encoding="utf-8") as f:
+        json.dump(ergebnis, f, indent=2, ensure_ascii=False)
+    print(f"\nErgebnis gespeichert: {ausgabe}")
+    if args.baseline_speichern:
+        with open(BASELINE_PFAD, "w", encoding="utf-8") as f:
+            json.dump(ergebnis, f, indent=2, ensure_ascii=False)
+        print(f"Baseline gespeichert: {BASELINE_PFAD}")
+
+    exit_code = 0
+    if args.vergleiche:
+        with open(args.vergleiche, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressionen = vergleiche(ergebnis, baseline, args.toleranz, args.min_ms)
+        if regressionen:
+            print(f"\n{len(regressionen)} Regressionen gegenüber {args.vergleiche}:")
+            for workload, stufe, alt_ms, neu_ms in regressionen:
+                print(f"  {workload} / {stufe}: {alt_ms:.2f} ms -> {neu_ms:.2f} ms")
+            exit_code = 1
+        else:
+            print(f"\nKeine Regressionen gegenüber {args.vergleiche}")
+
+    app.exitQgis()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Zeitmessung je Stufe der Flurstückssuche
+
+Die Stufen werden gemessen, indem die Methoden einer FlurstueckKern-Instanz
+umhüllt werden; der Plugin-Code bleibt unverändert. Gemessen wird jeweils
+die exklusive Zeit: ruft eine gemessene Methode eine andere auf (z.B.
+lese_antwort_stream -> antwort_bloecke), zählt die Zeit nur bei der
+inneren Stufe.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import functools
+import math
+import threading
+import time
+
+# Stufe -> Methoden von FlurstueckKern
+STUFEN = {
+    "gemarkung": ("get_gemarkungen_for_bundesland", "find_gemarkung_by_name", "validate_gemarkungsschluessel"),
+    "url": ("erstelle_wfs_request_standard", "erstelle_wfs_request_rlp", "erstelle_sammel_requests"),
+    "http": ("sende_wfs_request",),
+    "dekodierung": ("lese_antwort_stream",),
+    "entpacken": ("lese_shapefile_vsimem", "lese_shapefile_tempfile"),
+    "ogr": ("lese_ogr_quelle", "lese_xml_antwort"),
+    "layer": ("erstelle_memory_layer",),
+}
+
+# Generatoren: gemessen wird jeder einzelne Schritt (Download der Blöcke)
+GENERATOR_STUFEN = {
+    "http": ("antwort_bloecke",),
+}
+
+
+class StufenMesser:
+    """Summiert exklusive Zeiten und Aufrufe je Stufe (thread-sicher)"""
+
+    def __init__(self):
+        self.lokal = threading.local()
+        self.lock = threading.Lock()
+        self.zeiten = defaultdict(float)
+        self.aufrufe = defaultdict(int)
+
+    def stapel(self):
+        if not hasattr(self.lokal, "stapel"):
+            self.lokal.stapel = []
+        return self.lokal.stapel
+
+    @contextmanager
+    def stufe(self, name):
+        """Misst den Block als Stufe name"""
+        stapel = self.stapel()
+        stapel.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            dauer = time.perf_counter() - start
+            kinder = stapel.pop()
+            if stapel:
+                stapel[-1] += dauer
+            with self.lock:
+                self.zeiten[name] += dauer - kinder
+                self.aufrufe[name] += 1
+
+    def umhuelle(self, objekt, methode, name):
+        """Ersetzt objekt.methode durch eine gemessene Variante"""
+        original = getattr(objekt, methode)
+
+        @functools.wraps(original)
+        def gemessen(*args, **kwargs):
+            with self.stufe(name):
+                return original(*args, **kwargs)
+
+        setattr(objekt, methode, gemessen)
+
+    def umhuelle_generator(self, objekt, methode, name):
+        """Wie umhuelle, misst aber jeden Schritt des zurückgegebenen Generators"""
+        original = getattr(objekt, methode)
+
+        @functools.wraps(original)
+        def gemessen(*args, **kwargs):
+            iterator = iter(original(*args, **kwargs))
+            while True:
+                with self.stufe(name):
+                    try:
+                        wert = next(iterator)
+                    except StopIteration:
+                        return
+                yield wert
+
+        setattr(objekt, methode, gemessen)
+
+    def instrumentiere(self, kern):
+        """Umhüllt alle Methoden aus STUFEN und GENERATOR_STUFEN"""
+        for name, methoden in STUFEN.items():
+            for methode in methoden:
+                self.umhuelle(kern, methode, name)
+        for name, methoden in GENERATOR_STUFEN.items():
+            for methode in methoden:
+                self.umhuelle_generator(kern, methode, name)
+
+    def entnehme(self):
+        """Gibt die Zeiten (Sekunden) seit dem letzten Aufruf zurück und setzt sie zurück"""
+        with self.lock:
+            zeiten = dict(self.zeiten)
+            self.zeiten.clear()
+            self.aufrufe.clear()
+        return zeiten
+
+
+def perzentil(werte, p):
+    """Perzentil nach dem Nearest-Rank-Verfahren"""
+    if not werte:
+        return 0.0
+    sortiert = sorted(werte)
+    rang = max(1, math.ceil(p / 100.0 * len(sortiert)))
+    return sortiert[rang - 1]
+
+
+def fasse_zusammen(durchlaeufe):
+    """Median, p95 und Mittel je Stufe in Millisekunden
+
+    durchlaeufe ist eine Liste von Dicts Stufe -> Sekunden; fehlende Stufen
+    zählen als 0.
+    """
+    stufen = sorted({name for durchlauf in durchlaeufe for name in durchlauf})
+    ergebnis = {}
+    for name in stufen:
+        werte = [durchlauf.get(name, 0.0) * 1000.0 for durchlauf in durchlaeufe]
+        ergebnis[name] = {
+            "median_ms": round(perzentil(werte, 50), 3),
+            "p95_ms": round(perzentil(werte, 95), 3),
+            "mittel_ms": round(sum(werte) / len(werte), 3),
+        }
+    return ergebnis
+
+
+def vergleiche(aktuell, baseline, toleranz=0.2, min_ms=2.0):
+    """Vergleicht die Mediane zweier Ergebnisse
+
+    Eine Regression liegt vor, wenn der Median einer Stufe um mehr als
+    toleranz (relativ) und min_ms (absolut) über der Baseline liegt. Gibt
+    eine Liste von (workload, stufe, baseline_ms, aktuell_ms) zurück.
+    """
+    regressionen = []
+    for workload, alt in baseline.get("workloads", {}).items():
+        neu = aktuell.get("workloads", {}).get(workload)
+        if neu is None:
+            continue
+        for stufe, werte in alt["stufen"].items():
+            if stufe not in neu["stufen"]:
+                continue
+            alt_ms = werte["median_ms"]
+            neu_ms = neu["stufen"][stufe]["median_ms"]
+            if neu_ms > alt_ms * (1 + toleranz) and neu_ms - alt_ms > min_ms:
+                regressionen.append((workload, stufe, alt_ms, neu_ms))
+    return regressionen
@@ -0,0 +1,216 @@
+"""Lokaler Ersatz für die WFS-Dienste der Länder
+
+Gibt aufgezeichnete Antworten aus einem Fixture-Verzeichnis wieder. Je
+Bundesland (Pfad /NRW, /NI, /HE, /RLP) liegt dort ein Unterverzeichnis mit
+manifest.json und den Antwortdateien:
+
+    einzel.zip / einzel.xml   Antwort auf ein einzelnes Flurstück
+    sammel.zip / sammel.xml   Antwort auf einen Sammel-Request (Or-Filter)
+    exception.xml             ExceptionReport des Dienstes
+
+manifest.json ordnet jeder Datei ihren Content-Type zu. Welche Datei
+geliefert wird, hängt vom angefragten OUTPUTFORMAT, vom Filter und vom
+Szenario des Bundeslands ab. Latenz (vor dem ersten Byte) und Durchsatz
+sind einstellbar.
+
+Kommt ohne QGIS aus und kann auch allein gestartet werden:
+
+    python -m benchmark.wfs_stub --port 8765 --latenz-ms 80
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+SZENARIEN = ("auto", "xml", "fehler", "exception")
+
+
+class WfsStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.stub.antworte(self, "")
+
+    def do_POST(self):
+        laenge = int(self.headers.get("Content-Length") or 0)
+        daten = self.rfile.read(laenge).decode("utf-8", errors="replace") if laenge else ""
+        self.server.stub.antworte(self, daten)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WfsStub:
+    """HTTP-Server, der Fixtures mit einstellbarer Latenz und Bandbreite ausliefert
+
+    latenz_ms verzögert jede Antwort vor dem Statuscode, durchsatz_kbs
+    begrenzt die Übertragungsrate (0 = unbegrenzt). szenarien ordnet
+    Kürzeln eines der SZENARIEN zu:
+
+        auto       ZIP bei Shapefile-Anfragen, sonst XML (Standard)
+        xml        immer XML, auch wenn ein Shapefile angefragt wurde
+        fehler     HTTP 500
+        exception  HTTP 200 mit ExceptionReport
+    """
+
+    BLOCK_GROESSE = 16384
+
+    def __init__(self, fixtures_dir, latenz_ms=0, durchsatz_kbs=0, szenarien=None, port=0):
+        self.fixtures_dir = fixtures_dir
+        self.latenz_ms = latenz_ms
+        self.durchsatz_kbs = durchsatz_kbs
+        self.szenarien = dict(szenarien or {})
+        self.port = port
+        self.server = None
+        self.thread = None
+        self.manifeste = {}
+        self.dateien = {}
+        self.lock = threading.Lock()
+        self.anfragen = 0
+        self.bytes_gesendet = 0
+
+    def starte(self):
+        """Startet den Server in einem Hintergrund-Thread; gibt den Port zurück"""
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.port), WfsStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stoppe(self):
+        """Beendet den Server"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def url(self, kuerzel):
+        """Basis-URL des Ersatzdienstes für ein Bundesland"""
+        return f"http://127.0.0.1:{self.port}/{kuerzel}"
+
+    def manifest(self, kuerzel):
+        """manifest.json eines Bundeslands (zwischengespeichert)"""
+        with self.lock:
+            if kuerzel not in self.manifeste:
+                pfad = os.path.join(self.fixtures_dir, kuerzel, "manifest.json")
+                if os.path.exists(pfad):
+                    with open(pfad, "r", encoding="utf-8") as f:
+                        self.manifeste[kuerzel] = json.load(f)
+                else:
+                    self.manifeste[kuerzel] = None
+            return self.manifeste[kuerzel]
+
+    def datei(self, kuerzel, name):
+        """Inhalt einer Fixture-Datei (zwischengespeichert)"""
+        with self.lock:
+            schluessel = (kuerzel, name)
+            if schluessel not in self.dateien:
+                with open(os.path.join(self.fixtures_dir, kuerzel, name), "rb") as f:
+                    self.dateien[schluessel] = f.read()
+            return self.dateien[schluessel]
+
+    def waehle_fixture(self, kuerzel, abfrage, daten):
+        """Name der Fixture-Datei für eine Anfrage oder None für HTTP 500"""
+        szenario = self.szenarien.get(kuerzel, "auto")
+        if szenario == "fehler":
+            return None
+        if szenario == "exception":
+            return "exception.xml"
+
+        parameter = {k.lower(): v[0] for k, v in urllib.parse.parse_qs(abfrage).items()}
+        ausgabeformat = parameter.get("outputformat", "")
+        if daten:
+            treffer = re.search(r'outputFormat="([^"]*)"', daten)
+            ausgabeformat = treffer.group(1) if treffer else ausgabeformat
+        filter_xml = daten or parameter.get("filter", "")
+
+        art = "sammel" if re.search(r"<(\w+:)?Or>", filter_xml) else "einzel"
+        endung = "zip" if szenario == "auto" and "shape" in ausgabeformat.lower() else "xml"
+        return f"{art}.{endung}"
+
+    def antworte(self, handler, daten):
+        """Beantwortet eine GetFeature-Anfrage"""
+        pfad, _, abfrage = handler.path.partition("?")
+        kuerzel = pfad.strip("/").split("/")[0].upper()
+        with self.lock:
+            self.anfragen += 1
+
+        if self.latenz_ms:
+            time.sleep(self.latenz_ms / 1000.0)
+
+        manifest = self.manifest(kuerzel)
+        name = self.waehle_fixture(kuerzel, abfrage, daten) if manifest else None
+        if name is None or name not in manifest["dateien"]:
+            inhalt = f"Interner Fehler ({kuerzel})".encode("utf-8")
+            handler.send_response(500)
+            handler.send_header("Content-Type", "text/plain; charset=utf-8")
+            handler.send_header("Content-Length", str(len(inhalt)))
+            handler.end_headers()
+            handler.wfile.write(inhalt)
+            return
+
+        inhalt = self.datei(kuerzel, name)
+        handler.send_response(200)
+        handler.send_header("Content-Type", manifest["dateien"][name])
+        handler.send_header("Content-Length", str(len(inhalt)))
+        handler.end_headers()
+        self.sende_gedrosselt(handler, inhalt)
+
+    def sende_gedrosselt(self, handler, inhalt):
+        """Schreibt den Body blockweise und hält den eingestellten Durchsatz ein"""
+        start = time.monotonic()
+        gesendet = 0
+        try:
+            for position in range(0, len(inhalt), self.BLOCK_GROESSE):
+                block = inhalt[position:position + self.BLOCK_GROESSE]
+                handler.wfile.write(block)
+                gesendet += len(block)
+                if self.durchsatz_kbs:
+                    soll = gesendet / (self.durchsatz_kbs * 1024.0)
+                    rest = soll - (time.monotonic() - start)
+                    if rest > 0:
+                        time.sleep(rest)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        with self.lock:
+            self.bytes_gesendet += gesendet
+
+
+def lese_szenarien(eintraege):
+    """Wandelt ["NRW=xml", "HE=fehler"] in ein Dict um"""
+    szenarien = {}
+    for eintrag in eintraege or []:
+        kuerzel, _, szenario = eintrag.partition("=")
+        if szenario not in SZENARIEN:
+            raise ValueError(f"Unbekanntes Szenario '{szenario}' (erlaubt: {', '.join(SZENARIEN)})")
+        szenarien[kuerzel.strip().upper()] = szenario
+    return szenarien
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokaler WFS-Ersatz mit aufgezeichneten Antworten")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(__file__), "fixtures"))
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latenz-ms", type=float, default=0)
+    parser.add_argument("--durchsatz-kbs", type=float, default=0)
+    parser.add_argument("--szenario", action="append", metavar="LAND=SZENARIO",
+                        help=f"Szenario je Kürzel, z.B. HE=fehler ({', '.join(SZENARIEN)})")
+    args = parser.parse_args()
+
+    stub = WfsStub(args.fixtures, args.latenz_ms, args.durchsatz_kbs, lese_szenarien(args.szenario), args.port)
+    stub.starte()
+    print(f"WFS-Ersatz läuft auf {stub.url('<LAND>')} (Strg+C beendet)")
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        stub.stoppe()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsRectangle,
+                       QgsMessageLog, Qgis)
+from qgis.PyQt.QtCore import QSettings
+from concurrent.futures import ThreadPoolExecutor
+from .wfs_stream import WfsStreamFehler
+import threading
+import time
+import requests
+
+
+class LaufendeAbrufe:
+    """Tabelle der laufenden Abrufe; gleiche Abrufe teilen sich einen Request
+
+    Der erste Aufrufer eines Schlüssels führt den Abruf aus, alle weiteren
+    warten auf sein Ergebnis, statt denselben Request erneut zu senden.
+    Wurde der führende Abruf abgebrochen oder ist er mit einer Ausnahme
+    gescheitert, übernimmt einer der Wartenden. Layer werden nicht geteilt:
+    teile erzeugt im Thread des Führenden eine thread-neutrale Kopie
+    (Features, Felder, KBS) für die Wartenden.
+    """
+
+    def __init__(self):
+        self.laufend = {}
+        self.lock = threading.Lock()
+
+    def fuehre_aus(self, schluessel, abruf, abgebrochen=None, teile=None):
+        """Führt abruf() einmal je Schlüssel aus und gibt (geteilt, ergebnis) zurück
+
+        geteilt ist True, wenn das Ergebnis von einem anderen Aufrufer
+        stammt; Wartende erhalten teile(ergebnis) bzw. ohne teile das
+        Ergebnis selbst. teile wird nur aufgerufen, wenn jemand wartet.
+        Bricht ein Wartender ab, erhält er (True, None).
+        """
+        while True:
+            with self.lock:
+                eintrag = self.laufend.get(schluessel)
+                if eintrag is None:
+                    eintrag = {"fertig": threading.Event(), "ergebnis": None, "wartend": 0}
+                    self.laufend[schluessel] = eintrag
+                    break
+                eintrag["wartend"] += 1
+
+            while not eintrag["fertig"].wait(0.1):
+                if abgebrochen and abgebrochen():
+                    return True, None
+            if eintrag["ergebnis"] is not None:
+                return True, eintrag["ergebnis"]
+
+        ergebnis = None
+        try:
+            ergebnis = abruf()
+            return False, ergebnis
+        finally:
+            # Nach dem Austragen kann sich niemand mehr anschließen
+            with self.lock:
+                del self.laufend[schluessel]
+            # Ohne Ergebnis übernimmt ein Wartender den Abruf
+            if eintrag["wartend"] and ergebnis is not None and not (abgebrochen and abgebrochen()):
+                try:
+                    eintrag["ergebnis"] = teile(ergebnis) if teile else ergebnis
+                except Exception as e:
+                    QgsMessageLog.logMessage(f"Ergebnis kann nicht geteilt werden: {str(e)}", "Flurstück-Suche",
+                                             Qgis.Warning)
+            eintrag["fertig"].set()
+
+
+class FlurstueckVorabruf:
+    """Lädt nach einem Treffer die umliegenden Flurstücke im Hintergrund
+
+    Nach einer erfolgreichen Einzelsuche beim WFS werden die räumlichen
+    Nachbarn (BBOX um das Flurstück, erweitert um puffer_m), die Flurstücke
+    mit benachbarten Zählern und auf Wunsch die ganze Flur abgerufen. Die
+    Flurstücke landen im Cache und im räumlichen Index, sodass
+    Folgesuchen in derselben Gegend ohne Request auskommen. Die Abrufe
+    laufen nacheinander in einem eigenen Thread und zählen nicht zu den
+    Suchmetriken.
+
+    QSettings unter alkis_suchmodul/vorabruf: aktiv (Standard aus),
+    zaehler_spanne (Standard 5, 0 = aus), puffer_m (Standard 50, 0 = aus)
+    und flur (Standard aus).
+
+    Bereits abgerufene Fluren und Zähler werden in erledigt vermerkt (mit
+    Zeitpunkt), sobald ihr Auftrag eingeplant ist; scheitert der Abruf,
+    wird der Vermerk wieder entfernt. Vermerke verfallen mit der TTL des
+    Caches, da danach auch die Einträge neu abgerufen werden müssen.
+    """
+
+    SETTINGS_PREFIX = "alkis_suchmodul/vorabruf"
+    # Weitere Treffer werden übergangen, solange so viele Vorabrufe warten
+    MAX_WARTEND = 4
+    # Höchstzahl der Vermerke in erledigt; die ältesten entfallen zuerst
+    MAX_ERLEDIGT = 20000
+
+    def __init__(self, kern):
+        self.kern = kern
+        self.pool = None
+        self.wartend = 0
+        self.erledigt = {}
+        self.beendet = False
+        self.lock = threading.Lock()
+
+    @property
+    def aktiv(self):
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/aktiv", False, type=bool)
+
+    def plane(self, anfrage, ergebnis):
+        """Plant den Vorabruf rund um ein gefundenes Flurstück; kehrt sofort zurück
+
+        ergebnis wird nur hier im aufrufenden Thread gelesen (Ausdehnung und
+        Features), nicht von den Vorabruf-Threads.
+        """
+        if self.beendet or not self.aktiv or not self.kern.cache.aktiv:
+            return
+        try:
+            auftraege = self.erstelle_auftraege(anfrage, ergebnis)
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Vorabruf nicht möglich: {str(e)}", "Flurstück-Suche", Qgis.Warning)
+            return
+        if not auftraege:
+            return
+
+        ttl = self.kern.cache.ttl_sekunden
+        with self.lock:
+            if self.beendet or self.wartend >= self.MAX_WARTEND:
+                return
+            self.raeume_erledigt(ttl)
+            # Ein anderer Thread kann dieselben Bereiche inzwischen eingeplant haben
+            auftraege = [auftrag for auftrag in auftraege
+                         if not auftrag[3] or not any(marke in self.erledigt for marke in auftrag[3])]
+            if not auftraege:
+                return
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=1)
+            self.pool.submit(self.fuehre_aus, anfrage["bundesland"], anfrage.get("profil"), auftraege)
+            self.wartend += 1
+            jetzt = time.time()
+            for auftrag in auftraege:
+                for marke in auftrag[3]:
+                    self.erledigt[marke] = jetzt
+
+    def ist_erledigt(self, marke):
+        """True, wenn der Bereich bereits abgerufen oder eingeplant ist"""
+        with self.lock:
+            return marke in self.erledigt
+
+    def raeume_erledigt(self, ttl):
+        """Entfernt verfallene Vermerke und begrenzt ihre Zahl (mit gehaltenem Lock aufrufen)"""
+        grenze = time.time() - ttl
+        for marke in [marke for marke, zeitpunkt in self.erledigt.items() if zeitpunkt < grenze]:
+            del self.erledigt[marke]
+        # Dicts behalten die Einfügereihenfolge; vorn stehen die ältesten Vermerke
+        while len(self.erledigt) > self.MAX_ERLEDIGT:
+            del self.erledigt[next(iter(self.erledigt))]
+
+    def vergiss(self, marken):
+        """Entfernt die Vermerke eines gescheiterten Auftrags"""
+        with self.lock:
+            for marke in marken:
+                self.erledigt.pop(marke, None)
+
+    def erstelle_auftraege(self, anfrage, ergebnis):
+        """Liste von (beschreibung, url, daten, marken) für die Umgebung des Flurstücks
+
+        marken sind die Vermerke für erledigt, die plane beim Einplanen setzt.
+        """
+        settings = QSettings()
+        spanne = settings.value(f"{self.SETTINGS_PREFIX}/zaehler_spanne", 5, type=int)
+        puffer = settings.value(f"{self.SETTINGS_PREFIX}/puffer_m", 50.0, type=float)
+        ganze_flur = settings.value(f"{self.SETTINGS_PREFIX}/flur", False, type=bool)
+
+        bundesland = anfrage["bundesland"]
+        cfg = self.kern.wfs_config[bundesland]
+        profil = anfrage.get("profil")
+        ausgabeformat = self.kern.ausgabeformat(bundesland)
+        flur = (bundesland, anfrage["gem_schluessel"], anfrage["flur_text"].lstrip("0"))
+        auftraege = []
+
+        if puffer > 0:
+            extent = self.umgebung(ergebnis, puffer)
+            if extent is not None:
+                url = self.kern.erstelle_bbox_url(bundesland, extent.xMinimum(), extent.yMinimum(),
+                                                  extent.xMaximum(), extent.yMaximum(), profil)
+                auftraege.append(("Nachbarn", url, None, []))
+
+        if ganze_flur and not self.ist_erledigt(flur):
+            filter_xml = self.flur_filter(anfrage, cfg)
+            url = self.kern.erstelle_seiten_url(anfrage["wfs_url"], cfg, filter_xml, 0, cfg["seiten_groesse"],
+                                                ausgabeformat, profil=profil)
+            auftraege.append(("Flur", url, None, [flur]))
+        elif spanne > 0 and not self.ist_erledigt(flur):
+            zaehler = int(anfrage["zaehler_text"])
+            if not self.ist_erledigt((flur, zaehler)):
+                bereich = range(max(1, zaehler - spanne), zaehler + spanne + 1)
+                filter_xml = self.zaehler_filter(anfrage, cfg, bereich)
+                url = self.kern.erstelle_getfeature_url(anfrage["wfs_url"], cfg, filter_xml, ausgabeformat, profil)
+                daten = None
+                if len(url) > cfg["max_url_laenge"] and cfg["post"]:
+                    url, daten = anfrage["wfs_url"], self.kern.erstelle_getfeature_post(cfg, filter_xml,
+                                                                                        ausgabeformat, profil)
+                auftraege.append(("Zähler", url, daten, [(flur, z) for z in bereich]))
+        return auftraege
+
+    def umgebung(self, ergebnis, puffer):
+        """Ausdehnung des Ergebnisses in EPSG:25832, um puffer Meter erweitert"""
+        if ergebnis.get("extent") is not None:
+            extent = QgsRectangle(ergebnis["extent"])
+        else:
+            extent = QgsRectangle()
+            extent.setMinimal()
+            for feature in ergebnis["features"]:
+                if feature.hasGeometry():
+                    extent.combineExtentWith(feature.geometry().boundingBox())
+        if extent.isEmpty():
+            return None
+
+        ziel_crs = QgsCoordinateReferenceSystem("EPSG:25832")
+        if ergebnis["crs"] != ziel_crs:
+            transform = QgsCoordinateTransform(ergebnis["crs"], ziel_crs, QgsProject.instance())
+            extent = transform.transformBoundingBox(extent)
+        extent.grow(puffer)
+        return extent
+
+    def flur_filter(self, anfrage, cfg):
+        """Filter auf die Flur des Flurstücks"""
+        if anfrage["rlp_filter"]:
+            gemarkung, flur = anfrage["rlp_filter"][:2]
+            return self.kern.erstelle_bereich_filter_rlp([("gemarkung", gemarkung), ("flur", flur)])
+        return self.kern.erstelle_bereich_filter(anfrage["gem_schluessel"] + anfrage["flur_text"].zfill(3), cfg)
+
+    def zaehler_filter(self, anfrage, cfg, zaehler):
+        """Filter auf alle Flurstücke (jeder Nenner) mit den angegebenen Zählern"""
+        if anfrage["rlp_filter"]:
+            gemarkung, flur = anfrage["rlp_filter"][:2]
+            return self.kern.erstelle_sammel_filter(
+                [{"rlp_filter": (gemarkung, flur, str(z), "")} for z in zaehler], cfg)
+        praefix = anfrage["gem_schluessel"] + anfrage["flur_text"].zfill(3)
+        return self.kern.erstelle_praefix_filter([praefix + str(z).zfill(5) for z in zaehler], cfg)
+
+    def fuehre_aus(self, bundesland, profil, auftraege):
+        """Arbeitet die Aufträge ab und legt die Flurstücke im Cache ab (Vorabruf-Thread)
+
+        Die Vermerke gescheiterter oder nicht mehr ausgeführter Aufträge
+        werden entfernt, damit spätere Treffer sie erneut einplanen.
+        """
+        offen = list(auftraege)
+        try:
+            anzahl = 0
+            while offen and not self.beendet:
+                beschreibung, url, daten, marken = offen[0]
+                try:
+                    anzahl += self.lade(bundesland, profil, url, daten)
+                    del offen[0]
+                except (WfsStreamFehler, requests.exceptions.RequestException) as e:
+                    self.vergiss(marken)
+                    del offen[0]
+                    QgsMessageLog.logMessage(f"Vorabruf {beschreibung} ({bundesland}) fehlgeschlagen: {str(e)}",
+                                             "Flurstück-Suche", Qgis.Warning)
+            QgsMessageLog.logMessage(f"Vorabruf {bundesland}: {anzahl} Flurstücke im Umfeld zwischengespeichert",
+                                     "Flurstück-Suche")
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Fehler Vorabruf: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+        finally:
+            for auftrag in offen:
+                self.vergiss(auftrag[3])
+            with self.lock:
+                self.wartend -= 1
+
+    def lade(self, bundesland, profil, url, daten):
+        """Ruft einen Auftrag ab; gibt die Anzahl zwischengespeicherter Flurstücke zurück"""
+        response = self.kern.sende_wfs_request(url, daten, bundesland=bundesland, stream_lesen=True)
+        try:
+            if response.status_code != 200:
+                raise requests.exceptions.RequestException(f"HTTP {response.status_code}")
+            success, ergebnis = self.kern.lese_antwort_stream(response, abgebrochen=lambda: self.beendet,
+                                                              profil=profil, bundesland=bundesland)
+        finally:
+            response.close()
+        if not success:
+            raise WfsStreamFehler(ergebnis)
+
+        rlp = "flstkennz" not in ergebnis["felder"].names()
+        for feature in ergebnis["features"]:
+            if rlp:
+                anfrage = {"bundesland": bundesland, "flstkennz": None, "profil": profil,
+                           "rlp_filter": (feature["gemarkung"], feature["flur"], feature["flstnrzae"],
+                                          feature["flstnrnen"])}
+            else:
+                anfrage = {"bundesland": bundesland, "flstkennz": str(feature["flstkennz"]).strip(),
+                           "rlp_filter": None, "profil": profil}
+            self.kern.cache.speichere(self.kern.cache_schluessel(anfrage), bundesland, {
+                "felder": ergebnis["felder"], "crs": ergebnis["crs"], "features": [feature]
+            })
+        self.kern.flurstueck_index.fuege_hinzu(bundesland, ergebnis["features"], ergebnis["crs"])
+        return len(ergebnis["features"])
+
+    def beende(self):
+        """Verwirft wartende Vorabrufe und bricht den laufenden ab"""
+        self.beendet = True
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
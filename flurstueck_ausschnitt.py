@@ -0,0 +1,270 @@
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsFeature, QgsField, QgsFields,
+                       QgsProject, QgsMessageLog, Qgis)
+from qgis.PyQt.QtCore import QSettings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .flurstueck_bereich import FlurstueckBereichDownload
+from .wfs_stream import WfsStreamFehler
+import math
+import threading
+import time
+import requests
+
+
+class KachelCache:
+    """Begrenzter LRU-Speicher für bereits geladene Kacheln
+
+    Schlüssel ist (Bundesland, Abfrageprofil, Kachelgröße, Spalte, Zeile); Wert das
+    Ergebnis-Dict mit Feature-Liste. Einträge verfallen nach max_alter
+    Sekunden, damit Änderungen am Kataster irgendwann ankommen.
+    """
+
+    def __init__(self, max_kacheln=256, max_alter=3600):
+        self.max_kacheln = max_kacheln
+        self.max_alter = max_alter
+        self.kacheln = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hole(self, schluessel):
+        """Gibt eine gültige Kachel zurück oder None"""
+        with self.lock:
+            eintrag = self.kacheln.get(schluessel)
+            if eintrag is None:
+                return None
+            zeitpunkt, ergebnis = eintrag
+            if time.monotonic() - zeitpunkt > self.max_alter:
+                del self.kacheln[schluessel]
+                return None
+            self.kacheln.move_to_end(schluessel)
+            return ergebnis
+
+    def speichere(self, schluessel, ergebnis):
+        """Legt eine Kachel ab und verdrängt bei Bedarf die älteste"""
+        with self.lock:
+            self.kacheln[schluessel] = (time.monotonic(), ergebnis)
+            self.kacheln.move_to_end(schluessel)
+            while len(self.kacheln) > self.max_kacheln:
+                self.kacheln.popitem(last=False)
+
+    def leere(self):
+        """Entfernt alle Kacheln"""
+        with self.lock:
+            self.kacheln.clear()
+
+
+class FlurstueckAusschnittDownload(FlurstueckBereichDownload):
+    """Lädt alle Flurstücke im Kartenausschnitt über ein festes Kachelraster
+
+    Der Ausschnitt wird in EPSG:25832 auf ein an Vielfachen der
+    Kachelgröße ausgerichtetes Raster abgebildet. Fehlende Kacheln werden
+    parallel per BBOX (seitenweise) abgerufen, vorhandene kommen aus dem
+    KachelCache des Plugins; abgeschnittene Kacheln werden nicht
+    zwischengespeichert. Flurstücke auf Kachelgrenzen werden über flstkennz (RLP:
+    Gemarkung/Flur/Zähler/Nenner) nur einmal übernommen.
+    """
+
+    SETTINGS_PREFIX = "alkis_suchmodul/kacheln"
+
+    def __init__(self, plugin, bundesland, extent, crs, max_worker=4, senke=None):
+        self.plugin = plugin
+        self.senke = senke
+        self.bundesland = bundesland
+        self.layer_name = f"{bundesland} - Flurstücke im Kartenausschnitt"
+        self.layer = None
+        self.max_worker = max_worker
+        self.profil = plugin.abfrage_profil_name("massen")
+
+        settings = QSettings()
+        self.kachel_groesse = settings.value(f"{self.SETTINGS_PREFIX}/groesse_m", 500.0, type=float)
+        self.max_kacheln = settings.value(f"{self.SETTINGS_PREFIX}/max_je_ausschnitt", 64, type=int)
+
+        ziel_crs = QgsCoordinateReferenceSystem("EPSG:25832")
+        if crs != ziel_crs:
+            extent = QgsCoordinateTransform(crs, ziel_crs, QgsProject.instance()).transformBoundingBox(extent)
+        self.extent = extent
+
+    def kacheln(self):
+        """Spalten/Zeilen der Rasterkacheln, die den Ausschnitt abdecken"""
+        g = self.kachel_groesse
+        spalten = range(math.floor(self.extent.xMinimum() / g), math.ceil(self.extent.xMaximum() / g))
+        zeilen = range(math.floor(self.extent.yMinimum() / g), math.ceil(self.extent.yMaximum() / g))
+        return [(spalte, zeile) for spalte in spalten for zeile in zeilen]
+
+    def pruefe(self):
+        """Lehnt zu große Ausschnitte vor dem Start ab"""
+        if self.extent.isEmpty():
+            return False, "Ungültiger Kartenausschnitt!"
+        anzahl = len(self.kacheln())
+        if anzahl > self.max_kacheln:
+            return False, f"Kartenausschnitt zu groß ({anzahl} Kacheln), bitte weiter hineinzoomen!"
+        return True, ""
+
+    def lade_kachel(self, kachel, abgebrochen=None):
+        """Ruft eine Kachel per BBOX seitenweise ab (Worker-Thread)
+
+        Volle Seiten werden wie beim Bereichsdownload weitergeblättert.
+        Wertet der Server STARTINDEX nicht aus, ist die Kachel an der
+        Seitengröße abgeschnitten; ergebnis["vollstaendig"] ist dann False.
+        """
+        seiten_groesse = self.plugin.wfs_config[self.bundesland]["seiten_groesse"]
+        seiten = []
+        start = 0
+        while True:
+            success, ergebnis = self.lade_kachel_seite(kachel, start, seiten_groesse, abgebrochen)
+            if not success:
+                return False, ergebnis
+            seite = ergebnis["features"]
+            if start and seite and seite[0].attributes() == seiten[0]["features"][0].attributes():
+                # Server wertet STARTINDEX nicht aus und liefert erneut die erste Seite
+                return True, dict(self.vereinige(seiten), vollstaendig=False)
+            seiten.append(ergebnis)
+            if len(seite) < seiten_groesse:
+                return True, dict(self.vereinige(seiten), vollstaendig=True)
+            if abgebrochen and abgebrochen():
+                return False, "Download abgebrochen"
+            start += seiten_groesse
+
+    def lade_kachel_seite(self, kachel, start, anzahl, abgebrochen=None):
+        """Ruft eine Ergebnisseite einer Kachel ab"""
+        g = self.kachel_groesse
+        spalte, zeile = kachel
+        url = self.plugin.erstelle_bbox_url(self.bundesland, spalte * g, zeile * g, (spalte + 1) * g, (zeile + 1) * g,
+                                            self.profil, start, anzahl)
+        response = self.plugin.sende_wfs_request(url, bundesland=self.bundesland, stream_lesen=True)
+        try:
+            if response.status_code != 200:
+                return False, f"Fehler beim Abruf: HTTP {response.status_code}"
+            success, ergebnis = self.plugin.lese_antwort_stream(response, abgebrochen=abgebrochen, profil=self.profil,
+                                                                bundesland=self.bundesland)
+        except WfsStreamFehler as e:
+            if self.bundesland in self.plugin.stream_gesperrt:
+                return False, str(e)
+            QgsMessageLog.logMessage(
+                f"Stream-Dekodierung für {self.bundesland} fehlgeschlagen, verwende Shapefile: {str(e)}",
+                "Flurstück-Suche",
+                Qgis.Warning
+            )
+            self.plugin.stream_gesperrt.add(self.bundesland)
+            return self.lade_kachel_seite(kachel, start, anzahl, abgebrochen)
+        finally:
+            response.close()
+
+        if not success and ergebnis.startswith("Keine Geometrien"):
+            return True, {"felder": None, "crs": None, "features": []}
+        return success, ergebnis
+
+    def vereinige(self, seiten):
+        """Führt die Seiten einer Kachel zu einem Ergebnis zusammen (Felder aller Seiten)"""
+        seiten = [seite for seite in seiten if seite["features"]]
+        if not seiten:
+            return {"felder": None, "crs": None, "features": []}
+        if len(seiten) == 1:
+            return seiten[0]
+
+        felder = QgsFields()
+        for seite in seiten:
+            for feld in seite["felder"]:
+                if felder.indexFromName(feld.name()) == -1:
+                    felder.append(QgsField(feld))
+        features = []
+        for seite in seiten:
+            if seite["felder"].names() == felder.names():
+                features += seite["features"]
+                continue
+            for quelle in seite["features"]:
+                feature = QgsFeature(felder)
+                feature.setGeometry(quelle.geometry())
+                for name in seite["felder"].names():
+                    feature[name] = quelle[name]
+                features.append(feature)
+        return {"felder": felder, "crs": seiten[0]["crs"], "features": features}
+
+    def fuehre_aus(self, fortschritt=None, abgebrochen=None):
+        """Lädt fehlende Kacheln und führt alle Kacheln in einem Layer zusammen"""
+        self.plugin.wende_profil_an(self.bundesland)
+        kacheln = self.kacheln()
+        ergebnisse = {}
+        fehlend = []
+        for kachel in kacheln:
+            ergebnis = self.plugin.kacheln.hole((self.bundesland, self.profil, self.kachel_groesse) + kachel)
+            if ergebnis is None:
+                fehlend.append(kachel)
+            else:
+                ergebnisse[kachel] = ergebnis
+
+        QgsMessageLog.logMessage(
+            f"Kartenausschnitt {self.bundesland}: {len(kacheln)} Kacheln, {len(fehlend)} nicht im Cache",
+            "Flurstück-Suche"
+        )
+
+        fehler = []
+        unvollstaendig = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_worker) as pool:
+                futures = {pool.submit(self.lade_kachel, kachel, abgebrochen): kachel for kachel in fehlend}
+                for erledigt, future in enumerate(as_completed(futures), 1):
+                    if abgebrochen and abgebrochen():
+                        for offen in futures:
+                            offen.cancel()
+                        return False, "Download abgebrochen"
+
+                    kachel = futures[future]
+                    success, ergebnis = future.result()
+                    if success:
+                        if ergebnis["vollstaendig"]:
+                            schluessel = (self.bundesland, self.profil, self.kachel_groesse) + kachel
+                            self.plugin.kacheln.speichere(schluessel, ergebnis)
+                        else:
+                            unvollstaendig += 1
+                        ergebnisse[kachel] = ergebnis
+                    else:
+                        fehler.append(ergebnis)
+                    if fortschritt:
+                        fortschritt(90 * erledigt / len(fehlend))
+        except requests.exceptions.Timeout:
+            return False, "Timeout: Server antwortet nicht"
+        except requests.exceptions.RequestException as e:
+            return False, f"Netzwerkfehler: {str(e)}"
+        except Exception as e:
+            if abgebrochen and abgebrochen():
+                return False, "Download abgebrochen"
+            QgsMessageLog.logMessage(f"Fehler Kartenausschnitt: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Unerwarteter Fehler: {str(e)}"
+
+        if unvollstaendig:
+            QgsMessageLog.logMessage(
+                f"Kartenausschnitt {self.bundesland}: Server unterstützt kein Blättern, "
+                f"{unvollstaendig} Kacheln nach {self.plugin.wfs_config[self.bundesland]['seiten_groesse']} "
+                f"Flurstücken abgeschnitten (nicht zwischengespeichert)",
+                "Flurstück-Suche",
+                Qgis.Warning
+            )
+
+        if fehler:
+            QgsMessageLog.logMessage(f"{len(fehler)} Kacheln fehlgeschlagen: {fehler[0]}",
+                                     "Flurstück-Suche", Qgis.Warning)
+            if not ergebnisse:
+                return False, fehler[0]
+
+        gesehen = set()
+        anzahl = 0
+        for kachel in kacheln:
+            ergebnis = ergebnisse.get(kachel)
+            if not ergebnis or not ergebnis["features"]:
+                continue
+            neue = []
+            for feature in ergebnis["features"]:
+                kennung = self.plugin.flurstueck_kennung(feature)
+                if kennung not in gesehen:
+                    gesehen.add(kennung)
+                    neue.append(feature)
+            if neue:
+                self.haenge_an(dict(ergebnis, features=neue))
+                anzahl += len(neue)
+
+        if self.leer():
+            return False, "Keine Flurstücke im Kartenausschnitt gefunden!"
+
+        if fortschritt:
+            fortschritt(100)
+        return self.schliesse_ab(anzahl)
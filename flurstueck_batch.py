@@ -0,0 +1,303 @@
+from qgis.core import (QgsVectorLayer, QgsFeature, QgsField, QgsFields, QgsMessageLog,
+                       QgsCoordinateTransform, QgsProject)
+from qgis.PyQt.QtCore import QVariant
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import csv
+
+# Spaltennamen, die in CSV-Dateien und Attributtabellen erkannt werden
+SPALTEN_ALIASE = {
+    "bundesland": ("bundesland", "land"),
+    "gemarkung": ("gemarkung", "gemarkungsname", "gemarkungsnummer"),
+    "flur": ("flur", "flurnummer"),
+    "zaehler": ("zaehler", "zähler", "flstnrzae"),
+    "nenner": ("nenner", "flstnrnen"),
+}
+
+
+class FlurstueckBatchSuche:
+    """Stapelsuche für viele Flurstücke aus CSV-Datei oder Attributtabelle
+
+    profil wählt das Abfrageprofil (siehe ABFRAGE_PROFILE); ohne Angabe gilt
+    die Einstellung alkis_suchmodul/abfrage/massen. Mit einer
+    FlurstueckDateiSenke werden die Treffer sofort in die Datei geschrieben
+    statt gesammelt, sodass der Speicherbedarf nicht mit dem Stapel wächst.
+    """
+
+    def __init__(self, plugin, max_worker=4, cache_umgehen=False, profil=None, senke=None):
+        self.plugin = plugin
+        self.max_worker = max(1, int(max_worker))
+        self.cache_umgehen = cache_umgehen
+        self.profil = profil or plugin.abfrage_profil_name("massen")
+        self.senke = senke
+
+    def ordne_spalten_zu(self, spaltennamen):
+        """Ordnet vorhandene Spalten den Suchfeldern zu"""
+        zuordnung = {}
+        normiert = {name.strip().lower(): name for name in spaltennamen if name}
+        for feld, aliase in SPALTEN_ALIASE.items():
+            for alias in aliase:
+                if alias in normiert:
+                    zuordnung[feld] = normiert[alias]
+                    break
+        return zuordnung
+
+    def lese_csv(self, csv_path, standard_bundesland):
+        """Liest Flurstücke aus einer CSV-Datei (Trennzeichen ; , oder Tab)"""
+        for encoding in ("utf-8-sig", "cp1252"):
+            try:
+                with open(csv_path, "r", encoding=encoding, newline="") as f:
+                    inhalt = f.read()
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            return False, "CSV-Datei konnte nicht gelesen werden (unbekannte Kodierung)!"
+
+        try:
+            delimiter = csv.Sniffer().sniff(inhalt[:4096], delimiters=";,\t").delimiter
+        except csv.Error:
+            delimiter = ";"
+
+        reader = csv.DictReader(inhalt.splitlines(), delimiter=delimiter)
+        zuordnung = self.ordne_spalten_zu(reader.fieldnames or [])
+
+        fehlend = [f for f in ("gemarkung", "flur", "zaehler") if f not in zuordnung]
+        if fehlend:
+            return False, f"Pflichtspalten fehlen in der CSV-Datei: {', '.join(fehlend)}"
+
+        zeilen = []
+        for nummer, row in enumerate(reader, start=1):
+            zeilen.append(self.erstelle_zeile(nummer, row, zuordnung, standard_bundesland))
+        return True, zeilen
+
+    def lese_layer(self, layer, standard_bundesland, nur_auswahl=False):
+        """Liest Flurstücke aus der Attributtabelle eines Layers"""
+        if layer is None or not layer.isValid():
+            return False, "Kein gültiger Layer ausgewählt!"
+
+        features = layer.getSelectedFeatures() if nur_auswahl else layer.getFeatures()
+        return self.lese_features(layer.fields().names(), features, standard_bundesland)
+
+    def lese_features(self, feldnamen, features, standard_bundesland):
+        """Liest Flurstücke aus Features (Layer oder Processing-Quelle)"""
+        zuordnung = self.ordne_spalten_zu(feldnamen)
+        fehlend = [f for f in ("gemarkung", "flur", "zaehler") if f not in zuordnung]
+        if fehlend:
+            return False, f"Pflichtfelder fehlen in der Attributtabelle: {', '.join(fehlend)}"
+
+        zeilen = []
+        for nummer, feature in enumerate(features, start=1):
+            row = {name: feature[name] for name in zuordnung.values()}
+            zeilen.append(self.erstelle_zeile(nummer, row, zuordnung, standard_bundesland))
+        return True, zeilen
+
+    def erstelle_zeile(self, nummer, row, zuordnung, standard_bundesland):
+        """Erstellt eine normierte Suchzeile"""
+        def wert(feld):
+            spalte = zuordnung.get(feld)
+            value = row.get(spalte) if spalte else None
+            if value is None or (hasattr(value, "isNull") and value.isNull()):
+                return ""
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            return str(value).strip()
+
+        return {
+            "zeile": nummer,
+            "bundesland": wert("bundesland") or standard_bundesland,
+            "gemarkung": wert("gemarkung"),
+            "flur": wert("flur"),
+            "zaehler": wert("zaehler"),
+            "nenner": wert("nenner"),
+        }
+
+    def fuehre_aus(self, zeilen, fortschritt=None, abgebrochen=None):
+        """Führt die Stapelsuche aus
+
+        Die Flurstücke werden je Bundesland zu Sammel-Requests mit Or-Filter
+        zusammengefasst; mehrfach aufgeführte Flurstücke werden nur einmal
+        abgerufen. Je Bundesland wird ein eigener, auf max_worker
+        begrenzter Thread-Pool verwendet, damit kein Landesdienst überlastet
+        wird. Legt keine Layer an und kann daher im Hintergrund laufen; gibt
+        die Treffer (für fuehre_treffer_zusammen, mit Senke leer) und den
+        Bericht zurück.
+        """
+        bericht = {zeile["zeile"]: dict(zeile, erfolg=False, meldung="", anzahl=0) for zeile in zeilen}
+        treffer = []
+
+        anfragen_je_land = {}
+        zeilen_zu_anfrage = {}
+        anfrage_je_schluessel = {}
+        for zeile in zeilen:
+            success, anfrage = self.plugin.bereite_anfrage_vor(zeile["bundesland"], zeile["gemarkung"],
+                                                               zeile["flur"], zeile["zaehler"], zeile["nenner"])
+            if not success:
+                bericht[zeile["zeile"]]["meldung"] = anfrage
+                continue
+            if anfrage.get("kandidaten"):
+                laender = ", ".join(kandidat["bundesland"] for kandidat in anfrage["kandidaten"])
+                bericht[zeile["zeile"]]["meldung"] = f"Gemarkung in mehreren Bundesländern ({laender}), " \
+                                                     f"bitte Bundesland angeben"
+                continue
+            anfrage["profil"] = self.profil
+
+            if not self.cache_umgehen:
+                bestand_eintrag = self.plugin.bestand.hole(anfrage)
+                if bestand_eintrag is not None:
+                    self.trage_treffer_ein(bericht, treffer, zeile, anfrage, bestand_eintrag, "OK (Bestand)")
+                    continue
+
+            cache_eintrag = self.hole_aus_cache(anfrage)
+            if cache_eintrag is not None:
+                self.trage_treffer_ein(bericht, treffer, zeile, anfrage, cache_eintrag, "OK (Cache)")
+                continue
+
+            schluessel = self.plugin.cache_schluessel(anfrage)
+            if schluessel in anfrage_je_schluessel:
+                zeilen_zu_anfrage[id(anfrage_je_schluessel[schluessel])].append(zeile)
+                continue
+            anfrage_je_schluessel[schluessel] = anfrage
+            anfragen_je_land.setdefault(anfrage["bundesland"], []).append(anfrage)
+            zeilen_zu_anfrage[id(anfrage)] = [zeile]
+
+        pools = {}
+        futures = {}
+        try:
+            for bundesland, anfragen in anfragen_je_land.items():
+                pool = ThreadPoolExecutor(max_workers=self.max_worker)
+                pools[bundesland] = pool
+                for request in self.plugin.erstelle_sammel_requests(bundesland, anfragen):
+                    futures[pool.submit(self.plugin.lade_sammel_request, request, abgebrochen)] = request
+
+            erledigt = len(zeilen) - sum(len(liste) for liste in zeilen_zu_anfrage.values())
+            if fortschritt:
+                fortschritt(erledigt, len(zeilen))
+
+            for future in as_completed(futures):
+                # Erledigte Requests freigeben, damit ihre Features nicht bis zum Ende im Speicher bleiben
+                request = futures.pop(future)
+                try:
+                    success, ergebnis = future.result()
+                except Exception as e:
+                    success, ergebnis = False, f"Unerwarteter Fehler: {str(e)}"
+                future = None
+
+                for position, anfrage in enumerate(request["anfragen"]):
+                    for zeile in zeilen_zu_anfrage[id(anfrage)]:
+                        eintrag = bericht[zeile["zeile"]]
+                        if not success:
+                            eintrag["meldung"] = ergebnis
+                            continue
+
+                        features = ergebnis["zuordnung"][position]
+                        if not features:
+                            eintrag["meldung"] = "Flurstück nicht gefunden"
+                            continue
+
+                        self.trage_treffer_ein(bericht, treffer, zeile, anfrage, {
+                            "felder": ergebnis["felder"],
+                            "crs": ergebnis["crs"],
+                            "features": features
+                        }, "OK")
+                    erledigt += len(zeilen_zu_anfrage[id(anfrage)])
+
+                if fortschritt:
+                    fortschritt(erledigt, len(zeilen))
+                if abgebrochen and abgebrochen():
+                    for offen in futures:
+                        offen.cancel()
+                    break
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+
+        for eintrag in bericht.values():
+            if not eintrag["erfolg"] and not eintrag["meldung"]:
+                eintrag["meldung"] = "Abgebrochen"
+
+        treffer.sort(key=lambda t: t[0]["zeile"])
+
+        QgsMessageLog.logMessage(
+            f"Stapelsuche beendet: {sum(1 for eintrag in bericht.values() if eintrag['erfolg'])} von {len(zeilen)} "
+            f"Flurstücken gefunden",
+            "Flurstück-Suche"
+        )
+        return treffer, [bericht[zeile["zeile"]] for zeile in zeilen]
+
+    def hole_aus_cache(self, anfrage):
+        """Liefert einen gültigen Cache-Eintrag oder None"""
+        if self.cache_umgehen or not self.plugin.cache.aktiv:
+            return None
+        eintrag = self.plugin.cache.hole(self.plugin.cache_schluessel(anfrage))
+        self.plugin.metriken.vermerke_cache(anfrage["bundesland"], eintrag is not None)
+        return eintrag
+
+    def trage_treffer_ein(self, bericht, treffer, zeile, anfrage, ergebnis, meldung):
+        """Vermerkt einen Treffer im Bericht und in der Trefferliste bzw. schreibt ihn in die Senke"""
+        eintrag = bericht[zeile["zeile"]]
+        eintrag["erfolg"] = True
+        eintrag["anzahl"] = len(ergebnis["features"])
+        eintrag["meldung"] = meldung
+        if self.senke is None:
+            treffer.append((zeile, anfrage, ergebnis))
+            return
+
+        abfrage = self.plugin.erstelle_layer_name(anfrage["bundesland"], anfrage["gem_full_name"],
+                                                  anfrage["flur_text"], anfrage["zaehler_text"],
+                                                  anfrage["nenner_text"])
+        self.senke.schreibe(ergebnis["features"], ergebnis["felder"], ergebnis["crs"], anfrage["bundesland"],
+                            abfrage, {"stapel_zeile": zeile["zeile"]})
+
+    def fuehre_treffer_zusammen(self, treffer, layer_name="Stapelsuche Flurstücke"):
+        """Führt alle Treffer in einem Memory-Layer zusammen"""
+        ziel_crs = treffer[0][2]["crs"]
+        felder = self.ausgabe_felder(treffer)
+
+        layer = QgsVectorLayer(f"Polygon?crs={ziel_crs.authid()}", layer_name, "memory")
+        provider = layer.dataProvider()
+        provider.addAttributes(felder)
+        layer.updateFields()
+
+        provider.addFeatures(list(self.ausgabe_features(treffer, layer.fields(), ziel_crs)))
+        layer.updateExtents()
+        return layer
+
+    def ausgabe_felder(self, treffer):
+        """Felder des Ergebnisses: Stapelzeile, Bundesland und alle WFS-Felder"""
+        felder = QgsFields()
+        felder.append(QgsField("stapel_zeile", QVariant.Int))
+        felder.append(QgsField("bundesland", QVariant.String))
+        for _, _, ergebnis in treffer:
+            for feld in ergebnis["felder"]:
+                if felder.indexFromName(feld.name()) == -1:
+                    felder.append(QgsField(feld))
+        return felder
+
+    def ausgabe_features(self, treffer, felder, ziel_crs):
+        """Erzeugt die Ergebnis-Features in ziel_crs"""
+        for zeile, anfrage, ergebnis in treffer:
+            transform = None
+            if ergebnis["crs"] != ziel_crs:
+                transform = QgsCoordinateTransform(ergebnis["crs"], ziel_crs, QgsProject.instance())
+
+            quell_namen = ergebnis["felder"].names()
+            for quelle in ergebnis["features"]:
+                feature = QgsFeature(felder)
+                geometrie = quelle.geometry()
+                if transform is not None:
+                    geometrie.transform(transform)
+                feature.setGeometry(geometrie)
+                feature["stapel_zeile"] = zeile["zeile"]
+                feature["bundesland"] = anfrage["bundesland"]
+                for name in quell_namen:
+                    feature[name] = quelle[name]
+                yield feature
+
+    def schreibe_bericht(self, csv_path, bericht):
+        """Schreibt den Stapelbericht als CSV-Datei"""
+        spalten = ["zeile", "bundesland", "gemarkung", "flur", "zaehler", "nenner", "erfolg", "anzahl", "meldung"]
+        with open(csv_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=spalten, delimiter=";", extrasaction="ignore")
+            writer.writeheader()
+            for eintrag in bericht:
+                writer.writerow(dict(eintrag, erfolg="ja" if eintrag["erfolg"] else "nein"))
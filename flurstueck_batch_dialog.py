@@ -0,0 +1,133 @@
+from qgis.PyQt.QtWidgets import QDialog, QFileDialog, QTableWidgetItem
+from qgis.PyQt.uic import loadUiType
+from qgis.core import QgsMapLayerProxyModel
+from .flurstueck_batch import FlurstueckBatchSuche
+from .flurstueck_export import FlurstueckDateiSenke
+from .flurstueck_task import FlurstueckBatchTask
+import os
+
+FORM_CLASS, _ = loadUiType(os.path.join(
+    os.path.dirname(__file__), 'flurstueck_batch_dialog.ui'
+))
+
+class FlurstueckBatchDialog(QDialog, FORM_CLASS):
+    """Dialog für die Stapelsuche aus CSV-Datei oder Attributtabelle"""
+
+    def __init__(self, plugin, parent=None):
+        super().__init__(parent)
+        self.plugin = plugin
+        self.bericht = []
+        self.task = None
+
+        # UI laden
+        self.setupUi(self)
+        self.layer_combo.setFilters(QgsMapLayerProxyModel.VectorLayer)
+
+        # Signal-Verbindungen
+        self.durchsuchen_button.clicked.connect(self.on_durchsuchen_clicked)
+        self.datei_button.clicked.connect(self.on_datei_clicked)
+        self.starten_button.clicked.connect(self.on_starten_clicked)
+        self.bericht_button.clicked.connect(self.on_bericht_clicked)
+        self.schliessen_button.clicked.connect(self.close)
+
+    def on_durchsuchen_clicked(self):
+        """CSV-Datei auswählen"""
+        csv_path, _ = QFileDialog.getOpenFileName(self, "CSV-Datei wählen", "", "CSV-Dateien (*.csv *.txt)")
+        if csv_path:
+            self.csv_edit.setText(csv_path)
+            self.csv_radio.setChecked(True)
+
+    def on_datei_clicked(self):
+        """Zieldatei für das Ergebnis auswählen"""
+        pfad, _ = QFileDialog.getSaveFileName(self, "Ergebnis speichern", "stapelsuche.gpkg",
+                                              "GeoPackage (*.gpkg);;FlatGeobuf (*.fgb)")
+        if pfad:
+            self.datei_edit.setText(pfad)
+            self.datei_check.setChecked(True)
+
+    def on_starten_clicked(self):
+        """Stapelsuche starten bzw. laufende Stapelsuche abbrechen"""
+        if self.task is not None:
+            self.task.cancel()
+            return
+
+        senke = None
+        if self.datei_check.isChecked():
+            try:
+                senke = FlurstueckDateiSenke(self.datei_edit.text().strip())
+            except ValueError as e:
+                self.zeige_status(str(e), "red")
+                return
+
+        batch = FlurstueckBatchSuche(self.plugin, self.worker_spin.value(), self.cache_umgehen_check.isChecked(),
+                                     senke=senke)
+        bundesland = self.bundesland_combo.currentText()
+
+        if self.csv_radio.isChecked():
+            success, zeilen = batch.lese_csv(self.csv_edit.text().strip(), bundesland)
+        else:
+            success, zeilen = batch.lese_layer(self.layer_combo.currentLayer(), bundesland,
+                                               self.nur_auswahl_check.isChecked())
+
+        if not success:
+            self.zeige_status(zeilen, "red")
+            return
+        if not zeilen:
+            self.zeige_status("Keine Flurstücke in der Quelle gefunden!", "red")
+            return
+
+        # Suche im Hintergrund starten
+        self.fortschritt_bar.setValue(0)
+        self.bericht_button.setEnabled(False)
+        self.zeige_status(f"Stapelsuche läuft ({len(zeilen)} Flurstücke)...", "#666")
+
+        self.task = FlurstueckBatchTask(batch, zeilen, self.on_batch_fertig)
+        self.task.progressChanged.connect(lambda wert: self.fortschritt_bar.setValue(int(wert)))
+        self.starten_button.setText("Abbrechen")
+        self.plugin.registriere_task(self.task)
+
+    def on_batch_fertig(self, layer, bericht, abgebrochen):
+        """Ergebnis der Stapelsuche anzeigen"""
+        self.task = None
+        self.starten_button.setText("Starten")
+        self.bericht = bericht
+
+        self.zeige_bericht(self.bericht)
+        self.bericht_button.setEnabled(bool(self.bericht))
+
+        gefunden = sum(1 for eintrag in self.bericht if eintrag["erfolg"])
+        if abgebrochen:
+            self.zeige_status(f"Stapelsuche abgebrochen ({gefunden} Flurstücke geladen)", "red")
+        elif layer is not None:
+            self.zeige_status(f"{gefunden} von {len(self.bericht)} Flurstücken geladen", "green")
+        else:
+            self.zeige_status("Keines der Flurstücke wurde gefunden!", "red")
+
+    def zeige_bericht(self, bericht):
+        """Bericht in der Tabelle anzeigen"""
+        self.bericht_table.setRowCount(len(bericht))
+        for row, eintrag in enumerate(bericht):
+            flurstueck = eintrag["zaehler"]
+            if eintrag["nenner"]:
+                flurstueck += f"/{eintrag['nenner']}"
+            werte = [eintrag["zeile"], eintrag["bundesland"], eintrag["gemarkung"], eintrag["flur"],
+                     flurstueck, eintrag["anzahl"], eintrag["meldung"]]
+            for column, wert in enumerate(werte):
+                self.bericht_table.setItem(row, column, QTableWidgetItem(str(wert)))
+        self.bericht_table.resizeColumnsToContents()
+
+    def on_bericht_clicked(self):
+        """Bericht als CSV exportieren"""
+        csv_path, _ = QFileDialog.getSaveFileName(self, "Bericht speichern", "stapelbericht.csv", "CSV-Dateien (*.csv)")
+        if not csv_path:
+            return
+        try:
+            FlurstueckBatchSuche(self.plugin).schreibe_bericht(csv_path, self.bericht)
+            self.zeige_status(f"Bericht gespeichert: {csv_path}", "green")
+        except OSError as e:
+            self.zeige_status(f"Bericht konnte nicht gespeichert werden: {str(e)}", "red")
+
+    def zeige_status(self, text, farbe):
+        """Statusmeldung anzeigen"""
+        self.status_label.setText(text)
+        self.status_label.setStyleSheet(f"color: {farbe}; font-style: italic;")
@@ -0,0 +1,242 @@
+from qgis.core import QgsVectorLayer, QgsFeature, QgsField, QgsMessageLog, Qgis
+from concurrent.futures import ThreadPoolExecutor
+from .wfs_stream import WfsStreamFehler, verschiebe_in_hauptthread
+import re
+import requests
+
+
+class FlurstueckBereichDownload:
+    """Lädt alle Flurstücke einer Flur oder Gemarkung seitenweise
+
+    Die Seiten werden mit COUNT/STARTINDEX (WFS 2.0) bzw. MAXFEATURES
+    (WFS 1.1) abgerufen. Während eine Seite in den Layer geschrieben wird,
+    lädt und dekodiert ein zweiter Thread bereits die nächste; es liegen
+    höchstens zwei Seiten im Speicher, unabhängig von der Größe des Gebiets.
+    Mit einer FlurstueckDateiSenke werden die Seiten statt in einen
+    Memory-Layer direkt in die Datei geschrieben.
+    """
+
+    def __init__(self, plugin, anfrage, seiten_groesse=None, senke=None):
+        self.plugin = plugin
+        self.senke = senke
+        self.anfrage = anfrage
+        self.bundesland = anfrage["bundesland"]
+        self.feste_seiten_groesse = seiten_groesse
+        self.seiten_groesse = seiten_groesse or plugin.wfs_config[self.bundesland]["seiten_groesse"]
+        self.layer_name = plugin.erstelle_bereich_layer_name(anfrage)
+        self.layer = None
+
+    def seiten_url(self, start=0, nur_anzahl=False):
+        """URL einer Ergebnisseite"""
+        return self.plugin.erstelle_seiten_url(self.anfrage["wfs_url"], self.plugin.wfs_config[self.bundesland],
+                                               self.anfrage["filter_xml"], start, self.seiten_groesse,
+                                               self.plugin.ausgabeformat(self.bundesland), nur_anzahl,
+                                               self.anfrage.get("profil"))
+
+    def zaehle(self, abgebrochen=None):
+        """Trefferzahl per resultType=hits; None, wenn der Server sie nicht liefert"""
+        try:
+            response = self.plugin.sende_wfs_request(self.seiten_url(nur_anzahl=True), abgebrochen=abgebrochen,
+                                                     bundesland=self.bundesland)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+
+        treffer = re.search(rb'number(?:Matched|OfFeatures)="(\d+)"', response.content[:4096])
+        return int(treffer.group(1)) if treffer else None
+
+    def lade_seite(self, start, abgebrochen=None):
+        """Lädt und dekodiert eine Seite (läuft im Vorlade-Thread)"""
+        response = self.plugin.sende_wfs_request(self.seiten_url(start), bundesland=self.bundesland,
+                                                 stream_lesen=True)
+        try:
+            if response.status_code != 200:
+                return False, f"Fehler beim Abruf: HTTP {response.status_code}"
+            success, ergebnis = self.plugin.lese_antwort_stream(response, abgebrochen=abgebrochen,
+                                                                profil=self.anfrage.get("profil"),
+                                                                bundesland=self.bundesland)
+        finally:
+            response.close()
+
+        if not success and ergebnis.startswith("Keine Geometrien"):
+            return True, {"felder": None, "crs": None, "features": []}
+        return success, ergebnis
+
+    def haenge_an(self, ergebnis):
+        """Schreibt die Features einer Seite in den Ergebnis-Layer bzw. die Senke"""
+        if self.senke is not None:
+            self.senke.schreibe(ergebnis["features"], ergebnis["felder"], ergebnis["crs"], self.bundesland,
+                                self.layer_name)
+            return
+
+        if self.layer is None:
+            self.layer = QgsVectorLayer(f"MultiPolygon?crs={ergebnis['crs'].authid()}", self.layer_name, "memory")
+
+        provider = self.layer.dataProvider()
+        neue_felder = [QgsField(feld) for feld in ergebnis["felder"]
+                       if self.layer.fields().indexFromName(feld.name()) == -1]
+        if neue_felder:
+            provider.addAttributes(neue_felder)
+            self.layer.updateFields()
+
+        quell_namen = ergebnis["felder"].names()
+        features = []
+        for quelle in ergebnis["features"]:
+            feature = QgsFeature(self.layer.fields())
+            geometrie = quelle.geometry()
+            geometrie.convertToMultiType()
+            feature.setGeometry(geometrie)
+            for name in quell_namen:
+                feature[name] = quelle[name]
+            features.append(feature)
+        provider.addFeatures(features)
+
+    def leer(self):
+        """True, solange noch kein Flurstück geschrieben wurde"""
+        if self.senke is not None:
+            return not self.senke.anzahl
+        return self.layer is None
+
+    def stelle_fertig(self, anzahl):
+        """Stellt den Ergebnis-Layer fertig (bei einer Senke die geschriebene Datei), ohne ihn abzugeben"""
+        if self.senke is not None:
+            self.senke.schliesse()
+            self.layer = self.senke.als_layer(self.layer_name)
+        else:
+            self.layer.updateExtents()
+        return True, {"layer": self.layer, "anzahl": anzahl}
+
+    def schliesse_ab(self, anzahl):
+        """Stellt den Ergebnis-Layer fertig und übergibt ihn an den Hauptthread"""
+        success, ergebnis = self.stelle_fertig(anzahl)
+        verschiebe_in_hauptthread(self.layer)
+        return success, ergebnis
+
+    def teile_ergebnis(self, ergebnis):
+        """Thread-neutrale Kopie des Ergebnisses für wartende Downloads (im eigenen Thread)"""
+        success, ergebnis = ergebnis
+        if not success:
+            return success, ergebnis
+        layer = ergebnis["layer"]
+        return True, {"felder": layer.fields(), "crs": layer.crs(), "features": list(layer.getFeatures()),
+                      "anzahl": ergebnis["anzahl"]}
+
+    def fuehre_aus(self, fortschritt=None, abgebrochen=None):
+        """Lädt alle Seiten in einen Memory-Layer
+
+        Gibt (True, ergebnis) mit "layer" und "anzahl" oder (False, meldung)
+        zurück. Ist die Gemarkung im lokalen Bestand, wird der Layer daraus
+        gefüllt. Lädt gerade ein anderer Download denselben Bereich, wird
+        dessen Ergebnis kopiert statt erneut abgerufen.
+        """
+        bestand = self.plugin.bestand.hole_bereich(self.bundesland, self.anfrage["gem_schluessel"],
+                                                   self.anfrage["flur_text"])
+        if bestand is not None:
+            self.haenge_an(bestand)
+            return self.schliesse_ab(len(bestand["features"]))
+
+        schluessel = ("bereich", self.bundesland, self.anfrage["gem_schluessel"], self.anfrage["flur_text"],
+                      self.anfrage.get("profil"))
+        # Den Layer gibt der Führende erst ab, nachdem er die Wartenden bedient hat
+        geteilt, ergebnis = self.plugin.laufende_abrufe.fuehre_aus(
+            schluessel, lambda: self.lade_vom_wfs(fortschritt, abgebrochen), abgebrochen, self.teile_ergebnis)
+        if ergebnis is None:
+            return False, "Download abgebrochen"
+        success, ergebnis = ergebnis
+        if not success:
+            return success, ergebnis
+        if not geteilt:
+            verschiebe_in_hauptthread(self.layer)
+            return success, ergebnis
+
+        QgsMessageLog.logMessage(f"Laufenden Download mitgenutzt: {self.layer_name}", "Flurstück-Suche")
+        self.haenge_an(ergebnis)
+        return self.schliesse_ab(ergebnis["anzahl"])
+
+    def lade_vom_wfs(self, fortschritt=None, abgebrochen=None):
+        """Seitenweiser Download beim WFS
+
+        Liefert das Stream-Format Fehler, wird einmalig mit Shapefile-Ausgabe
+        neu begonnen.
+        """
+        # Das Profil des Endpunkts kann die Seitengröße begrenzen
+        if self.plugin.wende_profil_an(self.bundesland) and not self.feste_seiten_groesse:
+            self.seiten_groesse = self.plugin.wfs_config[self.bundesland]["seiten_groesse"]
+        try:
+            return self.lade_alle_seiten(fortschritt, abgebrochen)
+        except WfsStreamFehler as e:
+            if not self.leer() or self.bundesland in self.plugin.stream_gesperrt:
+                return False, str(e)
+            QgsMessageLog.logMessage(
+                f"Stream-Dekodierung für {self.bundesland} fehlgeschlagen, verwende Shapefile: {str(e)}",
+                "Flurstück-Suche",
+                Qgis.Warning
+            )
+            self.plugin.stream_gesperrt.add(self.bundesland)
+            return self.lade_vom_wfs(fortschritt, abgebrochen)
+        except requests.exceptions.Timeout:
+            return False, "Timeout: Server antwortet nicht"
+        except requests.exceptions.RequestException as e:
+            return False, f"Netzwerkfehler: {str(e)}"
+        except Exception as e:
+            if abgebrochen and abgebrochen():
+                return False, "Download abgebrochen"
+            QgsMessageLog.logMessage(f"Fehler Bereichsdownload: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Unerwarteter Fehler: {str(e)}"
+
+    def lade_alle_seiten(self, fortschritt=None, abgebrochen=None):
+        """Seitenschleife mit Vorladen der jeweils nächsten Seite"""
+        gesamt = self.zaehle(abgebrochen)
+        if gesamt == 0:
+            return False, "Keine Flurstücke gefunden!"
+        QgsMessageLog.logMessage(f"Bereichsdownload {self.layer_name}: {gesamt if gesamt is not None else '?'} "
+                                 f"Flurstücke, Seitengröße {self.seiten_groesse}", "Flurstück-Suche")
+
+        anzahl = 0
+        erstes = None
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            start = 0
+            zukunft = pool.submit(self.lade_seite, start, abgebrochen)
+            while zukunft is not None:
+                success, ergebnis = zukunft.result()
+                if not success:
+                    return False, ergebnis
+
+                # Die nächste Seite lädt, während diese geschrieben wird. Ohne
+                # bekannte Trefferzahl endet die Schleife an der ersten
+                # unvollständigen Seite.
+                seite = ergebnis["features"]
+                naechster = start + self.seiten_groesse
+                zukunft = None
+                if len(seite) >= self.seiten_groesse and (gesamt is None or naechster < gesamt):
+                    if abgebrochen and abgebrochen():
+                        return False, "Download abgebrochen"
+                    zukunft = pool.submit(self.lade_seite, naechster, abgebrochen)
+
+                if seite:
+                    kennung = seite[0].attributes()
+                    if start and kennung == erstes:
+                        # Server wertet STARTINDEX nicht aus und liefert erneut die erste Seite
+                        QgsMessageLog.logMessage(
+                            f"{self.bundesland}: Server unterstützt kein Blättern, "
+                            f"nur die ersten {anzahl} Flurstücke geladen",
+                            "Flurstück-Suche",
+                            Qgis.Warning
+                        )
+                        if zukunft is not None:
+                            zukunft.cancel()
+                        break
+                    if not start:
+                        erstes = kennung
+                    self.haenge_an(ergebnis)
+                    anzahl += len(seite)
+
+                if fortschritt and gesamt:
+                    fortschritt(min(100, 100 * anzahl / gesamt))
+                start = naechster
+                ergebnis = seite = None
+
+        if self.leer():
+            return False, "Keine Flurstücke gefunden!"
+        return self.stelle_fertig(anzahl)
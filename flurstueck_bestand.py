@@ -0,0 +1,451 @@
+from qgis.core import QgsApplication, QgsCoordinateReferenceSystem, QgsFeature, QgsGeometry, QgsMessageLog, Qgis
+from qgis.PyQt.QtCore import QSettings, QVariant
+from osgeo import ogr, osr
+from .flurstueck_cache import erstelle_felder
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+TABELLE = "flurstuecke"
+BESTAND_EPSG = 25832
+
+# OGR-Feldtyp -> QVariant-Typ der Ergebnisfelder (alles andere als Text)
+OGR_TYPEN = {
+    ogr.OFTInteger: QVariant.Int,
+    ogr.OFTInteger64: QVariant.LongLong,
+    ogr.OFTReal: QVariant.Double,
+}
+
+# Größe der Envelope im GeoPackage-Geometriekopf je Indikator (Bits 1-3 der Flags)
+ENVELOPE_GROESSE = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def zerlege_kennzeichen(flstkennz):
+    """(gemaschl, flur, zaehler, nenner) aus einem Flurstückskennzeichen oder None
+
+    Akzeptiert die Form der ALKIS-Daten (Nenner vierstellig, mit _
+    aufgefüllt) ebenso wie die des Plugins (/Nenner).
+    """
+    treffer = re.match(r"^(\d{6})(\d{3})(\d{5})/?(\d*)_*$", (flstkennz or "").strip())
+    return treffer.groups() if treffer else None
+
+
+def sql_text(wert):
+    """Zeichenkette als SQL-Literal (für OGR-Filter und ExecuteSQL, die keine Parameter kennen)"""
+    return "'" + str(wert).replace("'", "''") + "'"
+
+
+def pruefe_gemaschl(gemaschl):
+    """Gibt einen sechsstelligen Gemarkungsschlüssel zurück; sonst ValueError"""
+    if not re.fullmatch(r"\d{6}", gemaschl or ""):
+        raise ValueError(f"Ungültiger Gemarkungsschlüssel: {gemaschl!r}")
+    return gemaschl
+
+
+def erstelle_kennung(gemaschl, flur, zaehler, nenner):
+    """Vergleichsschlüssel eines Flurstücks, unabhängig von führenden Nullen"""
+    nenner = str(int(nenner)) if nenner and int(nenner) else ""
+    return f"{gemaschl}|{int(flur)}|{int(zaehler)}|{nenner}"
+
+
+def wkb_aus_gpkg(blob):
+    """WKB aus einer GeoPackage-Geometrie (Kopf und Envelope entfernen)"""
+    envelope = ENVELOPE_GROESSE[(blob[3] >> 1) & 0x07]
+    return bytes(blob[8 + envelope:])
+
+
+class FlurstueckBestand:
+    """Lokaler Flurstücksbestand aus den Massendaten der Länder (GeoPackage)
+
+    NRW und Niedersachsen stellen ALKIS-vereinfacht vollständig zum
+    Download bereit. importiere liest eine solche Datei (GeoPackage,
+    Shapefile, GML, auch als ZIP) Feature für Feature in ein lokales
+    GeoPackage mit Indizes auf Kennung sowie Gemarkung/Flur und R-Tree.
+    Suchen fragen den Bestand vor dem Cache und dem WFS ab; ohne Treffer
+    geht es wie bisher weiter.
+
+    Beim erneuten Import werden nur Gemarkungen ersetzt, deren Prüfsumme
+    sich geändert hat. Abschaltbar über alkis_suchmodul/bestand/aktiv.
+    """
+
+    SETTINGS_PREFIX = "alkis_suchmodul/bestand"
+
+    def __init__(self, pfad=None):
+        if pfad is None:
+            pfad = QSettings().value(f"{self.SETTINGS_PREFIX}/pfad", "")
+        if not pfad:
+            verzeichnis = os.path.join(QgsApplication.qgisSettingsDirPath(), "alkis_suchmodul")
+            os.makedirs(verzeichnis, exist_ok=True)
+            pfad = os.path.join(verzeichnis, "flurstueck_bestand.gpkg")
+
+        self.pfad = pfad
+        self.lokal = threading.local()
+        self.lock = threading.Lock()
+        self.verbindungen = []
+        self.felder = {}
+
+    @property
+    def aktiv(self):
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/aktiv", True, type=bool)
+
+    def verbindung(self):
+        """Lesende SQLite-Verbindung des aktuellen Threads; None ohne Bestand"""
+        con = getattr(self.lokal, "con", None)
+        if con is None:
+            if not os.path.exists(self.pfad):
+                return None
+            con = sqlite3.connect(f"file:{urllib.parse.quote(self.pfad)}?mode=ro", uri=True, timeout=10,
+                                  check_same_thread=False)
+            self.lokal.con = con
+            with self.lock:
+                self.verbindungen.append(con)
+        return con
+
+    def schliesse(self):
+        """Schließt die Verbindungen aller Threads (erst, wenn keine Zugriffe mehr laufen)"""
+        with self.lock:
+            verbindungen, self.verbindungen = self.verbindungen, []
+        for con in verbindungen:
+            con.close()
+        self.lokal = threading.local()
+
+    def felder_fuer(self, con, bundesland):
+        """Ergebnisfelder eines Bundeslands (Felder der zuletzt importierten Datei)
+
+        Der Eintrag in bestand_laender wird bei jedem Aufruf gelesen, damit
+        ein Import über eine andere Instanz (z.B. Processing) sofort gilt;
+        nur das Erzeugen der Felder wird je Import zwischengespeichert.
+        Ohne Eintrag (noch nicht importiert) wird nichts gespeichert.
+        """
+        row = con.execute("SELECT importiert, felder FROM bestand_laender WHERE bundesland = ?",
+                          (bundesland,)).fetchone()
+        if row is None:
+            return erstelle_felder("[]")
+        with self.lock:
+            eintrag = self.felder.get(bundesland)
+        if eintrag is not None and eintrag[0] == row:
+            return eintrag[1]
+        felder = erstelle_felder(row[1])
+        with self.lock:
+            self.felder[bundesland] = (row, felder)
+        return felder
+
+    def lese(self, bundesland, bedingung, parameter):
+        """Flurstücke zur SQL-Bedingung als Ergebnis-Dict; None ohne Treffer"""
+        if not self.aktiv:
+            return None
+        con = self.verbindung()
+        if con is None:
+            return None
+
+        try:
+            rows = con.execute(f"SELECT geom, attribute FROM {TABELLE} WHERE {bedingung}", parameter).fetchall()
+            if not rows:
+                return None
+            felder = self.felder_fuer(con, bundesland)
+        except sqlite3.Error as e:
+            QgsMessageLog.logMessage(f"Bestand-Lesefehler: {str(e)}", "Flurstück-Suche", Qgis.Warning)
+            return None
+
+        features = []
+        for geom, attribute in rows:
+            feature = QgsFeature(felder)
+            geometrie = QgsGeometry()
+            geometrie.fromWkb(wkb_aus_gpkg(geom))
+            feature.setGeometry(geometrie)
+            for name, wert in json.loads(attribute).items():
+                index = felder.indexFromName(name)
+                if index >= 0:
+                    feature.setAttribute(index, wert)
+            features.append(feature)
+
+        return {
+            "felder": felder,
+            "crs": QgsCoordinateReferenceSystem(f"EPSG:{BESTAND_EPSG}"),
+            "features": features,
+            "quelle": "bestand"
+        }
+
+    def hole(self, anfrage):
+        """Flurstück einer vorbereiteten Anfrage aus dem Bestand oder None"""
+        try:
+            kennung = erstelle_kennung(anfrage["gem_schluessel"], anfrage["flur_text"], anfrage["zaehler_text"],
+                                       anfrage["nenner_text"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return self.lese(anfrage["bundesland"], "kennung = ?", (kennung,))
+
+    def hole_bereich(self, bundesland, gemaschl, flur_text=""):
+        """Alle Flurstücke einer Gemarkung bzw. Flur aus dem Bestand oder None"""
+        if flur_text:
+            return self.lese(bundesland, "bundesland = ? AND gemaschl = ? AND flur = ?",
+                             (bundesland, gemaschl, int(flur_text)))
+        return self.lese(bundesland, "bundesland = ? AND gemaschl = ?", (bundesland, gemaschl))
+
+    def hole_punkt(self, bundesland, x, y):
+        """Flurstücke, deren Rechteck den Punkt (EPSG:25832) enthält (über den R-Tree)"""
+        return self.lese(bundesland, f"bundesland = ? AND fid IN (SELECT id FROM rtree_{TABELLE}_geom "
+                                     f"WHERE minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?)",
+                         (bundesland, x, x, y, y))
+
+    def oeffne_ziel(self):
+        """Öffnet das GeoPackage zum Schreiben und legt fehlende Tabellen und Indizes an"""
+        if os.path.exists(self.pfad):
+            ziel = ogr.Open(self.pfad, update=1)
+        else:
+            ziel = ogr.GetDriverByName("GPKG").CreateDataSource(self.pfad)
+        if ziel is None:
+            raise RuntimeError(f"{self.pfad} kann nicht geschrieben werden")
+
+        if ziel.GetLayerByName(TABELLE) is None:
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(BESTAND_EPSG)
+            layer = ziel.CreateLayer(TABELLE, srs, ogr.wkbMultiPolygon,
+                                     ["GEOMETRY_NAME=geom", "FID=fid", "SPATIAL_INDEX=YES"])
+            for name, typ in (("bundesland", ogr.OFTString), ("gemaschl", ogr.OFTString), ("flur", ogr.OFTInteger),
+                              ("kennung", ogr.OFTString), ("flstkennz", ogr.OFTString),
+                              ("attribute", ogr.OFTString)):
+                layer.CreateField(ogr.FieldDefn(name, typ))
+            ziel.ExecuteSQL(f"CREATE INDEX {TABELLE}_kennung ON {TABELLE} (kennung)")
+            ziel.ExecuteSQL(f"CREATE INDEX {TABELLE}_bereich ON {TABELLE} (bundesland, gemaschl, flur)")
+
+        for tabelle, felder in (("bestand_gemarkungen", ("bundesland", "gemaschl", "pruefsumme", "anzahl",
+                                                          "importiert")),
+                                ("bestand_laender", ("bundesland", "felder", "quelle", "importiert"))):
+            if ziel.GetLayerByName(tabelle) is None:
+                layer = ziel.CreateLayer(tabelle, None, ogr.wkbNone)
+                for name in felder:
+                    layer.CreateField(ogr.FieldDefn(name, ogr.OFTInteger if name == "anzahl" else ogr.OFTString))
+        return ziel
+
+    def waehle_layer(self, quelle, layer_name=None):
+        """Flurstücks-Ebene der Quelle: die genannte oder die erste mit dem Feld flstkennz"""
+        if layer_name:
+            return quelle.GetLayerByName(layer_name)
+        kandidaten = []
+        for i in range(quelle.GetLayerCount()):
+            layer = quelle.GetLayerByIndex(i)
+            defn = layer.GetLayerDefn()
+            namen = [defn.GetFieldDefn(j).GetName().lower() for j in range(defn.GetFieldCount())]
+            if "flstkennz" in namen:
+                kandidaten.append(layer)
+        kandidaten.sort(key=lambda layer: "flurstueck" not in layer.GetName().lower())
+        return kandidaten[0] if kandidaten else None
+
+    def lese_quelle(self, layer, feldnamen, kennz_index):
+        """Liefert je Feature (teile, flstkennz, geometrie, attribute_json); None für unbrauchbare Features"""
+        layer.ResetReading()
+        for feature in layer:
+            flstkennz = feature.GetFieldAsString(kennz_index)
+            teile = zerlege_kennzeichen(flstkennz)
+            geometrie = feature.GetGeometryRef()
+            if teile is None or geometrie is None:
+                yield None
+                continue
+            attribute = {name: feature.GetField(i) for i, name in enumerate(feldnamen)
+                         if feature.IsFieldSetAndNotNull(i)}
+            yield (teile, flstkennz.strip(), geometrie.Clone(),
+                   json.dumps(attribute, ensure_ascii=False, default=str, separators=(",", ":")))
+
+    def importiere(self, quelle_pfad, bundesland, layer_name=None, entferne_fehlende=False, fortschritt=None,
+                   abgebrochen=None):
+        """Importiert eine Massendaten-Datei eines Bundeslands in den Bestand
+
+        Zwei Durchläufe über die Quelle, beide ohne sie ganz in den Speicher
+        zu laden: zuerst Prüfsummen je Gemarkung, dann werden nur geänderte
+        Gemarkungen gelöscht und neu geschrieben (in einer Transaktion). Mit
+        entferne_fehlende werden Gemarkungen des Lands, die in der Datei
+        fehlen, aus dem Bestand entfernt. Gibt (True, statistik) oder
+        (False, meldung) zurück; fortschritt erhält Werte von 0 bis 100.
+        """
+        if quelle_pfad.lower().endswith(".zip") and not quelle_pfad.startswith("/vsizip/"):
+            quelle_pfad = "/vsizip/" + quelle_pfad
+        quelle = ogr.Open(quelle_pfad)
+        if quelle is None:
+            return False, f"Datei kann nicht gelesen werden: {quelle_pfad}"
+        layer = self.waehle_layer(quelle, layer_name)
+        if layer is None:
+            return False, "Keine Flurstücksebene mit dem Feld flstkennz gefunden!"
+
+        defn = layer.GetLayerDefn()
+        feld_defns = [defn.GetFieldDefn(i) for i in range(defn.GetFieldCount())]
+        feldnamen = [feld.GetName() for feld in feld_defns]
+        kennz_index = [name.lower() for name in feldnamen].index("flstkennz")
+        gesamt = layer.GetFeatureCount(0)
+
+        start = time.time()
+        ziel = self.oeffne_ziel()
+        try:
+            # Durchlauf 1: Prüfsumme je Gemarkung, unabhängig von der Reihenfolge der Features
+            pruefsummen = {}
+            anzahl = {}
+            gelesen = 0
+            uebersprungen = 0
+            for eintrag in self.lese_quelle(layer, feldnamen, kennz_index):
+                gelesen += 1
+                if eintrag is None:
+                    uebersprungen += 1
+                    continue
+                teile, flstkennz, geometrie, attribute = eintrag
+                digest = hashlib.sha1(flstkennz.encode("utf-8") + geometrie.ExportToWkb() + attribute.encode("utf-8"))
+                gemaschl = teile[0]
+                pruefsummen[gemaschl] = (pruefsummen.get(gemaschl, 0) + int.from_bytes(digest.digest(), "big")) \
+                    % (1 << 160)
+                anzahl[gemaschl] = anzahl.get(gemaschl, 0) + 1
+                if gelesen % 1000 == 0:
+                    if abgebrochen and abgebrochen():
+                        return False, "Import abgebrochen"
+                    if fortschritt and gesamt > 0:
+                        fortschritt(min(50, 50 * gelesen / gesamt))
+
+            if not pruefsummen:
+                return False, "Die Datei enthält keine Flurstücke mit gültigem flstkennz!"
+
+            vorhanden = {}
+            bestand_gemarkungen = ziel.GetLayerByName("bestand_gemarkungen")
+            bestand_gemarkungen.SetAttributeFilter(f"bundesland = {sql_text(bundesland)}")
+            for feature in bestand_gemarkungen:
+                vorhanden[feature.GetField("gemaschl")] = (feature.GetField("pruefsumme"), feature.GetField("anzahl"))
+            bestand_gemarkungen.SetAttributeFilter(None)
+
+            neu = {gemaschl: (f"{summe:040x}", anzahl[gemaschl]) for gemaschl, summe in pruefsummen.items()}
+            geaendert = {gemaschl for gemaschl, wert in neu.items() if vorhanden.get(gemaschl) != wert}
+            entfernt = set(vorhanden) - set(neu) if entferne_fehlende else set()
+            statistik = {
+                "bundesland": bundesland,
+                "gemarkungen": len(neu),
+                "geaendert": len(geaendert),
+                "entfernt": len(entfernt),
+                "flurstuecke": 0,
+                "uebersprungen": uebersprungen,
+            }
+
+            felder = [[feld.GetName(), int(OGR_TYPEN.get(feld.GetType(), QVariant.String)), "", feld.GetWidth(),
+                       feld.GetPrecision()] for feld in feld_defns]
+            land = (felder, os.path.basename(quelle_pfad))
+            if geaendert or entfernt:
+                self.schreibe(ziel, layer, feldnamen, kennz_index, bundesland, geaendert | entfernt, geaendert, neu,
+                              sum(anzahl[g] for g in geaendert), statistik, fortschritt, abgebrochen, land)
+                if abgebrochen and abgebrochen():
+                    return False, "Import abgebrochen"
+            else:
+                ziel.StartTransaction()
+                try:
+                    self.schreibe_land(ziel, bundesland, *land)
+                except Exception:
+                    ziel.RollbackTransaction()
+                    raise
+                ziel.CommitTransaction()
+        finally:
+            ziel = None
+            quelle = None
+
+        with self.lock:
+            self.felder.clear()
+        if fortschritt:
+            fortschritt(100)
+
+        QgsMessageLog.logMessage(
+            f"Bestand {bundesland}: {statistik['geaendert']} von {statistik['gemarkungen']} Gemarkungen neu, "
+            f"{statistik['entfernt']} entfernt, {statistik['flurstuecke']} Flurstücke geschrieben "
+            f"({time.time() - start:.1f} s)",
+            "Flurstück-Suche"
+        )
+        return True, statistik
+
+    def schreibe_land(self, ziel, bundesland, felder, quelle):
+        """Ersetzt den Eintrag des Bundeslands in bestand_laender (innerhalb der laufenden Transaktion)"""
+        ziel.ExecuteSQL(f"DELETE FROM bestand_laender WHERE bundesland = {sql_text(bundesland)}")
+        laender = ziel.GetLayerByName("bestand_laender")
+        land = ogr.Feature(laender.GetLayerDefn())
+        land.SetField("bundesland", bundesland)
+        land.SetField("felder", json.dumps(felder))
+        land.SetField("quelle", quelle)
+        land.SetField("importiert", time.strftime("%Y-%m-%dT%H:%M:%S"))
+        laender.CreateFeature(land)
+
+    def schreibe(self, ziel, layer, feldnamen, kennz_index, bundesland, loeschen, geaendert, neu, gesamt, statistik,
+                 fortschritt=None, abgebrochen=None, land=None):
+        """Durchlauf 2: ersetzt die Gemarkungen in loeschen durch die Features der geänderten
+
+        land ist (felder, quelle) für bestand_laender; der Eintrag wird in
+        derselben Transaktion geschrieben, damit er nie von den Daten abweicht.
+        """
+        ziel_layer = ziel.GetLayerByName(TABELLE)
+        ziel_defn = ziel_layer.GetLayerDefn()
+        gemarkungen = ziel.GetLayerByName("bestand_gemarkungen")
+
+        transformation = None
+        quell_srs = layer.GetSpatialRef()
+        if quell_srs is not None:
+            ziel_srs = osr.SpatialReference()
+            ziel_srs.ImportFromEPSG(BESTAND_EPSG)
+            quell_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            ziel_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            if not quell_srs.IsSame(ziel_srs):
+                transformation = osr.CoordinateTransformation(quell_srs, ziel_srs)
+
+        ziel.StartTransaction()
+        try:
+            for gemaschl in sorted(loeschen):
+                bedingung = f"bundesland = {sql_text(bundesland)} AND gemaschl = {sql_text(pruefe_gemaschl(gemaschl))}"
+                ziel.ExecuteSQL(f"DELETE FROM {TABELLE} WHERE {bedingung}")
+                ziel.ExecuteSQL(f"DELETE FROM bestand_gemarkungen WHERE {bedingung}")
+
+            geschrieben = 0
+            for eintrag in self.lese_quelle(layer, feldnamen, kennz_index):
+                if eintrag is None or eintrag[0][0] not in geaendert:
+                    continue
+                teile, flstkennz, geometrie, attribute = eintrag
+                if transformation is not None:
+                    geometrie.Transform(transformation)
+                feature = ogr.Feature(ziel_defn)
+                feature.SetField("bundesland", bundesland)
+                feature.SetField("gemaschl", teile[0])
+                feature.SetField("flur", int(teile[1]))
+                feature.SetField("kennung", erstelle_kennung(*teile))
+                feature.SetField("flstkennz", flstkennz)
+                feature.SetField("attribute", attribute)
+                feature.SetGeometryDirectly(ogr.ForceTo(geometrie, ogr.wkbMultiPolygon))
+                ziel_layer.CreateFeature(feature)
+                geschrieben += 1
+                if geschrieben % 1000 == 0:
+                    if abgebrochen and abgebrochen():
+                        ziel.RollbackTransaction()
+                        return
+                    if fortschritt and gesamt:
+                        fortschritt(50 + 50 * geschrieben / gesamt)
+
+            importiert = time.strftime("%Y-%m-%dT%H:%M:%S")
+            for gemaschl in sorted(geaendert):
+                eintrag = ogr.Feature(gemarkungen.GetLayerDefn())
+                eintrag.SetField("bundesland", bundesland)
+                eintrag.SetField("gemaschl", gemaschl)
+                eintrag.SetField("pruefsumme", neu[gemaschl][0])
+                eintrag.SetField("anzahl", neu[gemaschl][1])
+                eintrag.SetField("importiert", importiert)
+                gemarkungen.CreateFeature(eintrag)
+            if land is not None:
+                self.schreibe_land(ziel, bundesland, *land)
+        except Exception:
+            ziel.RollbackTransaction()
+            raise
+        ziel.CommitTransaction()
+        statistik["flurstuecke"] = geschrieben
+
+    def statistik(self):
+        """Gemarkungen und Flurstücke je Bundesland im Bestand"""
+        con = self.verbindung()
+        if con is None:
+            return {}
+        try:
+            return {bundesland: {"gemarkungen": gemarkungen, "flurstuecke": flurstuecke or 0}
+                    for bundesland, gemarkungen, flurstuecke in con.execute(
+                        "SELECT bundesland, COUNT(*), SUM(anzahl) FROM bestand_gemarkungen GROUP BY bundesland")}
+        except sqlite3.Error:
+            return {}
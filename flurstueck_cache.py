@@ -0,0 +1,228 @@
+from qgis.core import (QgsApplication, QgsCoordinateReferenceSystem, QgsFeature, QgsField, QgsFields,
+                       QgsGeometry, QgsMessageLog, Qgis)
+from qgis.PyQt.QtCore import QSettings, QVariant
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def wert_fuer_json(wert):
+    """Wandelt einen Attributwert in einen JSON-tauglichen Wert um"""
+    if wert is None or (hasattr(wert, "isNull") and wert.isNull()):
+        return None
+    if isinstance(wert, (bool, int, float, str)):
+        return wert
+    if hasattr(wert, "toString"):
+        return wert.toString()
+    return str(wert)
+
+
+def erstelle_felder(felder_json):
+    """QgsFields aus der gespeicherten Form [[name, typ, typ_name, laenge, genauigkeit], ...]"""
+    felder = QgsFields()
+    for name, typ, typ_name, laenge, genauigkeit in json.loads(felder_json):
+        felder.append(QgsField(name, QVariant.Type(typ), typ_name, laenge, genauigkeit))
+    return felder
+
+
+class FlurstueckCache:
+    """Persistenter Cache für abgerufene Flurstücke (SQLite)
+
+    Gespeichert werden dekodierte Geometrien (WKB) und Attribute je
+    Bundesland und Flurstückskennzeichen bzw. RLP-Filter. Einträge älter
+    als die TTL werden neu abgerufen, bleiben aber als Rückfall erhalten,
+    falls der Landesdienst nicht erreichbar ist. Überschreitet der Cache
+    die Maximalgröße, werden die am längsten nicht genutzten Einträge
+    entfernt.
+    """
+
+    SETTINGS_PREFIX = "alkis_suchmodul/cache"
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            verzeichnis = os.path.join(QgsApplication.qgisSettingsDirPath(), "alkis_suchmodul")
+            os.makedirs(verzeichnis, exist_ok=True)
+            db_path = os.path.join(verzeichnis, "flurstueck_cache.sqlite")
+
+        self.db_path = db_path
+        self.lokal = threading.local()
+        self.lock = threading.Lock()
+        self.verbindungen = []
+        self.treffer = 0
+        self.fehlschlaege = 0
+        self.erstelle_tabelle()
+
+    @property
+    def aktiv(self):
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/aktiv", True, type=bool)
+
+    @property
+    def ttl_sekunden(self):
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/ttl_stunden", 168, type=int) * 3600
+
+    @property
+    def max_bytes(self):
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/max_mb", 200, type=int) * 1024 * 1024
+
+    def verbindung(self):
+        """Gibt die SQLite-Verbindung des aktuellen Threads zurück"""
+        con = getattr(self.lokal, "con", None)
+        if con is None:
+            # check_same_thread=False nur, damit schliesse() alle Verbindungen schließen kann
+            con = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self.lokal.con = con
+            with self.lock:
+                self.verbindungen.append(con)
+        return con
+
+    def schliesse(self):
+        """Schließt die Verbindungen aller Threads (erst, wenn keine Zugriffe mehr laufen)"""
+        with self.lock:
+            verbindungen, self.verbindungen = self.verbindungen, []
+        for con in verbindungen:
+            con.close()
+        self.lokal = threading.local()
+
+    def erstelle_tabelle(self):
+        """Legt die Cache-Tabelle an"""
+        con = self.verbindung()
+        con.execute("""CREATE TABLE IF NOT EXISTS flurstuecke (
+                           schluessel TEXT PRIMARY KEY,
+                           bundesland TEXT NOT NULL,
+                           crs TEXT NOT NULL,
+                           felder TEXT NOT NULL,
+                           features BLOB NOT NULL,
+                           groesse INTEGER NOT NULL,
+                           erstellt REAL NOT NULL,
+                           zugriff REAL NOT NULL)""")
+        con.execute("CREATE INDEX IF NOT EXISTS flurstuecke_zugriff ON flurstuecke (zugriff)")
+        con.commit()
+
+    def hole(self, schluessel, abgelaufen_erlaubt=False):
+        """Liest einen Eintrag; gibt ein Ergebnis-Dict oder None zurück
+
+        Das Ergebnis hat die Schlüssel "felder", "crs" und "features" und
+        zusätzlich "quelle" ("cache") und "abgelaufen".
+        """
+        try:
+            con = self.verbindung()
+            row = con.execute("SELECT crs, felder, features, erstellt FROM flurstuecke WHERE schluessel = ?",
+                              (schluessel,)).fetchone()
+            if row is None:
+                self.zaehle(False)
+                return None
+
+            abgelaufen = time.time() - row[3] > self.ttl_sekunden
+            if abgelaufen and not abgelaufen_erlaubt:
+                self.zaehle(False)
+                return None
+
+            con.execute("UPDATE flurstuecke SET zugriff = ? WHERE schluessel = ?", (time.time(), schluessel))
+            con.commit()
+            self.zaehle(not abgelaufen)
+
+            ergebnis = self.deserialisiere(row[0], row[1], row[2])
+            ergebnis["abgelaufen"] = abgelaufen
+            return ergebnis
+
+        except (sqlite3.Error, ValueError) as e:
+            QgsMessageLog.logMessage(f"Cache-Lesefehler: {str(e)}", "Flurstück-Suche", Qgis.Warning)
+            return None
+
+    def speichere(self, schluessel, bundesland, ergebnis):
+        """Speichert ein Ergebnis und verdrängt bei Bedarf alte Einträge"""
+        try:
+            crs, felder, features = self.serialisiere(ergebnis)
+            jetzt = time.time()
+            con = self.verbindung()
+            con.execute("INSERT OR REPLACE INTO flurstuecke VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (schluessel, bundesland, crs, felder, features, len(features), jetzt, jetzt))
+            con.commit()
+            self.verdraenge()
+        except (sqlite3.Error, ValueError, TypeError) as e:
+            QgsMessageLog.logMessage(f"Cache-Schreibfehler: {str(e)}", "Flurstück-Suche", Qgis.Warning)
+
+    def verdraenge(self):
+        """Entfernt die am längsten nicht genutzten Einträge oberhalb der Maximalgröße"""
+        con = self.verbindung()
+        gesamt = con.execute("SELECT COALESCE(SUM(groesse), 0) FROM flurstuecke").fetchone()[0]
+        max_bytes = self.max_bytes
+        if gesamt <= max_bytes:
+            return
+
+        entfernen = []
+        for schluessel, groesse in con.execute("SELECT schluessel, groesse FROM flurstuecke ORDER BY zugriff"):
+            if gesamt <= max_bytes:
+                break
+            entfernen.append((schluessel,))
+            gesamt -= groesse
+
+        con.executemany("DELETE FROM flurstuecke WHERE schluessel = ?", entfernen)
+        con.commit()
+        QgsMessageLog.logMessage(f"Cache: {len(entfernen)} Einträge verdrängt", "Flurstück-Suche")
+
+    def leere(self):
+        """Löscht alle Einträge"""
+        con = self.verbindung()
+        con.execute("DELETE FROM flurstuecke")
+        con.commit()
+        con.execute("VACUUM")
+
+    def zaehle(self, treffer):
+        with self.lock:
+            if treffer:
+                self.treffer += 1
+            else:
+                self.fehlschlaege += 1
+
+    def statistik(self):
+        """Gibt Treffer, Fehlschläge, Anzahl Einträge und Größe zurück"""
+        anzahl, groesse = self.verbindung().execute(
+            "SELECT COUNT(*), COALESCE(SUM(groesse), 0) FROM flurstuecke").fetchone()
+        return {
+            "treffer": self.treffer,
+            "fehlschlaege": self.fehlschlaege,
+            "eintraege": anzahl,
+            "bytes": groesse
+        }
+
+    def serialisiere(self, ergebnis):
+        """Wandelt Felder und Features in speicherbare Werte um"""
+        felder = [[f.name(), int(f.type()), f.typeName(), f.length(), f.precision()] for f in ergebnis["felder"]]
+        features = []
+        for feature in ergebnis["features"]:
+            geometrie = feature.geometry()
+            wkb = bytes(geometrie.asWkb()) if geometrie and not geometrie.isNull() else b""
+            features.append({
+                "wkb": base64.b64encode(wkb).decode("ascii"),
+                "attribute": [wert_fuer_json(wert) for wert in feature.attributes()]
+            })
+        return (ergebnis["crs"].authid(), json.dumps(felder),
+                json.dumps(features, separators=(",", ":")).encode("utf-8"))
+
+    def deserialisiere(self, crs, felder_json, features_blob):
+        """Baut Felder, KBS und Features aus dem Cache-Eintrag wieder auf"""
+        felder = erstelle_felder(felder_json)
+
+        features = []
+        for eintrag in json.loads(features_blob):
+            feature = QgsFeature(felder)
+            wkb = base64.b64decode(eintrag["wkb"])
+            if wkb:
+                geometrie = QgsGeometry()
+                geometrie.fromWkb(wkb)
+                feature.setGeometry(geometrie)
+            feature.setAttributes(eintrag["attribute"])
+            features.append(feature)
+
+        return {
+            "felder": felder,
+            "crs": QgsCoordinateReferenceSystem(crs),
+            "features": features,
+            "quelle": "cache"
+        }
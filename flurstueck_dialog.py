@@ -1,5 +1,7 @@
-from qgis.PyQt.QtWidgets import QDialog, QApplication
+from qgis.PyQt.QtCore import Qt, QSettings, QStringListModel, QTimer
+from qgis.PyQt.QtWidgets import QDialog, QCompleter
 from qgis.PyQt.uic import loadUiType
+from .flurstueck_kern import ALLE_BUNDESLAENDER
 import os
 
 FORM_CLASS, _ = loadUiType(os.path.join(
@@ -16,9 +18,42 @@ class FlurstueckDialog(QDialog, FORM_CLASS):
         # UI laden
         self.setupUi(self)
         
+        # Autovervollständigung für Gemarkungen; die Vorschläge werden bei
+        # jeder Eingabe aus den Indizes des Bundeslands neu berechnet
+        self.gemarkung_model = QStringListModel(self)
+        self.gemarkung_completer = QCompleter(self.gemarkung_model, self)
+        self.gemarkung_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.gemarkung_completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.gemarkung_edit.setCompleter(self.gemarkung_completer)
+
+        self.vorschlag_timer = QTimer(self)
+        self.vorschlag_timer.setSingleShot(True)
+        self.vorschlag_timer.setInterval(80)
+        self.vorschlag_timer.timeout.connect(self.aktualisiere_vorschlaege)
+        self.gemarkung_edit.textEdited.connect(self.vorschlag_timer.start)
+
+        # Zuletzt gewähltes Bundesland (gilt auch für die Suche per Klick);
+        # "Alle Bundesländer" wird getrennt gespeichert, da die Suche per
+        # Klick ein konkretes Land braucht
+        if QSettings().value("alkis_suchmodul/alle_bundeslaender", False, type=bool):
+            index = self.bundesland_combo.findText(ALLE_BUNDESLAENDER)
+        else:
+            index = self.bundesland_combo.findText(self.plugin.aktives_bundesland())
+        if index >= 0:
+            self.bundesland_combo.setCurrentIndex(index)
+        self.ausschnitt_button.setEnabled(self.bundesland_combo.currentText() != ALLE_BUNDESLAENDER)
+
+        self.sammellayer_check.setChecked(self.plugin.ergebnis_layer.aktiv())
+        self.sammellayer_check.toggled.connect(self.plugin.ergebnis_layer.setze_aktiv)
+
         # Signal-Verbindungen
         self.bundesland_combo.currentTextChanged.connect(self.on_bundesland_changed)
         self.suchen_button.clicked.connect(self.on_suchen_clicked)
+        self.bereich_button.clicked.connect(self.on_bereich_clicked)
+        self.ausschnitt_button.clicked.connect(self.on_ausschnitt_clicked)
+        self.stapel_button.clicked.connect(self.plugin.run_batch)
+        self.abbrechen_button.clicked.connect(self.plugin.breche_tasks_ab)
+        self.abbrechen_button.setEnabled(self.plugin.laufende_tasks() > 0)
         self.schliessen_button.clicked.connect(self.close)
         
         # Eingabevalidierung
@@ -28,7 +63,29 @@ class FlurstueckDialog(QDialog, FORM_CLASS):
         
     def on_bundesland_changed(self, bundesland):
         """Bundesland-Wechsel verarbeiten"""
-        pass
+        settings = QSettings()
+        settings.setValue("alkis_suchmodul/alle_bundeslaender", bundesland == ALLE_BUNDESLAENDER)
+        if bundesland != ALLE_BUNDESLAENDER:
+            settings.setValue("alkis_suchmodul/bundesland", bundesland)
+        self.ausschnitt_button.setEnabled(bundesland != ALLE_BUNDESLAENDER)
+        self.gemarkung_model.setStringList([])
+        if self.gemarkung_edit.text().strip():
+            self.vorschlag_timer.start()
+
+    def aktualisiere_vorschlaege(self):
+        """Gemarkungsvorschläge zur aktuellen Eingabe anzeigen"""
+        text = self.gemarkung_edit.text().strip()
+        bundesland = self.bundesland_combo.currentText()
+        if not text:
+            vorschlaege = []
+        elif bundesland == ALLE_BUNDESLAENDER:
+            vorschlaege = self.plugin.katalog.vorschlaege(text)
+        else:
+            vorschlaege = self.plugin.get_gemarkungen_for_bundesland(bundesland).vorschlaege(text)
+
+        self.gemarkung_model.setStringList(vorschlaege)
+        if vorschlaege and self.gemarkung_edit.hasFocus():
+            self.gemarkung_completer.complete()
         
     def validate_fields(self):
         """Pflichtfelder validieren"""
@@ -37,6 +94,8 @@ class FlurstueckDialog(QDialog, FORM_CLASS):
         zaehler = self.zaehler_edit.text().strip()
         
         self.suchen_button.setEnabled(bool(gemarkung and flur and zaehler))
+        self.bereich_button.setEnabled(bool(gemarkung))
+        self.bereich_button.setText("Ganze Flur laden" if flur else "Ganze Gemarkung laden")
             
     def on_suchen_clicked(self):
         """Suchfunktion aufrufen"""
@@ -64,18 +123,46 @@ class FlurstueckDialog(QDialog, FORM_CLASS):
             self.status_label.setStyleSheet("color: red; font-style: italic;")
             return
             
-        # UI für Suche vorbereiten
-        self.setEnabled(False)
-        self.status_label.setText("Suche läuft...")
-        self.status_label.setStyleSheet("color: #666; font-style: italic;")
-        QApplication.processEvents()
-        
-        # Suche ausführen
-        success, message = self.plugin.suche_flurstueck(bundesland, gemarkung, flur, zaehler, nenner)
-        
-        # UI zurücksetzen
-        self.setEnabled(True)
-        
+        # Suche im Hintergrund starten; weitere Suchen können sofort folgen
+        success, message = self.plugin.starte_suche_task(bundesland, gemarkung, flur, zaehler, nenner,
+                                                         self.on_suche_fertig,
+                                                         self.cache_umgehen_check.isChecked())
+        if not success:
+            self.status_label.setText(message)
+            self.status_label.setStyleSheet("color: red; font-style: italic;")
+            return
+
+        self.zeige_laufende_suchen()
+
+    def on_bereich_clicked(self):
+        """Alle Flurstücke der Flur bzw. Gemarkung laden"""
+        bundesland = self.bundesland_combo.currentText()
+        gemarkung = self.gemarkung_edit.text().strip()
+        flur = self.flur_edit.text().strip()
+
+        success, message = self.plugin.starte_bereich_task(bundesland, gemarkung, flur, self.on_suche_fertig)
+        if not success:
+            self.status_label.setText(message)
+            self.status_label.setStyleSheet("color: red; font-style: italic;")
+            return
+
+        self.zeige_laufende_suchen()
+
+    def on_ausschnitt_clicked(self):
+        """Alle Flurstücke im Kartenausschnitt laden"""
+        success, message = self.plugin.starte_ausschnitt_task(self.bundesland_combo.currentText(),
+                                                              self.on_suche_fertig)
+        if not success:
+            self.status_label.setText(message)
+            self.status_label.setStyleSheet("color: red; font-style: italic;")
+            return
+
+        self.zeige_laufende_suchen()
+
+    def on_suche_fertig(self, success, message):
+        """Ergebnis einer Hintergrundsuche anzeigen"""
+        self.abbrechen_button.setEnabled(self.plugin.laufende_tasks() > 1)
+
         # Ergebnis anzeigen
         if success:
             self.status_label.setText(message)
@@ -83,3 +170,10 @@ class FlurstueckDialog(QDialog, FORM_CLASS):
         else:
             self.status_label.setText(message)
             self.status_label.setStyleSheet("color: red; font-style: italic;")
+
+    def zeige_laufende_suchen(self):
+        """Anzahl laufender Suchen anzeigen"""
+        anzahl = self.plugin.laufende_tasks()
+        self.abbrechen_button.setEnabled(anzahl > 0)
+        self.status_label.setText(f"Suche läuft... ({anzahl} offen)" if anzahl > 1 else "Suche läuft...")
+        self.status_label.setStyleSheet("color: #666; font-style: italic;")
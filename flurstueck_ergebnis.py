@@ -0,0 +1,143 @@
+from qgis.core import (QgsCoordinateTransform, QgsFeature, QgsFeatureRequest, QgsField,
+                       QgsFields, QgsProject, QgsRectangle, QgsVectorFileWriter, QgsVectorLayer,
+                       QgsMessageLog, Qgis)
+from qgis.PyQt.QtCore import QSettings
+import os
+
+LAYER_EIGENSCHAFT = "alkis_suchmodul/sammellayer"
+
+
+class FlurstueckErgebnisLayer:
+    """Sammelt Suchergebnisse in einem Layer je Bundesland
+
+    Statt eines Memory-Layers je Treffer werden alle Flurstücke eines
+    Bundeslands an einen dauerhaften Layer mit räumlichem Index angehängt.
+    Bereits enthaltene Flurstücke (flstkennz) werden übersprungen. Ist
+    alkis_suchmodul/ergebnis/gpkg gesetzt, liegen die Layer in dieser
+    GeoPackage-Datei, sonst im Speicher.
+    """
+
+    SETTINGS_PREFIX = "alkis_suchmodul/ergebnis"
+    ZIEL_CRS = "EPSG:25832"
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.kennungen = {}
+
+    def aktiv(self):
+        """Ist der Sammellayer-Modus eingeschaltet?"""
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/sammellayer", False, type=bool)
+
+    def setze_aktiv(self, aktiv):
+        """Schaltet den Sammellayer-Modus ein oder aus"""
+        QSettings().setValue(f"{self.SETTINGS_PREFIX}/sammellayer", bool(aktiv))
+
+    def gpkg_pfad(self):
+        """Pfad der GeoPackage-Datei oder leer für Memory-Layer"""
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/gpkg", "")
+
+    def finde_layer(self, bundesland):
+        """Sucht den Sammellayer eines Bundeslands im Projekt"""
+        for layer in QgsProject.instance().mapLayers().values():
+            if layer.customProperty(LAYER_EIGENSCHAFT) == bundesland and layer.isValid():
+                return layer
+        return None
+
+    def erstelle_layer(self, bundesland, felder):
+        """Legt den Sammellayer eines Bundeslands an und fügt ihn dem Projekt hinzu
+
+        Enthält das GeoPackage die Tabelle des Bundeslands bereits (etwa aus
+        einer früheren Sitzung), wird sie geöffnet statt überschrieben.
+        """
+        kuerzel = self.plugin.bundesland_kuerzel(bundesland)
+        titel = f"{kuerzel} - Flurstücke"
+        pfad = self.gpkg_pfad()
+        tabelle = f"flurstuecke_{kuerzel.lower()}"
+        layer = None
+        if pfad and os.path.exists(pfad):
+            layer = QgsVectorLayer(f"{pfad}|layername={tabelle}", titel, "ogr")
+        if layer is None or not layer.isValid():
+            layer = self.neuer_layer(titel, felder, pfad, tabelle)
+
+        layer.setCustomProperty(LAYER_EIGENSCHAFT, bundesland)
+        QgsProject.instance().addMapLayer(layer)
+        return layer
+
+    def neuer_layer(self, titel, felder, pfad, tabelle):
+        """Neuer Sammellayer, als Tabelle im GeoPackage oder (ohne pfad bzw. bei Fehlern) im Speicher"""
+        layer = QgsVectorLayer(f"MultiPolygon?crs={self.ZIEL_CRS}&index=yes", titel, "memory")
+        layer.dataProvider().addAttributes(felder)
+        layer.updateFields()
+        if not pfad:
+            return layer
+
+        optionen = QgsVectorFileWriter.SaveVectorOptions()
+        optionen.driverName = "GPKG"
+        optionen.layerName = tabelle
+        if os.path.exists(pfad):
+            # Die Tabelle fehlt (sonst hätte erstelle_layer sie geöffnet); andere Tabellen bleiben erhalten
+            optionen.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        fehler = QgsVectorFileWriter.writeAsVectorFormatV2(
+            layer, pfad, QgsProject.instance().transformContext(), optionen)[0]
+        if fehler != QgsVectorFileWriter.NoError:
+            QgsMessageLog.logMessage(f"GeoPackage {pfad} konnte nicht angelegt werden, verwende Memory-Layer",
+                                     "Flurstück-Suche", Qgis.Warning)
+            return layer
+        return QgsVectorLayer(f"{pfad}|layername={tabelle}", titel, "ogr")
+
+    def vorhandene_kennungen(self, layer):
+        """Kennungen der Flurstücke im Layer (neu aufgebaut, wenn sich der Layer geändert hat)"""
+        eintrag = self.kennungen.get(layer.id())
+        if eintrag is None or eintrag[0] != layer.featureCount():
+            request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+            eintrag = (layer.featureCount(),
+                       {self.plugin.flurstueck_kennung(f) for f in layer.getFeatures(request)})
+            self.kennungen[layer.id()] = eintrag
+        return eintrag[1]
+
+    def fuege_hinzu(self, bundesland, features, crs):
+        """Hängt Features an den Sammellayer an
+
+        Gibt (layer, anzahl_neu, extent) zurück; extent umfasst alle
+        übergebenen Flurstücke, auch bereits vorhandene.
+        """
+        features = list(features)
+        felder = features[0].fields() if features else QgsFields()
+        layer = self.finde_layer(bundesland) or self.erstelle_layer(bundesland, felder)
+
+        neue_felder = [QgsField(feld) for feld in felder if layer.fields().indexFromName(feld.name()) == -1]
+        if neue_felder:
+            layer.dataProvider().addAttributes(neue_felder)
+            layer.updateFields()
+
+        transform = None
+        if crs != layer.crs():
+            transform = QgsCoordinateTransform(crs, layer.crs(), QgsProject.instance())
+
+        vorhanden = self.vorhandene_kennungen(layer)
+        extent = QgsRectangle()
+        neue = []
+        for quelle in features:
+            geometrie = quelle.geometry()
+            if transform is not None:
+                geometrie.transform(transform)
+            extent.combineExtentWith(geometrie.boundingBox())
+
+            kennung = self.plugin.flurstueck_kennung(quelle)
+            if kennung in vorhanden:
+                continue
+            vorhanden.add(kennung)
+
+            geometrie.convertToMultiType()
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(geometrie)
+            for name in quelle.fields().names():
+                feature[name] = quelle[name]
+            neue.append(feature)
+
+        if neue:
+            layer.dataProvider().addFeatures(neue)
+            layer.updateExtents()
+            self.kennungen[layer.id()] = (layer.featureCount(), vorhanden)
+            layer.triggerRepaint()
+        return layer, len(neue), extent
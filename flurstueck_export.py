@@ -0,0 +1,191 @@
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsVectorLayer,
+                       QgsMessageLog, Qgis)
+from qgis.PyQt.QtCore import QSettings, QVariant
+from osgeo import ogr, osr
+from .flurstueck_cache import wert_fuer_json
+import os
+import re
+import time
+
+# Dateiendung -> OGR-Treiber
+TREIBER = {".gpkg": "GPKG", ".fgb": "FlatGeobuf"}
+
+# QVariant-Typ der Quellfelder -> OGR-Feldtyp (alles andere als Text)
+OGR_FELD_TYPEN = {
+    QVariant.Int: ogr.OFTInteger,
+    QVariant.LongLong: ogr.OFTInteger64,
+    QVariant.Double: ogr.OFTReal,
+}
+
+# Herkunftsspalten, die jedes exportierte Flurstück erhält
+HERKUNFT_FELDER = ("bundesland", "abfrage", "abgerufen")
+
+EXPORT_TABELLE = "flurstuecke"
+
+
+def export_pfad(layer_name):
+    """Zieldatei für einen Bereichsdownload oder None (Memory-Layer)
+
+    Ist alkis_suchmodul/export/verzeichnis gesetzt, werden große
+    Downloads dort als Datei im Format alkis_suchmodul/export/format
+    ("gpkg" oder "fgb") abgelegt.
+    """
+    settings = QSettings()
+    verzeichnis = settings.value("alkis_suchmodul/export/verzeichnis", "")
+    if not verzeichnis:
+        return None
+    endung = settings.value("alkis_suchmodul/export/format", "gpkg")
+    if f".{endung}" not in TREIBER:
+        endung = "gpkg"
+    name = re.sub(r"[^\w\-]+", "_", layer_name).strip("_")
+    return os.path.join(verzeichnis, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.{endung}")
+
+
+class FlurstueckDateiSenke:
+    """Schreibt Flurstücke direkt in ein GeoPackage oder FlatGeobuf
+
+    Statt eines Memory-Layers wächst nur die Datei; im Speicher liegt
+    höchstens das gerade geschriebene Ergebnis. GeoPackages werden in
+    Transaktionen zu transaktion_groesse Features geschrieben, der
+    räumliche Index entsteht einmal beim Schließen (FlatGeobuf legt ihn
+    beim Schließen selbst an). Jedes Flurstück erhält die Herkunftsspalten
+    bundesland, abfrage und abgerufen. Die Senke ist nicht thread-sicher;
+    es darf immer nur ein Thread schreiben.
+    """
+
+    def __init__(self, pfad, transaktion_groesse=10000):
+        self.treiber = TREIBER.get(os.path.splitext(pfad)[1].lower())
+        if self.treiber is None:
+            raise ValueError(f"Nicht unterstütztes Dateiformat: {os.path.basename(pfad)} (nur .gpkg und .fgb)")
+        self.pfad = pfad
+        self.transaktion_groesse = transaktion_groesse
+        self.quelle = None
+        self.layer = None
+        self.crs = None
+        self.felder = set(HERKUNFT_FELDER)
+        self.transformationen = {}
+        self.transaktionen = False
+        self.offen = 0
+        self.anzahl = 0
+
+    def oeffne(self, crs):
+        """Legt die Datei mit der Ebene flurstuecke im KBS crs an (eine vorhandene wird ersetzt)"""
+        treiber = ogr.GetDriverByName(self.treiber)
+        if os.path.exists(self.pfad):
+            treiber.DeleteDataSource(self.pfad)
+        self.quelle = treiber.CreateDataSource(self.pfad)
+        if self.quelle is None:
+            raise RuntimeError(f"{self.pfad} kann nicht geschrieben werden")
+
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(crs.toWkt())
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        optionen = ["GEOMETRY_NAME=geom", "FID=fid", "SPATIAL_INDEX=NO"] if self.treiber == "GPKG" else []
+        self.layer = self.quelle.CreateLayer(EXPORT_TABELLE, srs, ogr.wkbMultiPolygon, optionen)
+        for name in HERKUNFT_FELDER:
+            self.layer.CreateField(ogr.FieldDefn(name, ogr.OFTString))
+        self.crs = crs
+        self.transaktionen = bool(self.quelle.TestCapability(ogr.ODsCTransactions))
+
+    def ergaenze_felder(self, felder, extra):
+        """Legt Spalten an, die in bisherigen Ergebnissen fehlten"""
+        neu = [(feld.name(), OGR_FELD_TYPEN.get(feld.type(), ogr.OFTString)) for feld in felder]
+        neu += [(name, ogr.OFTInteger if isinstance(wert, int) else ogr.OFTString) for name, wert in extra.items()]
+        for name, typ in neu:
+            if name in self.felder:
+                continue
+            self.felder.add(name)
+            if self.layer.CreateField(ogr.FieldDefn(name, typ)) != 0:
+                # FlatGeobuf erlaubt keine neuen Spalten, sobald Features geschrieben sind
+                QgsMessageLog.logMessage(f"Spalte {name} kann in {os.path.basename(self.pfad)} nicht mehr "
+                                         f"angelegt werden und bleibt leer", "Flurstück-Suche", Qgis.Warning)
+
+    def transformation(self, crs):
+        """Transformation aus crs in das KBS der Datei (None, wenn gleich)"""
+        if crs is None or not crs.isValid() or crs == self.crs:
+            return None
+        if crs.authid() not in self.transformationen:
+            self.transformationen[crs.authid()] = QgsCoordinateTransform(crs, self.crs, QgsProject.instance())
+        return self.transformationen[crs.authid()]
+
+    def schreibe(self, features, felder, crs, bundesland, abfrage, extra=None):
+        """Schreibt die Features eines Ergebnisses; gibt ihre Anzahl zurück
+
+        features darf ein Iterator sein. extra enthält zusätzliche Spalten
+        mit festem Wert (z.B. stapel_zeile).
+        """
+        extra = extra or {}
+        if self.quelle is None:
+            self.oeffne(crs if crs is not None and crs.isValid() else QgsCoordinateReferenceSystem("EPSG:25832"))
+        self.ergaenze_felder(felder, extra)
+        transform = self.transformation(crs)
+        defn = self.layer.GetLayerDefn()
+        namen = [name for name in felder.names() if defn.GetFieldIndex(name) != -1 and name not in HERKUNFT_FELDER]
+        werte = dict(extra, bundesland=bundesland, abfrage=abfrage, abgerufen=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        werte = {name: wert for name, wert in werte.items() if defn.GetFieldIndex(name) != -1}
+
+        anzahl = 0
+        for quelle in features:
+            if self.transaktionen and not self.offen:
+                self.quelle.StartTransaction()
+
+            feature = ogr.Feature(defn)
+            if quelle.hasGeometry():
+                geometrie = quelle.geometry()
+                if transform is not None:
+                    geometrie.transform(transform)
+                ogr_geometrie = ogr.CreateGeometryFromWkb(bytes(geometrie.asWkb()))
+                feature.SetGeometryDirectly(ogr.ForceTo(ogr_geometrie, ogr.wkbMultiPolygon))
+            for name in namen:
+                wert = wert_fuer_json(quelle[name])
+                if wert is not None:
+                    feature.SetField(name, int(wert) if isinstance(wert, bool) else wert)
+            for name, wert in werte.items():
+                feature.SetField(name, wert)
+            self.layer.CreateFeature(feature)
+
+            anzahl += 1
+            self.offen += 1
+            if self.offen >= self.transaktion_groesse:
+                self.schreibe_transaktion()
+        self.anzahl += anzahl
+        return anzahl
+
+    def schreibe_transaktion(self):
+        """Schließt die laufende Transaktion ab"""
+        if self.transaktionen and self.offen:
+            self.quelle.CommitTransaction()
+        self.offen = 0
+
+    def schliesse(self):
+        """Schreibt die letzte Transaktion, legt den räumlichen Index an und schließt die Datei
+
+        Gibt die Anzahl geschriebener Features zurück.
+        """
+        if self.quelle is None:
+            return self.anzahl
+        self.schreibe_transaktion()
+        if self.treiber == "GPKG" and self.anzahl:
+            ergebnis = self.quelle.ExecuteSQL(f"SELECT CreateSpatialIndex('{EXPORT_TABELLE}', 'geom')",
+                                              dialect="SQLite")
+            if ergebnis is not None:
+                self.quelle.ReleaseResultSet(ergebnis)
+        self.layer = None
+        self.quelle = None
+        QgsMessageLog.logMessage(f"{self.anzahl} Flurstücke geschrieben: {self.pfad}", "Flurstück-Suche")
+        return self.anzahl
+
+    def verwerfe(self):
+        """Schließt die Datei und löscht sie (nach Fehler oder Abbruch)"""
+        if self.quelle is not None and self.transaktionen and self.offen:
+            self.quelle.RollbackTransaction()
+        self.layer = None
+        self.quelle = None
+        self.offen = 0
+        if os.path.exists(self.pfad):
+            ogr.GetDriverByName(self.treiber).DeleteDataSource(self.pfad)
+
+    def als_layer(self, name):
+        """Die geschriebene Datei als Vektorlayer"""
+        uri = f"{self.pfad}|layername={EXPORT_TABELLE}" if self.treiber == "GPKG" else self.pfad
+        return QgsVectorLayer(uri, name, "ogr")
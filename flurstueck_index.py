@@ -0,0 +1,84 @@
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsFeature, QgsGeometry,
+                       QgsProject, QgsRectangle, QgsSpatialIndex)
+from collections import OrderedDict
+import threading
+
+INDEX_CRS = "EPSG:25832"
+
+
+class FlurstueckIndex:
+    """Räumlicher Index der zuletzt geladenen Flurstücke
+
+    Alle Geometrien liegen in EPSG:25832. Der Index ist auf max_features
+    begrenzt; die ältesten Einträge werden zuerst verdrängt. Flurstücke
+    werden je Bundesland über flstkennz (RLP: alle Attribute) nur einmal
+    aufgenommen.
+    """
+
+    def __init__(self, max_features=50000):
+        self.max_features = max_features
+        self.crs = QgsCoordinateReferenceSystem(INDEX_CRS)
+        self.index = QgsSpatialIndex()
+        self.eintraege = OrderedDict()
+        self.kennungen = {}
+        self.naechste_id = 1
+        self.lock = threading.Lock()
+
+    def kennung(self, feature):
+        """Kennung eines Flurstücks zum Erkennen von Duplikaten"""
+        if feature.fields().indexFromName("flstkennz") != -1:
+            return str(feature["flstkennz"]).strip()
+        return tuple(str(wert) for wert in feature.attributes())
+
+    def fuege_hinzu(self, bundesland, features, crs):
+        """Nimmt Features in den Index auf; gibt die Anzahl neuer Einträge zurück"""
+        transform = None
+        if crs != self.crs:
+            transform = QgsCoordinateTransform(crs, self.crs, QgsProject.instance())
+
+        neu = 0
+        with self.lock:
+            for quelle in features:
+                if not quelle.hasGeometry():
+                    continue
+                schluessel = (bundesland, self.kennung(quelle))
+                if schluessel in self.kennungen:
+                    continue
+
+                feature = QgsFeature(quelle)
+                feature.setId(self.naechste_id)
+                if transform is not None:
+                    geometrie = feature.geometry()
+                    geometrie.transform(transform)
+                    feature.setGeometry(geometrie)
+
+                self.index.addFeature(feature)
+                self.eintraege[self.naechste_id] = (schluessel, feature)
+                self.kennungen[schluessel] = self.naechste_id
+                self.naechste_id += 1
+                neu += 1
+
+            while len(self.eintraege) > self.max_features:
+                _, (schluessel, feature) = self.eintraege.popitem(last=False)
+                self.index.deleteFeature(feature)
+                del self.kennungen[schluessel]
+        return neu
+
+    def finde(self, punkt, bundesland=None):
+        """Flurstücke, die den Punkt (EPSG:25832) enthalten"""
+        geometrie = QgsGeometry.fromPointXY(punkt)
+        with self.lock:
+            kandidaten = self.index.intersects(QgsRectangle(punkt.x(), punkt.y(), punkt.x(), punkt.y()))
+            treffer = []
+            for fid in kandidaten:
+                (land, _), feature = self.eintraege[fid]
+                if (bundesland is None or land == bundesland) and feature.geometry().contains(geometrie):
+                    treffer.append(QgsFeature(feature))
+        return treffer
+
+    def leere(self):
+        """Entfernt alle Einträge"""
+        with self.lock:
+            self.index = QgsSpatialIndex()
+            self.eintraege.clear()
+            self.kennungen.clear()
@@ -0,0 +1,1299 @@
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import (QgsVectorLayer, QgsMessageLog, Qgis, QgsCoordinateTransform, QgsGeometry, QgsProject)
+from .flurstueck_cache import FlurstueckCache
+from .flurstueck_bestand import FlurstueckBestand
+from .flurstueck_index import FlurstueckIndex
+from .flurstueck_ausschnitt import KachelCache
+from .wfs_session import WfsSessionManager
+from .gemarkung_katalog import GemarkungKatalog, GemarkungTabelle, MEHRDEUTIG
+from .flurstueck_metriken import FlurstueckMetriken, erfasst
+from .wfs_stream import WfsStreamDecoder, WfsStreamFehler, reduziere_geometrie, verschiebe_in_hauptthread
+from .wfs_profil import WfsProfilCache
+from .flurstueck_abruf import LaufendeAbrufe, FlurstueckVorabruf
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+import urllib.parse
+import os
+import tempfile
+import zipfile
+import uuid
+import re
+import threading
+from xml.sax.saxutils import escape
+from osgeo import gdal
+
+AVE_NAMESPACE = "http://repository.gdi-de.org/schemas/adv/produkt/alkis-vereinfacht/2.0"
+
+BUNDESLAND_KUERZEL = {
+    "Nordrhein-Westfalen": "NRW",
+    "Niedersachsen": "NI",
+    "Hessen": "HE",
+    "Rheinland-Pfalz": "RLP"
+}
+
+# Auswahl im Suchdialog, wenn das Bundesland aus der Gemarkung ermittelt werden soll
+ALLE_BUNDESLAENDER = "Alle Bundesländer"
+
+# Abfrageprofile: eigenschaften werden per PROPERTYNAME angefordert (None = alle),
+# raster rundet Koordinaten auf ein Gitter (m), toleranz vereinfacht Umringe (m)
+KENNUNG_EIGENSCHAFTEN = ("flstkennz", "gemarkung", "flur", "flstnrzae", "flstnrnen")
+ABFRAGE_PROFILE = {
+    "vollstaendig": {"eigenschaften": None, "raster": None, "toleranz": None},
+    "umring": {"eigenschaften": KENNUNG_EIGENSCHAFTEN, "raster": 0.01, "toleranz": None},
+    "uebersicht": {"eigenschaften": KENNUNG_EIGENSCHAFTEN, "raster": 0.1, "toleranz": 0.5},
+}
+
+
+class SucheAbgebrochen(Exception):
+    """Wird ausgelöst, wenn eine laufende Suche abgebrochen wurde"""
+
+
+class FlurstueckKern:
+    """Suchlogik ohne Benutzeroberfläche
+
+    Gemarkungsauflösung, Request-Aufbau, Abruf und Dekodierung. Die Klasse
+    greift weder auf iface noch auf das Projekt zu und kann daher auch in
+    qgis_process, auf QGIS Server oder in Skripten verwendet werden.
+    """
+
+    def __init__(self):
+        self.cache = FlurstueckCache()
+        self.bestand = FlurstueckBestand()
+        self.http = WfsSessionManager()
+        self.kacheln = KachelCache()
+        self.flurstueck_index = FlurstueckIndex()
+        self.metriken = FlurstueckMetriken()
+        self.laufende_abrufe = LaufendeAbrufe()
+        self.vorabruf = FlurstueckVorabruf(self)
+        
+        # Gemarkungen werden erst bei der ersten Suche je Bundesland geladen
+        self.katalog = GemarkungKatalog(os.path.dirname(__file__))
+        
+        self.fluren = {}
+        self.wfs_urls = {
+            "Nordrhein-Westfalen": "https://www.wfs.nrw.de/geobasis/wfs_nw_alkis_vereinfacht",
+            "Niedersachsen": "https://opendata.lgln.niedersachsen.de/doorman/noauth/alkis_wfs_einfach",
+            "Hessen": "https://www.gds.hessen.de/wfs2/aaa-suite/cgi-bin/alkis/vereinf/wfs",
+            "Rheinland-Pfalz": "https://www.geoportal.rlp.de/registry/wfs/519"
+        }
+
+        # Request-Konfiguration je Bundesland; max_filter und max_url_laenge
+        # begrenzen Sammel-Requests, post erlaubt den Wechsel auf HTTP-POST,
+        # seiten_groesse gilt für den seitenweisen Download ganzer Fluren.
+        # stream_format wird beim Download direkt dekodiert (ohne Shapefile);
+        # srsname fordert EPSG:25832 auch für das Shapefile an (sonst nur für
+        # das Stream-Format, siehe sende_srsname)
+        self.wfs_config = {
+            "Nordrhein-Westfalen": {
+                "version": "1.1.0",
+                "typename": "TYPENAME",
+                "filter_ns": "ogc_with_ave",
+                "output_format": "application/x-zip-shapefile",
+                "stream_format": "text/xml; subtype=gml/3.1.1",
+                "max_filter": 100,
+                "max_url_laenge": 8000,
+                "post": True,
+                "seiten_groesse": 1000
+            },
+            "Niedersachsen": {
+                "version": "1.1.0",
+                "typename": "typename",
+                "filter_ns": "ogc_with_ave",
+                "output_format": "application/x-zip-shapefile",
+                "stream_format": "text/xml; subtype=gml/3.1.1",
+                "max_filter": 100,
+                "max_url_laenge": 8000,
+                "post": True,
+                "seiten_groesse": 1000
+            },
+            "Hessen": {
+                "version": "2.0.0", 
+                "typename": "TYPENAMES",
+                "filter_ns": "fes",
+                "output_format": "application/x-zip-shapefile",
+                "stream_format": "application/gml+xml; version=3.2",
+                "max_filter": 50,
+                "max_url_laenge": 8000,
+                "post": True,
+                "seiten_groesse": 1000
+            },
+            "Rheinland-Pfalz": {
+                "version": "2.0.0",
+                "typename": "TYPENAMES",
+                "filter_ns": "fes_rlp",
+                "output_format": "application/x-zip-shapefile",
+                "stream_format": None,
+                "max_filter": 25,
+                "max_url_laenge": 6000,
+                "post": False,
+                "seiten_groesse": 500,
+                "srsname": True
+            }
+        }
+
+        # Grundkonfiguration; wfs_config wird daraus und aus dem Profil des
+        # Endpunkts (GetCapabilities) abgeleitet, siehe wende_profil_an
+        self.wfs_basis = {land: dict(cfg) for land, cfg in self.wfs_config.items()}
+        self.profile = WfsProfilCache(self.http)
+
+        # Bundesländer, deren Stream-Antworten in dieser Sitzung nicht
+        # dekodiert werden konnten; sie fallen auf Shapefile-ZIP zurück
+        self.stream_gesperrt = set()
+
+    def get_gemarkungen_for_bundesland(self, bundesland):
+        """Gibt Gemarkungen für Bundesland zurück (beim ersten Zugriff geladen)"""
+        return self.katalog.tabelle(bundesland)
+
+    def bundesland_kuerzel(self, bundesland):
+        """Kürzel eines Bundeslands für Layernamen"""
+        return BUNDESLAND_KUERZEL.get(bundesland, "")
+
+    def flurstueck_kennung(self, feature):
+        """Eindeutige Kennung eines Flurstücks: flstkennz bzw. RLP-Schlüssel"""
+        namen = feature.fields().names()
+        if "flstkennz" in namen:
+            return str(feature["flstkennz"]).strip()
+        if "flstnrzae" in namen:
+            return self.normiere_rlp_schluessel(feature["gemarkung"], feature["flur"],
+                                                feature["flstnrzae"], feature["flstnrnen"])
+        return tuple(str(wert) for wert in feature.attributes())
+
+    def lade_flurstueck_an_punkt(self, bundesland, punkt, abgebrochen=None):
+        """Ruft die Flurstücke an einem Punkt (EPSG:25832) ab
+
+        Der WFS liefert alle Flurstücke, deren Umring ein 1-m-Rechteck um
+        den Punkt schneidet; übrig bleiben die, die den Punkt enthalten.
+        Liegt der Punkt in einem Flurstück des lokalen Bestands, entfällt
+        der Request.
+        """
+        try:
+            ergebnis = self.bestand.hole_punkt(bundesland, punkt.x(), punkt.y())
+            punkt_geometrie = QgsGeometry.fromPointXY(punkt)
+            success = ergebnis is not None and any(f.geometry().contains(punkt_geometrie)
+                                                   for f in ergebnis["features"])
+            if not success:
+                self.wende_profil_an(bundesland)
+                profil = self.abfrage_profil_name("einzel")
+                url = self.erstelle_bbox_url(bundesland, punkt.x() - 0.5, punkt.y() - 0.5,
+                                             punkt.x() + 0.5, punkt.y() + 0.5, profil)
+                response = self.sende_wfs_request(url, bundesland=bundesland, stream_lesen=True)
+                try:
+                    if response.status_code != 200:
+                        return False, f"Fehler beim Abruf: HTTP {response.status_code}"
+                    success, ergebnis = self.lese_antwort_stream(response, abgebrochen=abgebrochen, profil=profil,
+                                                                 bundesland=bundesland)
+                finally:
+                    response.close()
+
+            if not success:
+                if ergebnis.startswith("Keine Geometrien"):
+                    return False, "Kein Flurstück an dieser Stelle gefunden"
+                return False, ergebnis
+
+            geometrie = QgsGeometry.fromPointXY(punkt)
+            index_crs = self.flurstueck_index.crs
+            if ergebnis["crs"] != index_crs:
+                geometrie.transform(QgsCoordinateTransform(index_crs, ergebnis["crs"], QgsProject.instance()))
+            features = [f for f in ergebnis["features"] if f.geometry().contains(geometrie)]
+            if not features:
+                return False, "Kein Flurstück an dieser Stelle gefunden"
+
+            self.flurstueck_index.fuege_hinzu(bundesland, ergebnis["features"], ergebnis["crs"])
+            return True, dict(ergebnis, features=features)
+
+        except SucheAbgebrochen:
+            return False, "Suche abgebrochen"
+        except WfsStreamFehler as e:
+            return False, str(e)
+        except requests.exceptions.Timeout:
+            return False, "Timeout: Server antwortet nicht"
+        except requests.exceptions.RequestException as e:
+            return False, f"Netzwerkfehler: {str(e)}"
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Fehler Punktsuche: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Unerwarteter Fehler: {str(e)}"
+
+    def bereite_anfrage_vor(self, bundesland, gemarkung_name, flur_text, zaehler_text, nenner_text):
+        """Prüft Eingaben, löst die Gemarkung auf und erstellt die WFS-URL"""
+
+        if not bundesland or not gemarkung_name or not flur_text or not zaehler_text:
+            return False, "Bitte alle Pflichtfelder ausfüllen!"
+
+        if bundesland == ALLE_BUNDESLAENDER:
+            return self.bereite_anfrage_alle_vor(gemarkung_name, flur_text, zaehler_text, nenner_text)
+
+        try:
+            gemarkungen_data = self.get_gemarkungen_for_bundesland(bundesland)
+            if not gemarkungen_data:
+                return False, f"Keine Gemarkungsdaten für {bundesland} gefunden!"
+
+            gem_schluessel, gem_full_name = self.find_gemarkung_by_name(gemarkung_name, gemarkungen_data)
+            if not gem_schluessel:
+                return False, gem_full_name or f"Gemarkung '{gemarkung_name}' nicht gefunden!"
+
+            if not self.validate_gemarkungsschluessel(gem_schluessel, bundesland):
+                return False, "Ungültiger Gemarkungsschlüssel!"
+
+            int(flur_text)
+            int(zaehler_text)
+            if nenner_text:
+                int(nenner_text)
+
+            flur = flur_text.zfill(3)
+            zaehler = zaehler_text.zfill(5)
+
+            wfs_url = self.wfs_urls.get(bundesland)
+            if not wfs_url:
+                return False, f"Keine WFS-URL für {bundesland} konfiguriert!"
+            self.wende_profil_an(bundesland, proben=False)
+
+            anfrage = {
+                "bundesland": bundesland,
+                "gem_schluessel": gem_schluessel,
+                "gem_full_name": gem_full_name,
+                "flur_text": flur_text,
+                "zaehler_text": zaehler_text,
+                "nenner_text": nenner_text,
+                "wfs_url": wfs_url,
+                "flstkennz": None,
+                "rlp_filter": None,
+                "profil": self.abfrage_profil_name("einzel"),
+            }
+
+            if bundesland == "Rheinland-Pfalz":
+                gemarkung_value = gemarkungen_data[gem_schluessel]["name"]
+                anfrage["rlp_filter"] = (gemarkung_value, f"Flur {flur_text}", zaehler_text, nenner_text)
+                anfrage["url"] = self.erstelle_anfrage_url(anfrage)
+                return True, anfrage
+
+            anfrage["flstkennz"] = self.erstelle_flurstueckskennzeichen(bundesland, gem_schluessel, flur, zaehler,
+                                                                        nenner_text)
+            anfrage["url"] = self.erstelle_anfrage_url(anfrage)
+            return True, anfrage
+
+        except ValueError:
+            return False, "Bitte nur Zahlen für Flur, Zähler und Nenner eingeben!"
+        except Exception as e:
+            return False, f"Fehler bei der Eingabeverarbeitung: {str(e)}"
+
+    def protokolliere_anfrage(self, anfrage):
+        """Schreibt Kennzeichen und WFS-URL einer Einzelsuche ins Protokoll
+
+        Nur für die interaktive Suche; Stapelsuchen protokollieren am Ende
+        eine Zusammenfassung.
+        """
+        for kandidat in anfrage.get("kandidaten") or [anfrage]:
+            if kandidat["flstkennz"]:
+                QgsMessageLog.logMessage(f"Suche Flurstück: {kandidat['flstkennz']}", "Flurstück-Suche")
+            QgsMessageLog.logMessage(f"WFS-URL: {kandidat['url']}", "Flurstück-Suche")
+
+    def bereite_anfrage_alle_vor(self, gemarkung_name, flur_text, zaehler_text, nenner_text):
+        """Wie bereite_anfrage_vor, aber mit der Gemarkung in allen Bundesländern
+
+        Passt die Gemarkung in genau einem Land, entsteht eine gewöhnliche
+        Anfrage. Sonst enthält die Anfrage des ersten Kandidaten unter
+        "kandidaten" die Anfragen aller Länder; lade_erstes_flurstueck ruft
+        sie gleichzeitig ab.
+        """
+        kandidaten = self.katalog.kandidaten(gemarkung_name)
+        if not kandidaten:
+            return False, f"Gemarkung '{gemarkung_name}' in keinem Bundesland gefunden!"
+        meldung = self.pruefe_mehrdeutig(gemarkung_name, kandidaten)
+        if meldung:
+            return False, meldung
+
+        anfragen = []
+        for bundesland, _, gem_full_name in kandidaten:
+            success, anfrage = self.bereite_anfrage_vor(bundesland, gem_full_name, flur_text, zaehler_text,
+                                                        nenner_text)
+            if not success:
+                return False, anfrage
+            anfragen.append(anfrage)
+
+        if len(anfragen) == 1:
+            return True, anfragen[0]
+
+        QgsMessageLog.logMessage(
+            f"Gemarkung '{gemarkung_name}' in {len(anfragen)} Bundesländern: "
+            f"{', '.join(self.bundesland_kuerzel(a['bundesland']) for a in anfragen)}",
+            "Flurstück-Suche"
+        )
+        return True, dict(anfragen[0], kandidaten=anfragen)
+
+    def ermittle_bundesland(self, gemarkung_name):
+        """Bundesland einer Gemarkung, wenn es eindeutig ist; sonst (False, meldung)"""
+        kandidaten = self.katalog.kandidaten(gemarkung_name)
+        if not kandidaten:
+            return False, f"Gemarkung '{gemarkung_name}' in keinem Bundesland gefunden!"
+        meldung = self.pruefe_mehrdeutig(gemarkung_name, kandidaten)
+        if meldung:
+            return False, meldung
+        if len(kandidaten) > 1:
+            laender = ", ".join(bundesland for bundesland, _, _ in kandidaten)
+            return False, f"Gemarkung '{gemarkung_name}' gibt es in mehreren Bundesländern ({laender}), " \
+                          f"bitte Bundesland wählen!"
+        return True, kandidaten[0]
+
+    def pruefe_mehrdeutig(self, gemarkung_name, kandidaten):
+        """Meldung, wenn die Gemarkung in einem Land auf mehrere Gemarkungen passt; sonst None"""
+        laender = [bundesland for bundesland, _, _ in kandidaten]
+        if len(set(laender)) == len(laender):
+            return None
+        namen = ", ".join(f"{full_name} – {bundesland}" for bundesland, _, full_name in kandidaten)
+        return f"Gemarkung '{gemarkung_name}' ist mehrdeutig ({namen}), bitte auswählen!"
+
+    def bereite_bereich_vor(self, bundesland, gemarkung_name, flur_text=""):
+        """Prüft Eingaben und erstellt den Filter für eine ganze Flur bzw. Gemarkung"""
+        if not bundesland or not gemarkung_name:
+            return False, "Bitte Bundesland und Gemarkung angeben!"
+
+        if bundesland == ALLE_BUNDESLAENDER:
+            success, kandidat = self.ermittle_bundesland(gemarkung_name)
+            if not success:
+                return False, kandidat
+            bundesland, _, gemarkung_name = kandidat
+
+        try:
+            gemarkungen_data = self.get_gemarkungen_for_bundesland(bundesland)
+            if not gemarkungen_data:
+                return False, f"Keine Gemarkungsdaten für {bundesland} gefunden!"
+
+            gem_schluessel, gem_full_name = self.find_gemarkung_by_name(gemarkung_name, gemarkungen_data)
+            if not gem_schluessel:
+                return False, gem_full_name or f"Gemarkung '{gemarkung_name}' nicht gefunden!"
+
+            if not self.validate_gemarkungsschluessel(gem_schluessel, bundesland):
+                return False, "Ungültiger Gemarkungsschlüssel!"
+
+            if flur_text:
+                int(flur_text)
+
+            wfs_url = self.wfs_urls.get(bundesland)
+            self.wende_profil_an(bundesland, proben=False)
+            cfg = self.wfs_config.get(bundesland)
+            if not wfs_url or not cfg:
+                return False, f"Keine WFS-URL für {bundesland} konfiguriert!"
+
+            if bundesland == "Rheinland-Pfalz":
+                werte = [("gemarkung", gemarkungen_data[gem_schluessel]["name"])]
+                if flur_text:
+                    werte.append(("flur", f"Flur {flur_text}"))
+                filter_xml = self.erstelle_bereich_filter_rlp(werte)
+            else:
+                # flstkennz beginnt mit Gemarkungsschlüssel und dreistelliger Flur
+                praefix = gem_schluessel + (flur_text.zfill(3) if flur_text else "")
+                filter_xml = self.erstelle_bereich_filter(praefix, cfg)
+
+            QgsMessageLog.logMessage(f"Bereichsdownload: {bundesland} {gem_full_name} Flur {flur_text or 'alle'}",
+                                     "Flurstück-Suche")
+            return True, {
+                "bundesland": bundesland,
+                "gem_schluessel": gem_schluessel,
+                "gem_full_name": gem_full_name,
+                "flur_text": flur_text,
+                "wfs_url": wfs_url,
+                "filter_xml": filter_xml,
+                "profil": self.abfrage_profil_name("massen"),
+            }
+
+        except ValueError:
+            return False, "Bitte nur Zahlen für die Flur eingeben!"
+        except Exception as e:
+            return False, f"Fehler bei der Eingabeverarbeitung: {str(e)}"
+
+    def erstelle_bereich_filter(self, praefix, cfg):
+        """PropertyIsLike-Filter auf den Anfang des flstkennz"""
+        return self.erstelle_praefix_filter([praefix], cfg)
+
+    def erstelle_praefix_filter(self, praefixe, cfg):
+        """Or-Filter aus PropertyIsLike-Bedingungen auf Anfänge des flstkennz"""
+        if cfg["filter_ns"] == "fes":
+            prefix, ns, property_tag = "fes", "http://www.opengis.net/fes/2.0", "ValueReference"
+        else:
+            prefix, ns, property_tag = "ogc", "http://www.opengis.net/ogc", "PropertyName"
+
+        bedingungen = [
+            f'<{prefix}:PropertyIsLike wildCard="*" singleChar="?" escapeChar="!">'
+            f'<{prefix}:{property_tag}>ave:flstkennz</{prefix}:{property_tag}>'
+            f'<{prefix}:Literal>{escape(praefix)}*</{prefix}:Literal></{prefix}:PropertyIsLike>'
+            for praefix in praefixe
+        ]
+        inhalt = bedingungen[0] if len(bedingungen) == 1 else f"<{prefix}:Or>{''.join(bedingungen)}</{prefix}:Or>"
+        return f'<{prefix}:Filter xmlns:{prefix}="{ns}" xmlns:ave="{AVE_NAMESPACE}">{inhalt}</{prefix}:Filter>'
+
+    def erstelle_bereich_filter_rlp(self, werte):
+        """Filter auf Gemarkung (und Flur) für Rheinland-Pfalz"""
+        bedingungen = "".join(
+            f"<PropertyIsEqualTo><ValueReference>{name}</ValueReference>"
+            f"<Literal>{escape(str(wert))}</Literal></PropertyIsEqualTo>"
+            for name, wert in werte
+        )
+        inhalt = bedingungen if len(werte) == 1 else f"<And>{bedingungen}</And>"
+        return f'<Filter xmlns="http://www.opengis.net/fes/2.0">{inhalt}</Filter>'
+
+    def erstelle_bereich_layer_name(self, anfrage):
+        """Layername für den Download einer Flur oder Gemarkung"""
+        ortsteil = anfrage["gem_full_name"].split('(')[0].strip()
+        name = f"{BUNDESLAND_KUERZEL.get(anfrage['bundesland'], '')} - {ortsteil}"
+        if anfrage["flur_text"]:
+            return f"{name} - Flur {anfrage['flur_text']}"
+        return f"{name} - alle Fluren"
+
+    @erfasst("einzel")
+    def lade_flurstueck(self, anfrage, fortschritt=None, abgebrochen=None):
+        """Ruft ein vorbereitetes Flurstück ab, ohne einen Layer anzulegen
+
+        Gibt (True, ergebnis) mit den Schlüsseln "felder", "crs" und "features"
+        oder (False, meldung) zurück. Bei GML/GeoJSON-Antworten enthält
+        ergebnis statt der Feature-Liste unter "layer" den beim Download
+        befüllten Memory-Layer; er wird erst am Ende, nach Cache, Vorabruf
+        und Weitergabe an wartende Aufrufer, an den Hauptthread übergeben.
+        Kann aus einem Hintergrund-Task aufgerufen werden; fortschritt
+        erhält Werte von 0 bis 100.
+
+        Zuerst wird der lokale Bestand gefragt (importierte Massendaten),
+        dann der Cache. Gültige Cache-Einträge werden ohne Netzwerkzugriff
+        geliefert; abgelaufene nur, wenn der Landesdienst nicht antwortet.
+        Läuft für dasselbe Flurstück bereits ein Abruf, wird dessen Ergebnis
+        mitgenutzt.
+        """
+        if not anfrage.get("cache_umgehen"):
+            with self.metriken.stufe("bestand"):
+                bestand_eintrag = self.bestand.hole(anfrage)
+            if bestand_eintrag is not None:
+                return True, bestand_eintrag
+
+        cache_eintrag = None
+        if not anfrage.get("cache_umgehen") and self.cache.aktiv:
+            cache_eintrag = self.cache.hole(self.cache_schluessel(anfrage), abgelaufen_erlaubt=True)
+            self.metriken.vermerke_cache(anfrage["bundesland"],
+                                         cache_eintrag is not None and not cache_eintrag["abgelaufen"])
+            if cache_eintrag is not None and not cache_eintrag["abgelaufen"]:
+                QgsMessageLog.logMessage(
+                    f"Cache-Treffer: {self.cache_schluessel(anfrage)} "
+                    f"(Treffer {self.cache.treffer}, Fehlschläge {self.cache.fehlschlaege})",
+                    "Flurstück-Suche"
+                )
+                return True, cache_eintrag
+
+        geteilt, ergebnis = self.laufende_abrufe.fuehre_aus(
+            self.cache_schluessel(anfrage),
+            lambda: self.lade_flurstueck_vom_wfs(anfrage, cache_eintrag, fortschritt, abgebrochen),
+            abgebrochen,
+            self.teile_ergebnis
+        )
+        if ergebnis is None:
+            return False, "Suche abgebrochen"
+        success, ergebnis = ergebnis
+        if not geteilt:
+            if success and ergebnis.get("layer") is not None:
+                verschiebe_in_hauptthread(ergebnis["layer"])
+            return success, ergebnis
+
+        QgsMessageLog.logMessage(f"Laufenden Abruf mitgenutzt: {self.cache_schluessel(anfrage)}", "Flurstück-Suche")
+        if success:
+            ergebnis = dict(ergebnis, features=list(ergebnis["features"]))
+        if fortschritt:
+            fortschritt(100)
+        return success, ergebnis
+
+    def teile_ergebnis(self, ergebnis):
+        """Thread-neutrale Kopie eines Abrufergebnisses für wartende Aufrufer
+
+        Läuft im Thread des Führenden, der den Layer erzeugt hat, bevor
+        lade_flurstueck ihn an den Hauptthread übergibt; den Layer selbst
+        behält der Führende. Felder, KBS und Ausdehnung liegen bereits als
+        einfache Werte vor, kopiert werden nur die Features.
+        """
+        success, ergebnis = ergebnis
+        if success and ergebnis.get("layer") is not None:
+            ergebnis = dict(ergebnis, layer=None, features=list(ergebnis["layer"].getFeatures()))
+        return success, ergebnis
+
+    def lade_flurstueck_vom_wfs(self, anfrage, cache_eintrag=None, fortschritt=None, abgebrochen=None):
+        """Abruf eines Flurstücks beim WFS (Teil von lade_flurstueck)
+
+        cache_eintrag ist ein abgelaufener Cache-Eintrag, der geliefert
+        wird, wenn der Landesdienst nicht antwortet. Nach einem Treffer
+        wird der Vorabruf der Umgebung geplant.
+        """
+        try:
+            if self.wende_profil_an(anfrage["bundesland"]):
+                anfrage["url"] = self.erstelle_anfrage_url(anfrage)
+            download_fortschritt = (lambda wert: fortschritt(wert * 0.8)) if fortschritt else None
+            response = self.sende_wfs_request(anfrage["url"], bundesland=anfrage["bundesland"], stream_lesen=True)
+            try:
+                if response.status_code != 200:
+                    if cache_eintrag is not None and response.status_code >= 500:
+                        return True, cache_eintrag
+                    return False, f"Fehler beim Abruf: HTTP {response.status_code}"
+
+                layer_name = self.erstelle_layer_name(anfrage["bundesland"], anfrage["gem_full_name"],
+                                                      anfrage["flur_text"], anfrage["zaehler_text"],
+                                                      anfrage["nenner_text"])
+                success, ergebnis = self.lese_antwort_stream(response, download_fortschritt, abgebrochen,
+                                                             layer_name=layer_name, profil=anfrage.get("profil"),
+                                                             bundesland=anfrage["bundesland"])
+            except WfsStreamFehler as e:
+                if anfrage["bundesland"] in self.stream_gesperrt:
+                    return False, str(e)
+                QgsMessageLog.logMessage(
+                    f"Stream-Dekodierung für {anfrage['bundesland']} fehlgeschlagen, "
+                    f"verwende Shapefile: {str(e)}",
+                    "Flurstück-Suche",
+                    Qgis.Warning
+                )
+                self.stream_gesperrt.add(anfrage["bundesland"])
+                anfrage["url"] = self.erstelle_anfrage_url(anfrage)
+                return self.lade_flurstueck_vom_wfs(anfrage, cache_eintrag, fortschritt, abgebrochen)
+            finally:
+                response.close()
+
+            if success and self.cache.aktiv:
+                cache_ergebnis = ergebnis
+                if ergebnis.get("layer") is not None:
+                    cache_ergebnis = dict(ergebnis, features=ergebnis["layer"].getFeatures())
+                self.cache.speichere(self.cache_schluessel(anfrage), anfrage["bundesland"], cache_ergebnis)
+            if success:
+                # Noch im Thread des Layers; lade_flurstueck übergibt ihn erst danach
+                self.vorabruf.plane(anfrage, ergebnis)
+            if fortschritt:
+                fortschritt(100)
+            return success, ergebnis
+
+        except SucheAbgebrochen:
+            return False, "Suche abgebrochen"
+        except requests.exceptions.Timeout:
+            if cache_eintrag is not None:
+                return True, cache_eintrag
+            return False, "Timeout: Server antwortet nicht"
+        except requests.exceptions.RequestException as e:
+            if cache_eintrag is not None:
+                return True, cache_eintrag
+            return False, f"Netzwerkfehler: {str(e)}"
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Fehler: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Unerwarteter Fehler: {str(e)}"
+
+    def lade_erstes_flurstueck(self, anfragen, fortschritt=None, abgebrochen=None):
+        """Ruft dieselbe Anfrage in mehreren Bundesländern gleichzeitig ab
+
+        Das erste erfolgreiche Ergebnis gewinnt; die übrigen Abrufe werden
+        über ihr abgebrochen-Callback beendet, ohne auf sie zu warten. Gibt
+        (True, ergebnis) mit der erfolgreichen Anfrage unter "anfrage" oder
+        (False, meldung) zurück.
+        """
+        gefunden = threading.Event()
+
+        def beendet():
+            return gefunden.is_set() or bool(abgebrochen and abgebrochen())
+
+        def lade(anfrage):
+            # Verlierer zählen nicht als fehlgeschlagene Suche
+            with self.metriken.messung(anfrage["bundesland"]) as messung:
+                success, ergebnis = self.lade_flurstueck(anfrage, abgebrochen=beendet)
+                messung.verworfen = not success and gefunden.is_set()
+                return success, ergebnis
+
+        pool = ThreadPoolExecutor(max_workers=len(anfragen))
+        try:
+            futures = {pool.submit(lade, anfrage): anfrage for anfrage in anfragen}
+            meldungen = []
+            for erledigt, future in enumerate(as_completed(futures), start=1):
+                anfrage = futures[future]
+                try:
+                    success, ergebnis = future.result()
+                except Exception as e:
+                    success, ergebnis = False, f"Unerwarteter Fehler: {str(e)}"
+                if success:
+                    gefunden.set()
+                    QgsMessageLog.logMessage(f"Flurstück gefunden in {anfrage['bundesland']}", "Flurstück-Suche")
+                    if fortschritt:
+                        fortschritt(100)
+                    return True, dict(ergebnis, anfrage=anfrage)
+
+                meldungen.append(f"{self.bundesland_kuerzel(anfrage['bundesland'])}: {ergebnis}")
+                if fortschritt:
+                    fortschritt(100 * erledigt / len(anfragen))
+                if abgebrochen and abgebrochen():
+                    return False, "Suche abgebrochen"
+        finally:
+            gefunden.set()
+            pool.shutdown(wait=False)
+
+        return False, "Flurstück in keinem Bundesland gefunden (" + "; ".join(meldungen) + ")"
+
+    def cache_schluessel(self, anfrage):
+        """Cache-Schlüssel aus Bundesland und flstkennz bzw. RLP-Filter
+
+        Reduzierte Abfrageprofile erhalten eigene Einträge, damit ein
+        vollständiger Abruf nie aus einem reduzierten bedient wird.
+        """
+        if anfrage["rlp_filter"]:
+            schluessel = "|".join((anfrage["bundesland"],) + self.normiere_rlp_schluessel(*anfrage["rlp_filter"]))
+        else:
+            schluessel = f"{anfrage['bundesland']}|{anfrage['flstkennz']}"
+        profil = anfrage.get("profil") or "vollstaendig"
+        if profil != "vollstaendig":
+            schluessel += f"|{profil}"
+        return schluessel
+
+    def abfrage_profil_name(self, art):
+        """Name des Abfrageprofils für "einzel" (Suche) bzw. "massen" (Stapel, Bereich, Ausschnitt)
+
+        Einstellbar über alkis_suchmodul/abfrage/einzel und
+        alkis_suchmodul/abfrage/massen; Standard ist "vollstaendig".
+        """
+        name = QSettings().value(f"alkis_suchmodul/abfrage/{art}", "vollstaendig")
+        return name if name in ABFRAGE_PROFILE else "vollstaendig"
+
+    def abfrage_profil(self, name):
+        """Einstellungen eines Abfrageprofils (unbekannte Namen: vollständig)"""
+        return ABFRAGE_PROFILE.get(name or "vollstaendig", ABFRAGE_PROFILE["vollstaendig"])
+
+    def projektion(self, cfg, profil):
+        """Eigenschaftsnamen für PROPERTYNAME oder None (alle Eigenschaften)
+
+        Projiziert wird nur, wenn DescribeFeatureType die Eigenschaften und
+        die Geometrie-Eigenschaft des Endpunkts geliefert hat; sonst könnte
+        eine unbekannte Eigenschaft den ganzen Request scheitern lassen.
+        """
+        eigenschaften = self.abfrage_profil(profil)["eigenschaften"]
+        if not eigenschaften or not cfg.get("geometrie"):
+            return None
+        namen = [name for name in cfg["eigenschaften"] if name in eigenschaften] + [cfg["geometrie"]]
+        if cfg["filter_ns"] == "fes_rlp":
+            return namen
+        return [f"ave:{name}" for name in namen]
+
+    def sende_wfs_request(self, url, daten=None, fortschritt=None, abgebrochen=None, bundesland=None,
+                          stream_lesen=False):
+        """Sendet einen GetFeature-Request an den WFS (GET oder XML-POST)
+
+        Der Request läuft über die Session des Endpunkts (Keep-Alive, Retry,
+        Ratenbegrenzung je Bundesland). Die Antwort wird blockweise gelesen,
+        damit ein Download abgebrochen und der Fortschritt (0-100) gemeldet
+        werden kann. Mit stream_lesen wird die Antwort ungelesen
+        zurückgegeben; der Aufrufer liest sie über lese_antwort_stream und
+        schließt sie.
+        """
+        with self.metriken.stufe("http"):
+            if daten is not None:
+                response = self.http.request("POST", url, bundesland, data=daten.encode('utf-8'), timeout=30,
+                                             stream=True, headers={"Content-Type": "text/xml; charset=utf-8"})
+            else:
+                response = self.http.request("GET", url, bundesland, timeout=30, stream=True)
+
+        if stream_lesen:
+            return response
+
+        try:
+            response._content = b"".join(self.antwort_bloecke(response, fortschritt, abgebrochen))
+        finally:
+            response.close()
+
+        return response
+
+    def antwort_bloecke(self, response, fortschritt=None, abgebrochen=None):
+        """Liefert die Antwort in 64-KB-Blöcken; prüft Abbruch und meldet Fortschritt
+
+        Die Wartezeit auf jeden Block zählt als Stufe download.
+        """
+        gesamt = int(response.headers.get('Content-Length') or 0)
+        geladen = 0
+        inhalt = response.iter_content(chunk_size=65536)
+        while True:
+            with self.metriken.stufe("download"):
+                block = next(inhalt, None)
+            if block is None:
+                break
+            if abgebrochen and abgebrochen():
+                raise SucheAbgebrochen()
+            geladen += len(block)
+            self.metriken.zaehle_bytes(len(block))
+            if fortschritt and gesamt:
+                fortschritt(min(100, 100 * geladen / gesamt))
+            yield block
+
+    def lese_antwort_stream(self, response, fortschritt=None, abgebrochen=None, layer_name=None, profil=None,
+                            bundesland=None):
+        """Liest eine noch offene WFS-Antwort
+
+        GML- und GeoJSON-Antworten werden während des Downloads dekodiert,
+        mit layer_name direkt in einen Memory-Layer. Andere Antworten
+        (Shapefile-ZIP) werden vollständig geladen und über
+        lese_wfs_antwort gelesen. Die Geometrien werden nach dem
+        Abfrageprofil reduziert. Wirft WfsStreamFehler, wenn die Antwort
+        nicht dekodiert werden kann. Die Feldtypen kommen aus dem
+        WFS-Profil des Bundeslands, damit Stream und Shapefile dasselbe
+        Schema liefern.
+        """
+        bloecke = self.antwort_bloecke(response, fortschritt, abgebrochen)
+        art = self.stream_art(response)
+        if art is None:
+            response._content = b"".join(bloecke)
+            return self.lese_wfs_antwort(response, profil)
+
+        einstellungen = self.abfrage_profil(profil)
+        typen = self.wfs_config.get(bundesland, {}).get("feld_typen")
+        decoder = WfsStreamDecoder(art, raster=einstellungen["raster"], toleranz=einstellungen["toleranz"],
+                                   typen=typen)
+        with self.metriken.stufe("dekodierung"):
+            if layer_name:
+                return decoder.lade_in_layer(bloecke, layer_name)
+            return decoder.lade_ergebnis(bloecke)
+
+    def stream_art(self, response):
+        """"geojson" oder "gml", wenn die Antwort gestreamt dekodiert werden kann"""
+        content_type = response.headers.get('Content-Type', '').lower()
+        if 'json' in content_type:
+            return "geojson"
+        if 'gml' in content_type or self.ist_xml_antwort(response):
+            return "gml"
+        return None
+
+    def ausgabeformat(self, bundesland):
+        """OUTPUTFORMAT eines Bundeslands: Stream-Format, sonst Shapefile-ZIP
+
+        Abschaltbar über QSettings alkis_suchmodul/decode/stream.
+        """
+        cfg = self.wfs_config[bundesland]
+        if (cfg.get("stream_format") and bundesland not in self.stream_gesperrt
+                and QSettings().value("alkis_suchmodul/decode/stream", True, type=bool)):
+            return cfg["stream_format"]
+        return cfg["output_format"]
+
+    def erstelle_sammel_requests(self, bundesland, anfragen):
+        """Fasst vorbereitete Anfragen eines Bundeslands zu Sammel-Requests zusammen
+
+        Die Anfragen werden per Or-Filter kombiniert und so gestückelt, dass
+        je Request höchstens max_filter Bedingungen enthalten sind. Wird die
+        URL zu lang, wird auf POST ausgewichen oder der Block verkleinert.
+        """
+        self.wende_profil_an(bundesland)
+        cfg = self.wfs_config.get(bundesland)
+        wfs_url = self.wfs_urls.get(bundesland)
+        if not cfg or not wfs_url:
+            return []
+        profil = anfragen[0].get("profil") if anfragen else None
+
+        requests_liste = []
+        start = 0
+        while start < len(anfragen):
+            groesse = min(cfg["max_filter"], len(anfragen) - start)
+            while True:
+                block = anfragen[start:start + groesse]
+                filter_xml = self.erstelle_sammel_filter(block, cfg)
+                url = self.erstelle_getfeature_url(wfs_url, cfg, filter_xml, self.ausgabeformat(bundesland), profil)
+                if len(url) <= cfg["max_url_laenge"]:
+                    request = {"methode": "GET", "url": url, "daten": None}
+                    break
+                if cfg["post"]:
+                    request = {"methode": "POST", "url": wfs_url,
+                               "daten": self.erstelle_getfeature_post(cfg, filter_xml, self.ausgabeformat(bundesland),
+                                                                      profil)}
+                    break
+                if groesse == 1:
+                    request = {"methode": "GET", "url": url, "daten": None}
+                    break
+                groesse = max(1, groesse // 2)
+
+            request["bundesland"] = bundesland
+            request["anfragen"] = block
+            request["profil"] = profil
+            requests_liste.append(request)
+            start += groesse
+
+        QgsMessageLog.logMessage(
+            f"{len(anfragen)} Flurstücke in {len(requests_liste)} Sammel-Requests ({bundesland})",
+            "Flurstück-Suche"
+        )
+        return requests_liste
+
+    def erstelle_sammel_filter(self, anfragen, cfg):
+        """Erstellt einen Or-Filter über mehrere Flurstücke"""
+        if cfg["filter_ns"] == "fes_rlp":
+            bedingungen = []
+            for anfrage in anfragen:
+                gemarkung, flur, zaehler, nenner = anfrage["rlp_filter"]
+                werte = [("gemarkung", gemarkung), ("flur", flur), ("flstnrzae", zaehler)]
+                if nenner and nenner.strip():
+                    werte.append(("flstnrnen", nenner))
+                bedingungen.append("<And>" + "".join(
+                    f"<PropertyIsEqualTo><ValueReference>{name}</ValueReference>"
+                    f"<Literal>{escape(str(wert))}</Literal></PropertyIsEqualTo>"
+                    for name, wert in werte
+                ) + "</And>")
+            inhalt = bedingungen[0] if len(bedingungen) == 1 else f"<Or>{''.join(bedingungen)}</Or>"
+            return f'<Filter xmlns="http://www.opengis.net/fes/2.0">{inhalt}</Filter>'
+
+        if cfg["filter_ns"] == "fes":
+            prefix, ns, property_tag = "fes", "http://www.opengis.net/fes/2.0", "ValueReference"
+        else:
+            prefix, ns, property_tag = "ogc", "http://www.opengis.net/ogc", "PropertyName"
+
+        bedingungen = [
+            f"<{prefix}:PropertyIsEqualTo><{prefix}:{property_tag}>ave:flstkennz</{prefix}:{property_tag}>"
+            f"<{prefix}:Literal>{escape(anfrage['flstkennz'])}</{prefix}:Literal></{prefix}:PropertyIsEqualTo>"
+            for anfrage in anfragen
+        ]
+        inhalt = bedingungen[0] if len(bedingungen) == 1 else f"<{prefix}:Or>{''.join(bedingungen)}</{prefix}:Or>"
+        return (f'<{prefix}:Filter xmlns:{prefix}="{ns}" xmlns:ave="{AVE_NAMESPACE}">'
+                f'{inhalt}</{prefix}:Filter>')
+
+    def erstelle_getfeature_url(self, wfs_url, cfg, filter_xml, ausgabeformat=None, profil=None):
+        """Erstellt eine GetFeature-URL mit Filter (ohne filter_xml ungefiltert)
+
+        Mit einem reduzierten Abfrageprofil werden nur dessen Eigenschaften
+        per PROPERTYNAME angefordert.
+        """
+        url = f"{wfs_url}?SERVICE=WFS&VERSION={cfg['version']}"
+        url += f"&REQUEST=GetFeature&{cfg['typename']}=ave:Flurstueck"
+        if self.sende_srsname(cfg, ausgabeformat):
+            url += "&SRSNAME=urn:ogc:def:crs:EPSG::25832"
+        url += f"&OUTPUTFORMAT={urllib.parse.quote(ausgabeformat or cfg['output_format'])}"
+        namen = self.projektion(cfg, profil)
+        if namen:
+            url += f"&PROPERTYNAME={urllib.parse.quote(','.join(namen))}"
+        if filter_xml:
+            url += f"&FILTER={urllib.parse.quote(filter_xml)}"
+        return url
+
+    def sende_srsname(self, cfg, ausgabeformat=None):
+        """Wird SRSNAME (EPSG:25832) mitgeschickt?
+
+        Nur bei WFS 2.0 und nur für das Stream-Format (GeoJSON nennt das
+        KBS sonst nicht) oder wenn die Konfiguration es verlangt (RLP);
+        Shapefile-Requests der übrigen Länder bleiben unverändert.
+        """
+        if not cfg["version"].startswith("2"):
+            return False
+        return bool(cfg.get("srsname")) or (ausgabeformat or cfg["output_format"]) == cfg.get("stream_format")
+
+    def erstelle_bbox_url(self, bundesland, xmin, ymin, xmax, ymax, profil=None, start=0, anzahl=None):
+        """GetFeature-URL für ein Rechteck in EPSG:25832 (BBOX-Parameter)
+
+        Mit anzahl wird nur die Ergebnisseite ab start angefordert.
+        """
+        cfg = self.wfs_config[bundesland]
+        url = self.erstelle_getfeature_url(self.wfs_urls[bundesland], cfg, None, self.ausgabeformat(bundesland),
+                                           profil)
+        if anzahl:
+            url += self.seiten_parameter(cfg, start, anzahl)
+        crs = "urn:ogc:def:crs:EPSG::25832" if cfg["version"].startswith("2") else "EPSG:25832"
+        return url + f"&BBOX={xmin:.2f},{ymin:.2f},{xmax:.2f},{ymax:.2f},{crs}"
+
+    def erstelle_seiten_url(self, wfs_url, cfg, filter_xml, start=0, anzahl=None, ausgabeformat=None,
+                            nur_anzahl=False, profil=None):
+        """GetFeature-URL für eine Ergebnisseite (COUNT/STARTINDEX bzw. MAXFEATURES)
+
+        Mit nur_anzahl wird per resultType=hits nur die Trefferzahl abgefragt.
+        WFS 1.1 kennt kein STARTINDEX; es wird trotzdem mitgeschickt, da
+        viele Server es als Erweiterung auswerten.
+        """
+        url = self.erstelle_getfeature_url(wfs_url, cfg, filter_xml, ausgabeformat, profil)
+        if nur_anzahl:
+            return url + "&RESULTTYPE=hits"
+        return url + self.seiten_parameter(cfg, start, anzahl)
+
+    def seiten_parameter(self, cfg, start, anzahl):
+        """COUNT/STARTINDEX (WFS 2.0) bzw. MAXFEATURES/STARTINDEX (WFS 1.1) einer Ergebnisseite"""
+        if cfg["version"].startswith("2"):
+            return f"&COUNT={anzahl}&STARTINDEX={start}"
+        return f"&MAXFEATURES={anzahl}&STARTINDEX={start}"
+
+    def erstelle_getfeature_post(self, cfg, filter_xml, ausgabeformat=None, profil=None):
+        """Erstellt den XML-Body für einen GetFeature-POST"""
+        if cfg["version"].startswith("2"):
+            wfs_ns, typename_attr = "http://www.opengis.net/wfs/2.0", "typeNames"
+        else:
+            wfs_ns, typename_attr = "http://www.opengis.net/wfs", "typeName"
+        srs = ' srsName="urn:ogc:def:crs:EPSG::25832"' if self.sende_srsname(cfg, ausgabeformat) else ""
+        # Projektion: wfs:PropertyName-Elemente vor dem Filter (WFS 1.1 und 2.0)
+        eigenschaften = "".join(f"<wfs:PropertyName>{escape(name)}</wfs:PropertyName>"
+                                for name in self.projektion(cfg, profil) or [])
+        return (f'<?xml version="1.0" encoding="UTF-8"?>'
+                f'<wfs:GetFeature xmlns:wfs="{wfs_ns}" xmlns:ave="{AVE_NAMESPACE}" service="WFS" '
+                f'version="{cfg["version"]}" outputFormat="{escape(ausgabeformat or cfg["output_format"])}">'
+                f'<wfs:Query {typename_attr}="ave:Flurstueck"{srs}>{eigenschaften}{filter_xml}</wfs:Query>'
+                f'</wfs:GetFeature>')
+
+    @erfasst("stapel")
+    def lade_sammel_request(self, request, abgebrochen=None):
+        """Ruft einen Sammel-Request ab und ordnet die Features den Anfragen zu
+
+        Gibt (True, ergebnis) zurück; ergebnis["zuordnung"] enthält je Anfrage
+        (in Request-Reihenfolge) die Liste der zugehörigen Features.
+        """
+        try:
+            response = self.sende_wfs_request(request["url"], request["daten"], bundesland=request["bundesland"],
+                                              stream_lesen=True)
+            try:
+                if response.status_code != 200:
+                    return False, f"Fehler beim Abruf: HTTP {response.status_code}"
+
+                success, ergebnis = self.lese_antwort_stream(response, abgebrochen=abgebrochen,
+                                                             profil=request.get("profil"),
+                                                             bundesland=request["bundesland"])
+            except WfsStreamFehler as e:
+                bundesland = request["bundesland"]
+                if bundesland in self.stream_gesperrt:
+                    return False, str(e)
+                QgsMessageLog.logMessage(
+                    f"Stream-Dekodierung für {bundesland} fehlgeschlagen, verwende Shapefile: {str(e)}",
+                    "Flurstück-Suche",
+                    Qgis.Warning
+                )
+                self.stream_gesperrt.add(bundesland)
+                return self.lade_sammel_requests_erneut(request, abgebrochen)
+            finally:
+                response.close()
+
+            if not success:
+                # Leere Antwort: keines der Flurstücke existiert
+                if ergebnis.startswith("Keine Geometrien"):
+                    ergebnis = {"felder": None, "crs": None, "features": []}
+                else:
+                    return False, ergebnis
+
+            ergebnis["zuordnung"] = self.ordne_features_zu(request, ergebnis["features"])
+            if self.cache.aktiv and ergebnis["felder"] is not None:
+                for anfrage, features in zip(request["anfragen"], ergebnis["zuordnung"]):
+                    if features:
+                        self.cache.speichere(self.cache_schluessel(anfrage), request["bundesland"], {
+                            "felder": ergebnis["felder"], "crs": ergebnis["crs"], "features": features
+                        })
+            return True, ergebnis
+
+        except SucheAbgebrochen:
+            return False, "Suche abgebrochen"
+        except requests.exceptions.Timeout:
+            return False, "Timeout: Server antwortet nicht"
+        except requests.exceptions.RequestException as e:
+            return False, f"Netzwerkfehler: {str(e)}"
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Fehler Sammel-Request: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Unerwarteter Fehler: {str(e)}"
+
+    def lade_sammel_requests_erneut(self, request, abgebrochen=None):
+        """Wiederholt einen Sammel-Request mit den aktuellen Ausgabeformaten"""
+        gesamt = {"felder": None, "crs": None, "features": [], "zuordnung": []}
+        for neu in self.erstelle_sammel_requests(request["bundesland"], request["anfragen"]):
+            success, ergebnis = self.lade_sammel_request(neu, abgebrochen)
+            if not success:
+                return False, ergebnis
+            if ergebnis["felder"] is not None:
+                gesamt["felder"], gesamt["crs"] = ergebnis["felder"], ergebnis["crs"]
+            gesamt["features"].extend(ergebnis["features"])
+            gesamt["zuordnung"].extend(ergebnis["zuordnung"])
+        return True, gesamt
+
+    def ordne_features_zu(self, request, features):
+        """Ordnet gelieferte Features den angefragten Flurstücken zu"""
+        index = {}
+        if request["bundesland"] == "Rheinland-Pfalz":
+            for feature in features:
+                schluessel = self.normiere_rlp_schluessel(feature["gemarkung"], feature["flur"],
+                                                          feature["flstnrzae"], feature["flstnrnen"])
+                index.setdefault(schluessel, []).append(feature)
+                # Anfragen ohne Nenner treffen alle Nenner des Zählers
+                index.setdefault(schluessel[:3] + (None,), []).append(feature)
+            zuordnung = []
+            for anfrage in request["anfragen"]:
+                schluessel = self.normiere_rlp_schluessel(*anfrage["rlp_filter"])
+                if not schluessel[3]:
+                    schluessel = schluessel[:3] + (None,)
+                zuordnung.append(index.get(schluessel, []))
+            return zuordnung
+
+        for feature in features:
+            index.setdefault(str(feature["flstkennz"]).strip(), []).append(feature)
+        return [index.get(anfrage["flstkennz"], []) for anfrage in request["anfragen"]]
+
+    def normiere_rlp_schluessel(self, gemarkung, flur, zaehler, nenner):
+        """Normiert gemarkung/flur/flstnrzae/flstnrnen für den Vergleich"""
+        def normiere(wert):
+            if wert is None or (hasattr(wert, "isNull") and wert.isNull()):
+                return ""
+            if isinstance(wert, float) and wert.is_integer():
+                wert = int(wert)
+            # "Flur 05" und "Flur 5" bzw. "012" und "12" gleich behandeln
+            return re.sub(r"\b0+(\d)", r"\1", str(wert).strip().lower())
+
+        return normiere(gemarkung), normiere(flur), normiere(zaehler), normiere(nenner)
+
+    def erstelle_anfrage_url(self, anfrage):
+        """GetFeature-URL für eine vorbereitete Anfrage nach aktueller wfs_config"""
+        if anfrage["rlp_filter"]:
+            return self.erstelle_wfs_request_rlp(*anfrage["rlp_filter"], anfrage["wfs_url"], anfrage.get("profil"))
+        return self.erstelle_wfs_request_standard(anfrage["flstkennz"], anfrage["wfs_url"], anfrage["bundesland"],
+                                                  anfrage.get("profil"))
+
+    def erstelle_wfs_request_rlp(self, gemarkung, flur, zaehler, nenner, wfs_url, profil=None):
+        """Erstellt WFS-Request für Rheinland-Pfalz mit kombinierter Filterung"""
+        cfg = self.wfs_config["Rheinland-Pfalz"]
+        filter_xml = self.erstelle_sammel_filter([{"rlp_filter": (gemarkung, flur, zaehler, nenner)}], cfg)
+        return self.erstelle_getfeature_url(wfs_url, cfg, filter_xml, self.ausgabeformat("Rheinland-Pfalz"), profil)
+
+    def erstelle_wfs_request_standard(self, flstkennz, wfs_url, bundesland, profil=None):
+        """Erstellt WFS-Request für NRW, Niedersachsen und Hessen"""
+        cfg = self.wfs_config.get(bundesland)
+        if not cfg or cfg["filter_ns"] == "fes_rlp":
+            return None
+
+        filter_xml = self.erstelle_sammel_filter([{"flstkennz": flstkennz}], cfg)
+        return self.erstelle_getfeature_url(wfs_url, cfg, filter_xml, self.ausgabeformat(bundesland), profil)
+
+    def wende_profil_an(self, bundesland, proben=True):
+        """Leitet wfs_config[bundesland] aus Grundkonfiguration und Endpunkt-Profil ab
+
+        Mit proben wird ein fehlendes oder abgelaufenes Profil abgefragt;
+        das darf nur im Hintergrund geschehen. Ohne proben gilt das zuletzt
+        gespeicherte Profil. Gibt True zurück, wenn sich die Konfiguration
+        dadurch geändert hat (bereits erstellte URLs sind dann neu zu bauen).
+        """
+        basis = self.wfs_basis.get(bundesland)
+        wfs_url = self.wfs_urls.get(bundesland)
+        if not basis or not wfs_url:
+            return False
+
+        cfg = self.profile.wende_an(basis, self.profile.hole(wfs_url, basis, proben))
+        if cfg == self.wfs_config.get(bundesland):
+            return False
+        self.wfs_config[bundesland] = cfg
+        QgsMessageLog.logMessage(
+            f"WFS-Konfiguration {bundesland}: Stream {cfg['stream_format'] or '-'}, "
+            f"Rückfall {cfg['output_format']}, POST {'ja' if cfg['post'] else 'nein'}, "
+            f"Seitengröße {cfg['seiten_groesse']}",
+            "Flurstück-Suche"
+        )
+        return True
+
+    def erstelle_flurstueckskennzeichen(self, bundesland, gem_schluessel, flur, zaehler, nenner_text):
+        """Erstellt flstkennz je nach Bundesland-Format"""
+        
+        zaehler_formatted = zaehler.zfill(5)
+        
+        # Alle Bundesländer außer RLP verwenden das gleiche Format
+        if nenner_text and nenner_text.strip():
+            nenner_formatted = nenner_text.zfill(5)
+            return f"{gem_schluessel}{flur}{zaehler_formatted}/{nenner_formatted}______"
+        else:
+            return f"{gem_schluessel}{flur}{zaehler_formatted}______"
+
+    def ist_xml_antwort(self, response):
+        """Prüft, ob der WFS statt eines Shapefiles XML geliefert hat"""
+        content_type = response.headers.get('Content-Type', '').lower()
+
+        # Alle Bundesländer verwenden jetzt Shapefiles
+        # XML-Verarbeitung nur als Fallback bei Problemen
+        return 'xml' in content_type and 'shapefile' not in content_type
+
+    def lese_wfs_antwort(self, response, profil=None):
+        """Liest die WFS-Antwort (ZIP oder XML) ohne Layer anzulegen"""
+        with self.metriken.stufe("dekodierung"):
+            if self.ist_xml_antwort(response):
+                success, ergebnis = self.lese_xml_antwort(response)
+            else:
+                success, ergebnis = self.lese_shapefile_antwort(response)
+            einstellungen = self.abfrage_profil(profil)
+            if success and (einstellungen["raster"] or einstellungen["toleranz"]):
+                for feature in ergebnis["features"]:
+                    if feature.hasGeometry():
+                        feature.setGeometry(reduziere_geometrie(feature.geometry(), ergebnis["crs"],
+                                                                einstellungen["raster"], einstellungen["toleranz"]))
+            return success, ergebnis
+
+    def lese_shapefile_antwort(self, response):
+        """Entpackt die Shapefile-Antwort und liest Felder, KBS und Features
+
+        Standardweg ist die Dekodierung im Speicher über GDAL (/vsimem/ und
+        /vsizip/). Ist sie abgeschaltet (alkis_suchmodul/decode/vsimem) oder
+        schlägt sie fehl, wird über temporäre Dateien entpackt.
+        """
+        if not response.content.startswith(b"PK"):
+            return False, "Ungültige ZIP-Datei empfangen"
+
+        if QSettings().value("alkis_suchmodul/decode/vsimem", True, type=bool):
+            try:
+                return self.lese_shapefile_vsimem(response)
+            except Exception as e:
+                QgsMessageLog.logMessage(
+                    f"Dekodierung im Speicher fehlgeschlagen, verwende temporäre Dateien: {str(e)}",
+                    "Flurstück-Suche",
+                    Qgis.Warning
+                )
+
+        return self.lese_shapefile_tempfile(response)
+
+    def lese_shapefile_vsimem(self, response):
+        """Liest die Shapefile-ZIP-Antwort ohne Plattenzugriff über /vsimem/"""
+        vsi_path = f"/vsimem/alkis_suchmodul/{uuid.uuid4().hex}.zip"
+        gdal.FileFromMemBuffer(vsi_path, response.content)
+        try:
+            dateien = gdal.ReadDirRecursive(f"/vsizip/{vsi_path}")
+            if dateien is None:
+                return False, "Ungültige ZIP-Datei empfangen"
+
+            shape_files = sorted(f for f in dateien if f.lower().endswith('.shp'))
+            if not shape_files:
+                return False, "Kein Shapefile gefunden!"
+
+            return self.lese_ogr_quelle(f"/vsizip/{vsi_path}/{shape_files[0]}")
+        finally:
+            gdal.Unlink(vsi_path)
+
+    def lese_shapefile_tempfile(self, response):
+        """Liest die Shapefile-ZIP-Antwort über temporäre Dateien (Fallback)"""
+        zip_path = None
+        try:
+            with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as tmp_zip:
+                tmp_zip.write(response.content)
+                zip_path = tmp_zip.name
+                
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                    zip_ref.extractall(tmp_dir)
+                    
+                shape_files = [f for f in os.listdir(tmp_dir) if f.endswith('.shp')]
+                if not shape_files:
+                    for root, dirs, files in os.walk(tmp_dir):
+                        shape_files = [f for f in files if f.endswith('.shp')]
+                        if shape_files:
+                            tmp_dir = root
+                            break
+                            
+                if not shape_files:
+                    return False, "Kein Shapefile gefunden!"
+                    
+                return self.lese_ogr_quelle(os.path.join(tmp_dir, shape_files[0]))
+            
+        except zipfile.BadZipFile:
+            return False, "Ungültige ZIP-Datei empfangen"
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Shapefile-Verarbeitungsfehler: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Fehler bei Shapefile-Verarbeitung: {str(e)}"
+        finally:
+            if zip_path and os.path.exists(zip_path):
+                os.unlink(zip_path)
+
+    def lese_ogr_quelle(self, shape_path):
+        """Liest Felder, KBS und Features eines Shapefiles über OGR"""
+        source_memory_layer = QgsVectorLayer(shape_path, "temp_source", "ogr")
+
+        if not source_memory_layer.isValid():
+            return False, "Shapefile konnte nicht geladen werden!"
+
+        if source_memory_layer.featureCount() == 0:
+            return False, "Keine Geometrien im Shapefile!"
+
+        ergebnis = {
+            "felder": source_memory_layer.fields(),
+            "crs": source_memory_layer.crs(),
+            "features": list(source_memory_layer.getFeatures())
+        }
+        del source_memory_layer
+        return True, ergebnis
+
+    def lese_xml_antwort(self, response):
+        """Liest eine XML-Antwort (Fallback) über OGR"""
+        xml_path = None
+        try:
+            with tempfile.NamedTemporaryFile(suffix='.xml', delete=False, mode='w', encoding='utf-8') as tmp_xml:
+                tmp_xml.write(response.text)
+                xml_path = tmp_xml.name
+            
+            source_layer = QgsVectorLayer(xml_path, "temp_xml_source", "ogr")
+            
+            if not source_layer.isValid():
+                return False, "XML konnte nicht geladen werden!"
+            
+            if source_layer.featureCount() == 0:
+                return False, "Keine Geometrien in XML gefunden!"
+
+            ergebnis = {
+                "felder": source_layer.fields(),
+                "crs": source_layer.crs(),
+                "features": list(source_layer.getFeatures())
+            }
+            del source_layer
+
+            return True, ergebnis
+
+        except Exception as e:
+            QgsMessageLog.logMessage(f"XML-Verarbeitungsfehler: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Fehler bei XML-Verarbeitung: {str(e)}"
+        finally:
+            if xml_path and os.path.exists(xml_path):
+                os.unlink(xml_path)
+
+    def erstelle_layer_name(self, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text):
+        """Erstellt den Layernamen für ein einzelnes Flurstück"""
+        ortsteil = gem_full_name.split('(')[0].strip()
+
+        bundesland_kuerzel = BUNDESLAND_KUERZEL.get(bundesland, "")
+
+        layer_name = f"{bundesland_kuerzel} - {ortsteil} - Flur {flur_text} - Flurstück {zaehler_text}"
+        if nenner_text:
+            layer_name += f"/{nenner_text}"
+        return layer_name
+
+    def erstelle_memory_layer(self, layer_name, ergebnis):
+        """Erstellt einen Memory-Layer aus gelesenen Features"""
+        with self.metriken.stufe("layer"):
+            memory_layer = QgsVectorLayer(
+                f"Polygon?crs={ergebnis['crs'].authid()}",
+                layer_name,
+                "memory"
+            )
+
+            provider = memory_layer.dataProvider()
+            provider.addAttributes(ergebnis["felder"])
+            memory_layer.updateFields()
+
+            provider.addFeatures(ergebnis["features"])
+            memory_layer.updateExtents()
+        return memory_layer
+
+    def find_gemarkung_by_name(self, gemarkung_input, gemarkungen_data):
+        """Findet passende Gemarkung
+
+        Gibt (schluessel, full_name) zurück, (None, None), wenn nichts passt,
+        und (None, meldung), wenn die Eingabe mehrdeutig ist.
+        """
+        if not gemarkung_input or not gemarkungen_data:
+            return None, None
+        
+        if isinstance(gemarkungen_data, GemarkungTabelle):
+            position = gemarkungen_data.finde(gemarkung_input)
+            if position == MEHRDEUTIG:
+                namen = ", ".join(gemarkungen_data.eintrag(i)["full_name"]
+                                  for i in gemarkungen_data.suche_name(gemarkung_input))
+                return None, f"Gemarkung '{gemarkung_input}' ist mehrdeutig ({namen}), bitte auswählen!"
+            if position < 0:
+                return None, None
+            return gemarkungen_data.schluessel[position], gemarkungen_data.eintrag(position)["full_name"]
+
+        input_lower = gemarkung_input.lower().strip()
+        
+        if input_lower.isdigit() and len(input_lower) == 4:
+            for schluessel, data in gemarkungen_data.items():
+                if data["nummer"] == input_lower:
+                    return schluessel, data["full_name"]
+            
+        for schluessel, data in gemarkungen_data.items():
+            if input_lower == data["name"].lower():
+                return schluessel, data["full_name"]
+
+        return None, None
+
+    def validate_gemarkungsschluessel(self, schluessel, bundesland):
+        """Validiert Gemarkungsschlüssel"""
+        validators = {
+            "Nordrhein-Westfalen": lambda s: len(s) == 6 and s.startswith('05'),
+            "Niedersachsen": lambda s: len(s) == 6 and s.startswith('03'),
+            "Hessen": lambda s: len(s) == 6 and s.startswith('06'),
+            "Rheinland-Pfalz": lambda s: len(s) == 6 and s.startswith('07')
+        }
+        validator = validators.get(bundesland)
+        return validator(schluessel) if validator else False
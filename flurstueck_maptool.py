@@ -0,0 +1,18 @@
+from qgis.gui import QgsMapTool
+from qgis.PyQt.QtCore import Qt
+
+
+class FlurstueckKlickWerkzeug(QgsMapTool):
+    """Kartenwerkzeug: ein Klick sucht das Flurstück an dieser Stelle"""
+
+    def __init__(self, plugin):
+        super().__init__(plugin.iface.mapCanvas())
+        self.plugin = plugin
+        self.setCursor(Qt.CrossCursor)
+
+    def canvasReleaseEvent(self, event):
+        """Kartenpunkt an das Plugin übergeben"""
+        if event.button() != Qt.LeftButton:
+            return
+        punkt = self.toMapCoordinates(event.pos())
+        self.plugin.identifiziere(punkt, self.canvas().mapSettings().destinationCrs())
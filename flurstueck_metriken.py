@@ -0,0 +1,230 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import csv
+import functools
+import json
+import math
+import threading
+import time
+
+# Spalten der Zusammenfassung (CSV-Export und Metrik-Panel)
+SPALTEN = ["bundesland", "suchen", "fehler", "fehlerquote", "cache_treffer", "cache_fehlschlaege", "cache_quote",
+           "bytes", "features_mittel", "gesamt_p50_ms", "gesamt_p95_ms", "http_p50_ms", "http_p95_ms",
+           "download_p50_ms", "download_p95_ms", "dekodierung_p50_ms", "dekodierung_p95_ms", "letzter_fehler"]
+
+# Stufen, für die p50/p95 ausgewiesen werden
+STUFEN = ("http", "download", "dekodierung")
+
+
+def perzentil(werte, p):
+    """Perzentil nach dem Nearest-Rank-Verfahren (0 bei leerer Liste)"""
+    if not werte:
+        return 0.0
+    sortiert = sorted(werte)
+    return sortiert[max(1, math.ceil(p / 100.0 * len(sortiert))) - 1]
+
+
+def erfasst(art):
+    """Dekorator für Methoden (anfrage, ...) -> (success, ergebnis)
+
+    Misst den Aufruf als eine Suche im Bundesland anfrage["bundesland"].
+    Rekursive Aufrufe (z.B. der Shapefile-Rückfall) zählen zur äußeren
+    Messung.
+    """
+    def dekorator(methode):
+        @functools.wraps(methode)
+        def gemessen(self, anfrage, *args, **kwargs):
+            with self.metriken.messung(anfrage["bundesland"], art) as messung:
+                success, ergebnis = methode(self, anfrage, *args, **kwargs)
+                messung.setze_ergebnis(success, ergebnis)
+                return success, ergebnis
+        return gemessen
+    return dekorator
+
+
+class Messung:
+    """Stufenzeiten, Datenmenge und Ergebnis einer Suche"""
+
+    def __init__(self, bundesland, art):
+        self.bundesland = bundesland
+        self.art = art
+        self.zeitpunkt = time.time()
+        self.start = time.perf_counter()
+        self.gesamt = 0.0
+        self.stufen = defaultdict(float)
+        self.stapel = []
+        self.bytes = 0
+        self.anzahl = 0
+        self.cache = None
+        self.erfolg = False
+        self.meldung = ""
+        # Verworfene Messungen (z.B. abgebrochene Parallelabrufe) werden nicht gespeichert
+        self.verworfen = False
+
+    def setze_ergebnis(self, success, ergebnis):
+        """Übernimmt Erfolg und Feature-Anzahl aus (success, ergebnis)"""
+        self.erfolg = bool(success)
+        if not success:
+            self.meldung = str(ergebnis)
+            return
+        self.meldung = ""
+        if ergebnis.get("anzahl") is not None:
+            self.anzahl = ergebnis["anzahl"]
+        elif isinstance(ergebnis.get("features"), list):
+            self.anzahl = len(ergebnis["features"])
+
+    def als_dict(self):
+        return {
+            "bundesland": self.bundesland,
+            "art": self.art,
+            "zeitpunkt": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.zeitpunkt)),
+            "erfolg": self.erfolg,
+            "meldung": self.meldung,
+            "cache": self.cache,
+            "bytes": self.bytes,
+            "features": self.anzahl,
+            "gesamt_ms": round(self.gesamt * 1000, 2),
+            "stufen_ms": {name: round(dauer * 1000, 2) for name, dauer in self.stufen.items()},
+        }
+
+
+class FlurstueckMetriken:
+    """Sammelt Messwerte der Suchen je Bundesland (thread-sicher)
+
+    Eine Messung umfasst eine Suche bzw. einen Sammel-Request. Innerhalb
+    der Messung werden Stufen (http, download, dekodierung, layer) mit
+    ihrer exklusiven Zeit erfasst; die laufende Messung hängt am Thread,
+    sodass Stufen und Bytes ohne zusätzliche Parameter zugeordnet werden.
+    Je Bundesland bleiben die letzten max_messungen Messungen erhalten.
+    """
+
+    def __init__(self, max_messungen=500):
+        self.max_messungen = max_messungen
+        self.messungen = {}
+        self.cache_zaehler = defaultdict(lambda: [0, 0])
+        self.lokal = threading.local()
+        self.lock = threading.Lock()
+
+    def aktuelle(self):
+        """Laufende Messung des Threads oder None"""
+        return getattr(self.lokal, "messung", None)
+
+    @contextmanager
+    def messung(self, bundesland, art="einzel"):
+        """Misst den Block als eine Suche; innerhalb einer Messung wird diese weiterverwendet"""
+        laufend = self.aktuelle()
+        if laufend is not None:
+            yield laufend
+            return
+
+        messung = Messung(bundesland, art)
+        self.lokal.messung = messung
+        try:
+            yield messung
+        except Exception as e:
+            messung.erfolg = False
+            messung.meldung = str(e)
+            raise
+        finally:
+            self.lokal.messung = None
+            messung.gesamt = time.perf_counter() - messung.start
+            if not messung.verworfen:
+                with self.lock:
+                    if bundesland not in self.messungen:
+                        self.messungen[bundesland] = deque(maxlen=self.max_messungen)
+                    self.messungen[bundesland].append(messung)
+
+    @contextmanager
+    def stufe(self, name):
+        """Misst die exklusive Zeit des Blocks als Stufe der laufenden Messung"""
+        messung = self.aktuelle()
+        if messung is None:
+            yield
+            return
+
+        messung.stapel.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            dauer = time.perf_counter() - start
+            kinder = messung.stapel.pop()
+            if messung.stapel:
+                messung.stapel[-1] += dauer
+            messung.stufen[name] += dauer - kinder
+
+    def zaehle_bytes(self, anzahl):
+        """Addiert empfangene Bytes zur laufenden Messung"""
+        messung = self.aktuelle()
+        if messung is not None:
+            messung.bytes += anzahl
+
+    def zaehle_features(self, anzahl):
+        """Setzt die Feature-Anzahl der laufenden Messung"""
+        messung = self.aktuelle()
+        if messung is not None:
+            messung.anzahl = anzahl
+
+    def vermerke_cache(self, bundesland, treffer):
+        """Zählt einen Cache-Treffer bzw. -Fehlschlag (je Messung nur einmal)"""
+        messung = self.aktuelle()
+        if messung is not None:
+            if messung.cache is not None:
+                return
+            messung.cache = "treffer" if treffer else "fehlschlag"
+        with self.lock:
+            self.cache_zaehler[bundesland][0 if treffer else 1] += 1
+
+    def leere(self):
+        """Verwirft alle Messwerte"""
+        with self.lock:
+            self.messungen.clear()
+            self.cache_zaehler.clear()
+
+    def zusammenfassung(self):
+        """Kennzahlen je Bundesland als Liste von Dicts (Schlüssel wie SPALTEN)"""
+        with self.lock:
+            messungen = {land: list(liste) for land, liste in self.messungen.items()}
+            cache_zaehler = {land: list(zaehler) for land, zaehler in self.cache_zaehler.items()}
+
+        zeilen = []
+        for bundesland in sorted(set(messungen) | set(cache_zaehler)):
+            liste = messungen.get(bundesland, [])
+            treffer, fehlschlaege = cache_zaehler.get(bundesland, [0, 0])
+            fehler = [m for m in liste if not m.erfolg]
+            zeile = {
+                "bundesland": bundesland,
+                "suchen": len(liste),
+                "fehler": len(fehler),
+                "fehlerquote": round(len(fehler) / len(liste), 3) if liste else 0.0,
+                "cache_treffer": treffer,
+                "cache_fehlschlaege": fehlschlaege,
+                "cache_quote": round(treffer / (treffer + fehlschlaege), 3) if treffer + fehlschlaege else 0.0,
+                "bytes": sum(m.bytes for m in liste),
+                "features_mittel": round(sum(m.anzahl for m in liste) / len(liste), 1) if liste else 0.0,
+                "gesamt_p50_ms": round(perzentil([m.gesamt * 1000 for m in liste], 50), 1),
+                "gesamt_p95_ms": round(perzentil([m.gesamt * 1000 for m in liste], 95), 1),
+                "letzter_fehler": fehler[-1].meldung if fehler else "",
+            }
+            # Nur Messungen mit der Stufe zählen, damit Cache-Treffer die Latenz nicht schönen
+            for stufe in STUFEN:
+                werte = [m.stufen[stufe] * 1000 for m in liste if stufe in m.stufen]
+                zeile[f"{stufe}_p50_ms"] = round(perzentil(werte, 50), 1)
+                zeile[f"{stufe}_p95_ms"] = round(perzentil(werte, 95), 1)
+            zeilen.append(zeile)
+        return zeilen
+
+    def exportiere_csv(self, pfad):
+        """Schreibt die Zusammenfassung je Bundesland als CSV-Datei"""
+        with open(pfad, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SPALTEN, delimiter=";")
+            writer.writeheader()
+            writer.writerows(self.zusammenfassung())
+
+    def exportiere_json(self, pfad):
+        """Schreibt Zusammenfassung und Einzelmessungen als JSON-Datei"""
+        with self.lock:
+            messungen = {land: [m.als_dict() for m in liste] for land, liste in self.messungen.items()}
+        with open(pfad, "w", encoding="utf-8") as f:
+            json.dump({"zusammenfassung": self.zusammenfassung(), "messungen": messungen},
+                      f, indent=2, ensure_ascii=False)
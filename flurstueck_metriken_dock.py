@@ -0,0 +1,108 @@
+from qgis.gui import QgsDockWidget
+from qgis.PyQt.QtCore import Qt, QTimer
+from qgis.PyQt.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton,
+                                 QHeaderView, QFileDialog, QAbstractItemView)
+from qgis.core import QgsMessageLog, Qgis
+
+# (Überschrift, Schlüssel der Zusammenfassung, Format)
+SPALTEN = [
+    ("Bundesland", "bundesland", "{}"),
+    ("Suchen", "suchen", "{}"),
+    ("Fehler", "fehlerquote", "{:.0%}"),
+    ("Cache", "cache_quote", "{:.0%}"),
+    ("Gesamt p50", "gesamt_p50_ms", "{:.0f} ms"),
+    ("Gesamt p95", "gesamt_p95_ms", "{:.0f} ms"),
+    ("HTTP p50", "http_p50_ms", "{:.0f} ms"),
+    ("HTTP p95", "http_p95_ms", "{:.0f} ms"),
+    ("Download p95", "download_p95_ms", "{:.0f} ms"),
+    ("Dekodierung p95", "dekodierung_p95_ms", "{:.0f} ms"),
+    ("Features", "features_mittel", "{:.1f}"),
+    ("Daten", "bytes", "{}"),
+]
+
+
+def formatiere_bytes(anzahl):
+    for einheit in ("B", "KB", "MB"):
+        if anzahl < 1024:
+            return f"{anzahl:.0f} {einheit}"
+        anzahl /= 1024.0
+    return f"{anzahl:.1f} GB"
+
+
+class FlurstueckMetrikenDock(QgsDockWidget):
+    """Panel mit Kennzahlen der Suchen je Bundesland (p50/p95, Fehler- und Cache-Quote)"""
+
+    def __init__(self, metriken, parent=None):
+        super().__init__("ALKIS-Suchmodul: Metriken", parent)
+        self.setObjectName("ALKISSuchmodulMetriken")
+        self.metriken = metriken
+
+        inhalt = QWidget(self)
+        layout = QVBoxLayout(inhalt)
+
+        self.tabelle = QTableWidget(0, len(SPALTEN), inhalt)
+        self.tabelle.setHorizontalHeaderLabels([titel for titel, _, _ in SPALTEN])
+        self.tabelle.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.tabelle.setSelectionMode(QAbstractItemView.NoSelection)
+        self.tabelle.verticalHeader().setVisible(False)
+        self.tabelle.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        layout.addWidget(self.tabelle)
+
+        knoepfe = QHBoxLayout()
+        self.export_button = QPushButton("Exportieren...", inhalt)
+        self.export_button.clicked.connect(self.on_export_clicked)
+        self.leeren_button = QPushButton("Zurücksetzen", inhalt)
+        self.leeren_button.clicked.connect(self.on_leeren_clicked)
+        knoepfe.addStretch()
+        knoepfe.addWidget(self.export_button)
+        knoepfe.addWidget(self.leeren_button)
+        layout.addLayout(knoepfe)
+        self.setWidget(inhalt)
+
+        # Die Messwerte entstehen in Worker-Threads; das Panel fragt sie
+        # nur ab, solange es sichtbar ist
+        self.timer = QTimer(self)
+        self.timer.setInterval(2000)
+        self.timer.timeout.connect(self.aktualisiere)
+        self.visibilityChanged.connect(self.on_sichtbarkeit)
+
+    def on_sichtbarkeit(self, sichtbar):
+        if sichtbar:
+            self.aktualisiere()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def aktualisiere(self):
+        """Füllt die Tabelle mit der aktuellen Zusammenfassung"""
+        zeilen = self.metriken.zusammenfassung()
+        self.tabelle.setRowCount(len(zeilen))
+        for zeile, werte in enumerate(zeilen):
+            for spalte, (_, schluessel, format_text) in enumerate(SPALTEN):
+                wert = werte[schluessel]
+                text = formatiere_bytes(wert) if schluessel == "bytes" else format_text.format(wert)
+                item = QTableWidgetItem(text)
+                if spalte > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                if schluessel == "fehlerquote" and werte["letzter_fehler"]:
+                    item.setToolTip(f"Letzter Fehler: {werte['letzter_fehler']}")
+                self.tabelle.setItem(zeile, spalte, item)
+
+    def on_export_clicked(self):
+        pfad, filter_text = QFileDialog.getSaveFileName(self, "Metriken exportieren", "alkis_metriken.csv",
+                                                        "CSV-Dateien (*.csv);;JSON-Dateien (*.json)")
+        if not pfad:
+            return
+        try:
+            if pfad.lower().endswith(".json") or (not pfad.lower().endswith(".csv") and "json" in filter_text.lower()):
+                self.metriken.exportiere_json(pfad)
+            else:
+                self.metriken.exportiere_csv(pfad)
+            QgsMessageLog.logMessage(f"Metriken exportiert: {pfad}", "Flurstück-Suche")
+        except OSError as e:
+            QgsMessageLog.logMessage(f"Metriken konnten nicht exportiert werden: {str(e)}",
+                                     "Flurstück-Suche", Qgis.Warning)
+
+    def on_leeren_clicked(self):
+        self.metriken.leere()
+        self.aktualisiere()
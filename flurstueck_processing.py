@@ -0,0 +1,287 @@
+from qgis.core import (QgsProcessingProvider, QgsProcessingAlgorithm, QgsProcessingException,
+                       QgsProcessingParameterFeatureSource, QgsProcessingParameterEnum,
+                       QgsProcessingParameterNumber, QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFeatureSink, QgsProcessingParameterFileDestination,
+                       QgsProcessingOutputNumber, QgsProcessing, QgsFeatureSink, QgsWkbTypes,
+                       QgsCoordinateReferenceSystem, QgsProcessingParameterFile, QgsProcessingParameterString,
+                       QgsCoordinateTransform, QgsProject, QgsFeature, QgsField, QgsFields)
+from qgis.PyQt.QtCore import QVariant
+from qgis.PyQt.QtGui import QIcon
+from .flurstueck_kern import FlurstueckKern, BUNDESLAND_KUERZEL, ABFRAGE_PROFILE
+from .flurstueck_batch import FlurstueckBatchSuche
+from .flurstueck_bestand import FlurstueckBestand
+import os
+
+BUNDESLAENDER = list(BUNDESLAND_KUERZEL)
+PROFILE = list(ABFRAGE_PROFILE)
+
+
+class FlurstueckProvider(QgsProcessingProvider):
+    """Processing-Provider des ALKIS-Suchmoduls (auch für qgis_process)"""
+
+    def id(self):
+        return "alkis_suchmodul"
+
+    def name(self):
+        return "ALKIS-Suchmodul"
+
+    def icon(self):
+        icon_path = os.path.join(os.path.dirname(__file__), "icon.png")
+        return QIcon(icon_path) if os.path.exists(icon_path) else QgsProcessingProvider.icon(self)
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(FlurstueckStapelAlgorithmus())
+        self.addAlgorithm(FlurstueckBestandImportAlgorithmus())
+
+
+class FlurstueckAusgabeSenke:
+    """Schreibt die Treffer der Stapelsuche sofort in die Processing-Ausgabe
+
+    Gleiche Schnittstelle wie FlurstueckDateiSenke, sodass
+    FlurstueckBatchSuche.fuehre_aus keine Treffer sammeln muss. Die Ausgabe
+    wird beim ersten Treffer mit dessen Feldern und KBS angelegt; Spalten,
+    die erst spätere Treffer mitbringen, werden gemeldet und entfallen.
+    """
+
+    def __init__(self, algorithmus, parameters, context, feedback):
+        self.algorithmus = algorithmus
+        self.parameters = parameters
+        self.context = context
+        self.feedback = feedback
+        self.sink = None
+        self.dest_id = None
+        self.felder = None
+        self.crs = None
+        self.transformationen = {}
+        self.fehlende = set()
+        self.anzahl = 0
+
+    def oeffne(self, felder, crs):
+        """Legt die Ausgabe an: stapel_zeile, bundesland und die Felder des ersten Treffers"""
+        ausgabe = QgsFields()
+        ausgabe.append(QgsField("stapel_zeile", QVariant.Int))
+        ausgabe.append(QgsField("bundesland", QVariant.String))
+        for feld in felder:
+            if ausgabe.indexFromName(feld.name()) == -1:
+                ausgabe.append(QgsField(feld))
+        self.sink, self.dest_id = self.algorithmus.parameterAsSink(
+            self.parameters, self.algorithmus.OUTPUT, self.context, ausgabe, QgsWkbTypes.MultiPolygon, crs)
+        if self.sink is None:
+            raise QgsProcessingException(self.algorithmus.invalidSinkError(self.parameters, self.algorithmus.OUTPUT))
+        self.felder = ausgabe
+        self.crs = crs
+
+    def transformation(self, crs):
+        """Transformation aus crs in das KBS der Ausgabe (None, wenn gleich)"""
+        if crs == self.crs:
+            return None
+        if crs.authid() not in self.transformationen:
+            self.transformationen[crs.authid()] = QgsCoordinateTransform(crs, self.crs, QgsProject.instance())
+        return self.transformationen[crs.authid()]
+
+    def schreibe(self, features, felder, crs, bundesland, abfrage, extra=None):
+        """Schreibt die Features eines Treffers; gibt ihre Anzahl zurück"""
+        if self.sink is None:
+            self.oeffne(felder, crs)
+        fehlend = [name for name in felder.names() if self.felder.indexFromName(name) == -1
+                   and name not in self.fehlende]
+        if fehlend:
+            self.fehlende.update(fehlend)
+            self.feedback.reportError(f"Spalten {', '.join(fehlend)} ({bundesland}) fehlen in der Ausgabe "
+                                      f"und werden nicht übernommen")
+        namen = [name for name in felder.names() if self.felder.indexFromName(name) != -1]
+        werte = {name: wert for name, wert in (extra or {}).items() if self.felder.indexFromName(name) != -1}
+        transform = self.transformation(crs)
+
+        anzahl = 0
+        for quelle in features:
+            feature = QgsFeature(self.felder)
+            geometrie = quelle.geometry()
+            if transform is not None:
+                geometrie.transform(transform)
+            geometrie.convertToMultiType()
+            feature.setGeometry(geometrie)
+            feature["bundesland"] = bundesland
+            for name, wert in werte.items():
+                feature[name] = wert
+            for name in namen:
+                feature[name] = quelle[name]
+            self.sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            anzahl += 1
+        self.anzahl += anzahl
+        return anzahl
+
+    def schliesse(self):
+        """Legt ohne Treffer eine leere Ausgabe an; gibt die Anzahl geschriebener Features zurück"""
+        if self.sink is None:
+            self.oeffne(QgsFields(), QgsCoordinateReferenceSystem("EPSG:25832"))
+        return self.anzahl
+
+
+class FlurstueckStapelAlgorithmus(QgsProcessingAlgorithm):
+    """Stapelsuche ohne Oberfläche: Tabelle mit Flurstücken -> GeoPackage
+
+    Verwendet dieselbe Pipeline wie die Stapelsuche im Dialog
+    (FlurstueckKern + FlurstueckBatchSuche), legt aber keine Layer im
+    Projekt an und läuft daher auch in qgis_process. Treffer werden sofort
+    in die Ausgabe geschrieben; im Speicher bleibt nur der Bericht. Der
+    Vorabruf ist abgeschaltet, damit nach dem Algorithmus keine Threads
+    weiterlaufen.
+    """
+
+    INPUT = "INPUT"
+    BUNDESLAND = "BUNDESLAND"
+    WORKER = "WORKER"
+    CACHE_UMGEHEN = "CACHE_UMGEHEN"
+    PROFIL = "PROFIL"
+    OUTPUT = "OUTPUT"
+    BERICHT = "BERICHT"
+    GEFUNDEN = "GEFUNDEN"
+
+    def name(self):
+        return "stapelsuche"
+
+    def displayName(self):
+        return "Flurstücke aus Tabelle suchen"
+
+    def shortHelpString(self):
+        return ("Sucht alle Flurstücke einer Tabelle mit den Spalten Gemarkung, Flur, Zähler und "
+                "optional Nenner und Bundesland beim WFS des jeweiligen Landes und schreibt die "
+                "Geometrien in einen Layer (z.B. GeoPackage). Zeilen ohne Bundesland verwenden "
+                "das gewählte Standard-Bundesland. Parallele Abrufe: Anzahl gleichzeitiger "
+                "Anfragen je Bundesland. Abfrageprofil: 'umring' fordert nur Kennzeichen und "
+                "Geometrie an (auf 1 cm gerundet), 'uebersicht' vereinfacht die Umringe zusätzlich "
+                "mit 0,5 m Toleranz.")
+
+    def createInstance(self):
+        return FlurstueckStapelAlgorithmus()
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Tabelle mit Flurstücken", [QgsProcessing.TypeVector]))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.BUNDESLAND, "Standard-Bundesland", options=BUNDESLAENDER, defaultValue=0))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.WORKER, "Parallele Abrufe je Bundesland", QgsProcessingParameterNumber.Integer,
+            defaultValue=4, minValue=1, maxValue=16))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.CACHE_UMGEHEN, "Cache umgehen", defaultValue=False))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.PROFIL, "Abfrageprofil", options=PROFILE, defaultValue=0))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Gefundene Flurstücke", QgsProcessing.TypeVectorPolygon))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.BERICHT, "Stapelbericht", "CSV (*.csv)", optional=True, createByDefault=False))
+        self.addOutput(QgsProcessingOutputNumber(self.GEFUNDEN, "Anzahl gefundener Flurstücke"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        quelle = self.parameterAsSource(parameters, self.INPUT, context)
+        if quelle is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        standard_bundesland = BUNDESLAENDER[self.parameterAsEnum(parameters, self.BUNDESLAND, context)]
+        worker = self.parameterAsInt(parameters, self.WORKER, context)
+        cache_umgehen = self.parameterAsBool(parameters, self.CACHE_UMGEHEN, context)
+        profil = PROFILE[self.parameterAsEnum(parameters, self.PROFIL, context)]
+        bericht_pfad = self.parameterAsFileOutput(parameters, self.BERICHT, context)
+
+        kern = FlurstueckKern()
+        kern.vorabruf.beende()
+        try:
+            senke = FlurstueckAusgabeSenke(self, parameters, context, feedback)
+            batch = FlurstueckBatchSuche(kern, worker, cache_umgehen, profil, senke=senke)
+            success, zeilen = batch.lese_features(quelle.fields().names(), quelle.getFeatures(),
+                                                  standard_bundesland)
+            if not success:
+                raise QgsProcessingException(zeilen)
+            if not zeilen:
+                raise QgsProcessingException("Die Tabelle enthält keine Flurstücke!")
+
+            feedback.pushInfo(f"{len(zeilen)} Flurstücke werden gesucht ({worker} parallele Abrufe je Bundesland)")
+            _, bericht = batch.fuehre_aus(
+                zeilen, lambda erledigt, gesamt: feedback.setProgress(100 * erledigt / gesamt), feedback.isCanceled)
+            if feedback.isCanceled():
+                raise QgsProcessingException("Stapelsuche abgebrochen")
+            gefunden = senke.schliesse()
+            dest_id = senke.dest_id
+
+            if bericht_pfad:
+                batch.schreibe_bericht(bericht_pfad, bericht)
+
+            fehler = sum(1 for eintrag in bericht if not eintrag["erfolg"])
+            if fehler:
+                feedback.reportError(f"{fehler} von {len(zeilen)} Flurstücken nicht gefunden")
+            feedback.pushInfo(f"{gefunden} Flurstücke geschrieben")
+        finally:
+            kern.vorabruf.beende()
+            kern.http.schliesse()
+            kern.cache.schliesse()
+            kern.bestand.schliesse()
+
+        return {self.OUTPUT: dest_id, self.BERICHT: bericht_pfad, self.GEFUNDEN: gefunden}
+
+
+class FlurstueckBestandImportAlgorithmus(QgsProcessingAlgorithm):
+    """Importiert Massendaten eines Landes in den lokalen Flurstücksbestand
+
+    Danach beantworten Suchen, Stapelsuchen, Bereichsdownloads und die
+    Suche per Klick die importierten Gemarkungen ohne WFS-Zugriff.
+    """
+
+    INPUT = "INPUT"
+    BUNDESLAND = "BUNDESLAND"
+    LAYER = "LAYER"
+    ENTFERNE_FEHLENDE = "ENTFERNE_FEHLENDE"
+    GEAENDERT = "GEAENDERT"
+    FLURSTUECKE = "FLURSTUECKE"
+
+    def name(self):
+        return "bestand_import"
+
+    def displayName(self):
+        return "Flurstücke in lokalen Bestand importieren"
+
+    def shortHelpString(self):
+        return ("Liest einen Massendaten-Download ALKIS-vereinfacht (GeoPackage, Shapefile oder GML, auch als "
+                "ZIP) in den lokalen Flurstücksbestand. Suchen verwenden den Bestand vor dem WFS und "
+                "funktionieren für die importierten Gemarkungen auch offline. Beim erneuten Import werden nur "
+                "geänderte Gemarkungen ersetzt. Ebene: leer lassen, um die erste Ebene mit dem Feld flstkennz "
+                "zu verwenden.")
+
+    def createInstance(self):
+        return FlurstueckBestandImportAlgorithmus()
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(
+            self.INPUT, "Massendaten (GeoPackage, Shapefile, GML oder ZIP)",
+            fileFilter="Vektordaten (*.gpkg *.shp *.gml *.xml *.zip);;Alle Dateien (*.*)"))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.BUNDESLAND, "Bundesland", options=BUNDESLAENDER, defaultValue=0))
+        self.addParameter(QgsProcessingParameterString(
+            self.LAYER, "Ebene", optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.ENTFERNE_FEHLENDE, "Gemarkungen entfernen, die in der Datei fehlen", defaultValue=False))
+        self.addOutput(QgsProcessingOutputNumber(self.GEAENDERT, "Anzahl neu importierter Gemarkungen"))
+        self.addOutput(QgsProcessingOutputNumber(self.FLURSTUECKE, "Anzahl geschriebener Flurstücke"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        pfad = self.parameterAsFile(parameters, self.INPUT, context)
+        bundesland = BUNDESLAENDER[self.parameterAsEnum(parameters, self.BUNDESLAND, context)]
+        layer_name = self.parameterAsString(parameters, self.LAYER, context).strip()
+        entferne_fehlende = self.parameterAsBool(parameters, self.ENTFERNE_FEHLENDE, context)
+
+        bestand = FlurstueckBestand()
+        feedback.pushInfo(f"Importiere {pfad} nach {bestand.pfad} ({bundesland})")
+        try:
+            success, ergebnis = bestand.importiere(pfad, bundesland, layer_name or None, entferne_fehlende,
+                                                   feedback.setProgress, feedback.isCanceled)
+        except Exception as e:
+            raise QgsProcessingException(f"Fehler beim Import: {str(e)}")
+        if not success:
+            raise QgsProcessingException(ergebnis)
+
+        feedback.pushInfo(f"{ergebnis['geaendert']} von {ergebnis['gemarkungen']} Gemarkungen neu importiert, "
+                          f"{ergebnis['entfernt']} entfernt, {ergebnis['flurstuecke']} Flurstücke geschrieben")
+        if ergebnis["uebersprungen"]:
+            feedback.reportError(f"{ergebnis['uebersprungen']} Features ohne gültiges flstkennz oder Geometrie "
+                                 f"übersprungen")
+        return {self.GEAENDERT: ergebnis["geaendert"], self.FLURSTUECKE: ergebnis["flurstuecke"]}
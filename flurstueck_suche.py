@@ -1,65 +1,40 @@
 from qgis.PyQt.QtCore import Qt, QSettings, QTranslator, QCoreApplication
 from qgis.PyQt.QtGui import QIcon, QPixmap
 from qgis.PyQt.QtWidgets import QAction, QApplication, QMessageBox
-from qgis.core import QgsProject, QgsVectorLayer, QgsMessageLog, QgsApplication, Qgis
+from qgis.core import (QgsProject, QgsMessageLog, QgsApplication, Qgis,
+                       QgsCoordinateTransform, QgsFeatureRequest, QgsRectangle)
+from .flurstueck_kern import FlurstueckKern, BUNDESLAND_KUERZEL, ALLE_BUNDESLAENDER
 from .flurstueck_dialog import FlurstueckDialog
-import requests
-import urllib.parse
+from .flurstueck_batch_dialog import FlurstueckBatchDialog
+from .flurstueck_task import FlurstueckSucheTask, FlurstueckBereichTask, FlurstueckPunktTask, FlurstueckKatalogTask
+from .flurstueck_maptool import FlurstueckKlickWerkzeug
+from .flurstueck_ergebnis import FlurstueckErgebnisLayer
+from .flurstueck_bereich import FlurstueckBereichDownload
+from .flurstueck_ausschnitt import FlurstueckAusschnittDownload
+from .flurstueck_export import FlurstueckDateiSenke, export_pfad
+from .flurstueck_processing import FlurstueckProvider
+from .flurstueck_metriken_dock import FlurstueckMetrikenDock
+import configparser
 import os
-import tempfile
-import zipfile
-import json
 
-class FlurstueckSuche:
-    """Hauptklasse für das Flurstück-Suche Plugin"""
+
+class FlurstueckSuche(FlurstueckKern):
+    """Hauptklasse für das Flurstück-Suche Plugin
+
+    Ergänzt FlurstueckKern um Dialoge, Hintergrund-Tasks und die Anzeige
+    der Ergebnisse im Projekt.
+    """
     
     def __init__(self, iface):
+        super().__init__()
         self.iface = iface
         self.dlg = None
-        
-        self.gemarkungen_nrw = self.load_gemarkungen_json("gemarkungen_nrw.json")
-        self.gemarkungen_nieder = self.load_gemarkungen_json("gemarkungen_nieder.json")
-        self.gemarkungen_hessen = self.load_gemarkungen_json("gemarkungen_hessen.json")
-        self.gemarkungen_rlp = self.load_gemarkungen_json("gemarkungen_rlp.json")
-        
-        self.fluren = {}
-        self.wfs_urls = {
-            "Nordrhein-Westfalen": "https://www.wfs.nrw.de/geobasis/wfs_nw_alkis_vereinfacht",
-            "Niedersachsen": "https://opendata.lgln.niedersachsen.de/doorman/noauth/alkis_wfs_einfach",
-            "Hessen": "https://www.gds.hessen.de/wfs2/aaa-suite/cgi-bin/alkis/vereinf/wfs",
-            "Rheinland-Pfalz": "https://www.geoportal.rlp.de/registry/wfs/519"
-        }
-
-    def load_gemarkungen_json(self, filename):
-        """Lädt Gemarkungen aus JSON-Datei"""
-        try:
-            json_path = os.path.join(os.path.dirname(__file__), filename)
-
-            if not os.path.exists(json_path):
-                QgsMessageLog.logMessage(
-                    f"Warnung: {filename} nicht gefunden",
-                    "Flurstück-Suche",
-                    Qgis.Warning
-                )
-                return {}
-
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            QgsMessageLog.logMessage(
-                f"Gemarkungen geladen: {filename} ({len(data)} Einträge)",
-                "Flurstück-Suche"
-            )
-            return data
+        self.batch_dlg = None
+        self.tasks = []
+        self.klick_werkzeug = None
+        self.ergebnis_layer = FlurstueckErgebnisLayer(self)
+        self.provider = None
 
-        except Exception as e:
-            QgsMessageLog.logMessage(
-                f"Fehler beim Laden von {filename}: {str(e)}",
-                "Flurstück-Suche",
-                Qgis.Critical
-            )
-            return {}
-        
     def initGui(self):
         """Initialisiert die GUI"""
         icon_path = os.path.join(os.path.dirname(__file__), "icon.png")
@@ -74,12 +49,102 @@ class FlurstueckSuche:
         
         self.iface.addPluginToMenu("ALKIS-Suchmodul", self.action)
         self.iface.addToolBarIcon(self.action)
-        
+
+        self.klick_werkzeug = FlurstueckKlickWerkzeug(self)
+        self.klick_action = QAction(icon, "Flurstück per Klick suchen", self.iface.mainWindow())
+        self.klick_action.setCheckable(True)
+        self.klick_action.triggered.connect(self.aktiviere_klick_werkzeug)
+        self.klick_werkzeug.setAction(self.klick_action)
+        self.iface.addPluginToMenu("ALKIS-Suchmodul", self.klick_action)
+        self.iface.addToolBarIcon(self.klick_action)
+
+        self.metriken_dock = FlurstueckMetrikenDock(self.metriken, self.iface.mainWindow())
+        self.iface.addDockWidget(Qt.RightDockWidgetArea, self.metriken_dock)
+        self.metriken_dock.hide()
+        self.metriken_action = QAction("Metriken der Suchen", self.iface.mainWindow())
+        self.metriken_action.setCheckable(True)
+        self.metriken_dock.setToggleVisibilityAction(self.metriken_action)
+        self.iface.addPluginToMenu("ALKIS-Suchmodul", self.metriken_action)
+
+        self.katalog_action = QAction("Gemarkungen aktualisieren", self.iface.mainWindow())
+        self.katalog_action.triggered.connect(lambda: self.aktualisiere_gemarkungen())
+        self.iface.addPluginToMenu("ALKIS-Suchmodul", self.katalog_action)
+
+        self.initProcessing()
+        self.pruefe_plugin_update()
+
+    def initProcessing(self):
+        """Registriert den Processing-Provider (Stapelsuche für qgis_process)"""
+        self.provider = FlurstueckProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def unload(self):
         """Entfernt Plugin aus QGIS"""
+        self.breche_tasks_ab()
+        self.vorabruf.beende()
+        self.http.schliesse()
+        if self.iface.mapCanvas().mapTool() is self.klick_werkzeug:
+            self.iface.mapCanvas().unsetMapTool(self.klick_werkzeug)
+        self.iface.removePluginMenu("ALKIS-Suchmodul", self.klick_action)
+        self.iface.removeToolBarIcon(self.klick_action)
         self.iface.removePluginMenu("ALKIS-Suchmodul", self.action)
         self.iface.removeToolBarIcon(self.action)
-        
+        self.iface.removePluginMenu("ALKIS-Suchmodul", self.metriken_action)
+        self.iface.removePluginMenu("ALKIS-Suchmodul", self.katalog_action)
+        self.iface.removeDockWidget(self.metriken_dock)
+        self.metriken_dock.deleteLater()
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+
+    def aktualisiere_gemarkungen(self, fertig=None):
+        """Gleicht den Gemarkungskatalog im Hintergrund mit den WFS ab (höchstens ein Abgleich zugleich)
+
+        fertig(success, message) ersetzt die Meldung in der Nachrichtenleiste.
+        """
+        fertig = fertig or self.melde
+        if any(isinstance(task, FlurstueckKatalogTask) for task in self.tasks):
+            fertig(False, "Die Gemarkungen werden bereits aktualisiert")
+            return
+        self.registriere_task(FlurstueckKatalogTask(self, fertig))
+
+    def pruefe_plugin_update(self):
+        """Aktualisiert die Gemarkungen beim ersten Start einer neuen Plugin-Version
+
+        Nur wenn alkis_suchmodul/gemarkungen/nach_update gesetzt ist; dank
+        bedingter Anfragen werden dabei nur geänderte Listen übertragen. Die
+        Version wird erst nach einem erfolgreichen Abgleich vermerkt, sodass
+        ein gescheiterter oder abgebrochener beim nächsten Start wiederholt wird.
+        """
+        settings = QSettings()
+        if not settings.value("alkis_suchmodul/gemarkungen/nach_update", False, type=bool):
+            return
+        metadaten = configparser.ConfigParser()
+        metadaten.read(os.path.join(os.path.dirname(__file__), "metadata.txt"), encoding="utf-8")
+        version = metadaten.get("general", "version", fallback="")
+        if settings.value("alkis_suchmodul/gemarkungen/version", "") == version:
+            return
+
+        def fertig(success, message):
+            if success:
+                QSettings().setValue("alkis_suchmodul/gemarkungen/version", version)
+            self.melde(success, message)
+
+        self.aktualisiere_gemarkungen(fertig)
+
+    def aktiviere_klick_werkzeug(self):
+        """Schaltet das Kartenwerkzeug für die Suche per Klick ein"""
+        self.iface.mapCanvas().setMapTool(self.klick_werkzeug)
+
+    def aktives_bundesland(self):
+        """Zuletzt im Suchdialog gewähltes Bundesland"""
+        return QSettings().value("alkis_suchmodul/bundesland", "Nordrhein-Westfalen")
+
+    def melde(self, success, message):
+        """Meldung in der QGIS-Nachrichtenleiste anzeigen"""
+        self.iface.messageBar().pushMessage("ALKIS-Suchmodul", message,
+                                            level=Qgis.Success if success else Qgis.Warning, duration=5)
+
     def run(self):
         """Öffnet Suchdialog"""
         if self.dlg:
@@ -89,409 +154,323 @@ class FlurstueckSuche:
         self.dlg = FlurstueckDialog(self, self.iface.mainWindow())
         self.dlg.show()
         self.dlg.activateWindow()
-        
-    def get_gemarkungen_for_bundesland(self, bundesland):
-        """Gibt Gemarkungen für Bundesland zurück"""
-        gemarkungen_map = {
-            "Nordrhein-Westfalen": self.gemarkungen_nrw,
-            "Niedersachsen": self.gemarkungen_nieder,
-            "Hessen": self.gemarkungen_hessen,
-            "Rheinland-Pfalz": self.gemarkungen_rlp
-        }
-        return gemarkungen_map.get(bundesland, {})
-        
-    def suche_flurstueck(self, bundesland, gemarkung_name, flur_text, zaehler_text, nenner_text):
+
+    def run_batch(self):
+        """Öffnet Dialog für die Stapelsuche"""
+        if self.batch_dlg:
+            self.batch_dlg.close()
+            self.batch_dlg = None
+
+        self.batch_dlg = FlurstueckBatchDialog(self, self.iface.mainWindow())
+        self.batch_dlg.show()
+        self.batch_dlg.activateWindow()
+
+    def suche_flurstueck(self, bundesland, gemarkung_name, flur_text, zaehler_text, nenner_text, cache_umgehen=False):
         """Hauptsuchfunktion"""
-        
-        if not bundesland or not gemarkung_name or not flur_text or not zaehler_text:
-            return False, "Bitte alle Pflichtfelder ausfüllen!"
-            
-        try:
-            gemarkungen_data = self.get_gemarkungen_for_bundesland(bundesland)
-            if not gemarkungen_data:
-                return False, f"Keine Gemarkungsdaten für {bundesland} gefunden!"
-            
-            gem_schluessel, gem_full_name = self.find_gemarkung_by_name(gemarkung_name, gemarkungen_data)
-            if not gem_schluessel:
-                return False, f"Gemarkung '{gemarkung_name}' nicht gefunden!"
-            
-            if not self.validate_gemarkungsschluessel(gem_schluessel, bundesland):
-                return False, "Ungültiger Gemarkungsschlüssel!"
+        success, anfrage = self.bereite_anfrage_vor(bundesland, gemarkung_name, flur_text, zaehler_text, nenner_text)
+        if not success:
+            return False, anfrage
+        self.protokolliere_anfrage(anfrage)
 
-            flur_num = int(flur_text)
-            zaehler_num = int(zaehler_text)
-            
-            flur = flur_text.zfill(3)
-            zaehler = zaehler_text.zfill(5)
-        
-            if bundesland == "Rheinland-Pfalz":
-                success, message = self.suche_rheinland_pfalz(gem_schluessel, gem_full_name, gemarkungen_data, 
-                                                              flur_text, zaehler_text, nenner_text, 
-                                                              gemarkung_name, bundesland)
-                return success, message
-            
-            flstkennz = self.erstelle_flurstueckskennzeichen(bundesland, gem_schluessel, flur, zaehler, nenner_text)
-            QgsMessageLog.logMessage(f"Suche Flurstück: {flstkennz}", "Flurstück-Suche")
+        anfrage["cache_umgehen"] = cache_umgehen
+        if anfrage.get("kandidaten"):
+            for kandidat in anfrage["kandidaten"]:
+                kandidat["cache_umgehen"] = cache_umgehen
+            success, ergebnis = self.lade_erstes_flurstueck(anfrage["kandidaten"])
+            if success:
+                anfrage = ergebnis.pop("anfrage")
+        else:
+            success, ergebnis = self.lade_flurstueck(anfrage)
+        if not success:
+            return False, ergebnis
+
+        return self.zeige_ergebnis(anfrage, ergebnis)
+
+    def zeige_ergebnis(self, anfrage, ergebnis):
+        """Legt den Memory-Layer für ein geladenes Flurstück an und zeigt ihn
+
+        Im Sammellayer-Modus wird das Flurstück stattdessen an den Layer
+        des Bundeslands angehängt.
+        """
+        try:
+            layer_name = self.erstelle_layer_name(anfrage["bundesland"], anfrage["gem_full_name"],
+                                                  anfrage["flur_text"], anfrage["zaehler_text"],
+                                                  anfrage["nenner_text"])
+            if self.ergebnis_layer.aktiv():
+                return self.sammle_ergebnis(anfrage["bundesland"], layer_name, ergebnis)
 
-        except ValueError:
-            return False, "Bitte nur Zahlen für Flur, Zähler und Nenner eingeben!"
+            layer = ergebnis.get("layer")
+            if layer is not None:
+                layer.setName(layer_name)
+            else:
+                layer = self.erstelle_memory_layer(layer_name, ergebnis)
+            QgsMessageLog.logMessage(f"Memory-Layer erstellt: {layer.name()}", "Flurstück-Suche")
+            self.zeige_layer(layer)
+            self.flurstueck_index.fuege_hinzu(anfrage["bundesland"], layer.getFeatures(), layer.crs())
         except Exception as e:
-            return False, f"Fehler bei der Eingabeverarbeitung: {str(e)}"
-        
+            QgsMessageLog.logMessage(f"Fehler beim Anlegen des Layers: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Fehler beim Anlegen des Layers: {str(e)}"
+
+        if ergebnis.get("quelle") == "bestand":
+            return True, f"Flurstück aus lokalem Bestand geladen: {layer_name}"
+        if ergebnis.get("quelle") != "cache":
+            return True, f"Flurstück erfolgreich geladen: {layer_name}"
+        if ergebnis.get("abgelaufen"):
+            return True, f"Server nicht erreichbar, Flurstück aus Cache geladen: {layer_name}"
+        return True, f"Flurstück aus Cache geladen: {layer_name}"
+
+    def sammle_ergebnis(self, bundesland, layer_name, ergebnis, zoomen=True):
+        """Hängt ein Suchergebnis an den Sammellayer des Bundeslands an"""
+        quelle = ergebnis.get("layer")
+        features = quelle.getFeatures() if quelle is not None else ergebnis["features"]
+        layer, neu, extent = self.ergebnis_layer.fuege_hinzu(bundesland, features, ergebnis["crs"])
+        self.flurstueck_index.fuege_hinzu(bundesland, layer.getFeatures(QgsFeatureRequest(extent)), layer.crs())
+        if zoomen:
+            self.zoome_auf(extent)
+        else:
+            self.iface.mapCanvas().refresh()
+
+        if not neu:
+            return True, f"Flurstück bereits in {layer.name()}: {layer_name}"
+        if ergebnis.get("quelle") == "cache":
+            return True, f"Flurstück aus Cache zu {layer.name()} hinzugefügt: {layer_name}"
+        return True, f"Flurstück zu {layer.name()} hinzugefügt: {layer_name}"
+
+    def sammle_treffer(self, treffer):
+        """Hängt Stapeltreffer an die Sammellayer ihrer Bundesländer an
+
+        Die Features werden je Bundesland in einem Schritt eingefügt; die
+        Karte wird für den ganzen Stapel nur einmal neu gezeichnet. Gibt den
+        zuletzt befüllten Layer zurück.
+        """
+        gruppen = {}
+        for _, anfrage, ergebnis in treffer:
+            gruppe = gruppen.setdefault((anfrage["bundesland"], ergebnis["crs"].authid()), (ergebnis["crs"], []))
+            gruppe[1].extend(ergebnis["features"])
+
+        layer = None
+        extent = QgsRectangle()
+        for (bundesland, _), (crs, features) in gruppen.items():
+            layer, _, teil_extent = self.ergebnis_layer.fuege_hinzu(bundesland, features, crs)
+            extent.combineExtentWith(teil_extent)
+        if layer is not None:
+            self.zoome_auf(extent)
+        return layer
+
+    def starte_suche_task(self, bundesland, gemarkung_name, flur_text, zaehler_text, nenner_text, fertig=None,
+                          cache_umgehen=False):
+        """Startet die Suche als Hintergrund-Task
+
+        Die Eingabeprüfung läuft sofort; Abruf und Dekodierung laufen im
+        QGIS-Taskmanager. fertig(success, message) wird im Hauptthread
+        aufgerufen, sobald der Task beendet ist.
+        """
+        success, anfrage = self.bereite_anfrage_vor(bundesland, gemarkung_name, flur_text, zaehler_text, nenner_text)
+        if not success:
+            return False, anfrage
+        self.protokolliere_anfrage(anfrage)
+
+        anfrage["cache_umgehen"] = cache_umgehen
+        for kandidat in anfrage.get("kandidaten", []):
+            kandidat["cache_umgehen"] = cache_umgehen
+        task = FlurstueckSucheTask(self, anfrage, fertig)
+        self.registriere_task(task)
+        return True, f"Suche gestartet: {task.description()}"
+
+    def starte_bereich_task(self, bundesland, gemarkung_name, flur_text="", fertig=None):
+        """Lädt alle Flurstücke einer Flur (oder ohne Flur der ganzen Gemarkung) im Hintergrund
+
+        Ist ein Exportverzeichnis eingestellt (siehe export_pfad), wird in
+        eine Datei statt in einen Memory-Layer geschrieben.
+        """
+        success, anfrage = self.bereite_bereich_vor(bundesland, gemarkung_name, flur_text)
+        if not success:
+            return False, anfrage
+
+        senke = None
+        pfad = export_pfad(self.erstelle_bereich_layer_name(anfrage))
+        if pfad:
+            senke = FlurstueckDateiSenke(pfad)
+        task = FlurstueckBereichTask(FlurstueckBereichDownload(self, anfrage, senke=senke), fertig)
+        self.registriere_task(task)
+        return True, f"Download gestartet: {task.description()}"
+
+    def starte_ausschnitt_task(self, bundesland, fertig=None):
+        """Lädt alle Flurstücke im aktuellen Kartenausschnitt im Hintergrund"""
+        if bundesland == ALLE_BUNDESLAENDER:
+            return False, "Für den Kartenausschnitt bitte ein Bundesland wählen!"
+        if bundesland not in self.wfs_urls:
+            return False, f"Keine WFS-URL für {bundesland} konfiguriert!"
+
+        canvas = self.iface.mapCanvas()
+        senke = None
+        pfad = export_pfad(f"{bundesland} Kartenausschnitt")
+        if pfad:
+            senke = FlurstueckDateiSenke(pfad)
+        download = FlurstueckAusschnittDownload(self, bundesland, canvas.extent(),
+                                                canvas.mapSettings().destinationCrs(), senke=senke)
+        success, meldung = download.pruefe()
+        if not success:
+            return False, meldung
+
+        task = FlurstueckBereichTask(download, fertig)
+        self.registriere_task(task)
+        return True, f"Download gestartet: {task.description()}"
+
+    def identifiziere(self, punkt, crs):
+        """Sucht das Flurstück an einem Kartenpunkt
+
+        Zuerst wird der räumliche Index der zuletzt geladenen Flurstücke
+        befragt; nur ohne Treffer geht ein BBOX-Request an den WFS des
+        aktiven Bundeslands.
+        """
+        bundesland = self.aktives_bundesland()
+        index_crs = self.flurstueck_index.crs
+        if crs != index_crs:
+            punkt = QgsCoordinateTransform(crs, index_crs, QgsProject.instance()).transform(punkt)
+
+        treffer = self.flurstueck_index.finde(punkt, bundesland)
+        if treffer:
+            self.melde(*self.zeige_punkt_ergebnis(bundesland, treffer, index_crs))
+            return
+
+        self.registriere_task(FlurstueckPunktTask(self, bundesland, punkt, self.melde))
+
+    def zeige_punkt_ergebnis(self, bundesland, features, crs):
+        """Zeigt per Klick gefundene Flurstücke als Layer an (ohne Zoom)"""
+        feature = features[0]
+        if feature.fields().indexFromName("flstkennz") != -1:
+            bezeichnung = str(feature["flstkennz"]).strip().rstrip("_")
+        else:
+            bezeichnung = " - ".join(str(feature[name]) for name in ("gemarkung", "flur", "flstnrzae")
+                                     if feature.fields().indexFromName(name) != -1)
+        layer_name = f"{BUNDESLAND_KUERZEL.get(bundesland, '')} - Flurstück {bezeichnung}"
+
         try:
-            wfs_url = self.wfs_urls.get(bundesland)
-            if not wfs_url:
-                return False, f"Keine WFS-URL für {bundesland} konfiguriert!"
-            
-            url = self.erstelle_wfs_request_standard(flstkennz, wfs_url, bundesland)
-            QgsMessageLog.logMessage(f"WFS-URL: {url}", "Flurstück-Suche")
-            
-            response = requests.get(url, timeout=30)
-            
-            if response.status_code != 200:
-                return False, f"Fehler beim Abruf: HTTP {response.status_code}"
-                
-            return self.verarbeite_wfs_antwort(response, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text)
-            
-        except requests.exceptions.Timeout:
-            return False, "Timeout: Server antwortet nicht"
-        except requests.exceptions.RequestException as e:
-            return False, f"Netzwerkfehler: {str(e)}"
+            if self.ergebnis_layer.aktiv():
+                return self.sammle_ergebnis(bundesland, layer_name, {"crs": crs, "features": features}, zoomen=False)
+            layer = self.erstelle_memory_layer(layer_name, {"felder": feature.fields(), "crs": crs,
+                                                            "features": features})
+            self.zeige_layer(layer, zoomen=False)
         except Exception as e:
-            QgsMessageLog.logMessage(f"Fehler: {str(e)}", "Flurstück-Suche", Qgis.Critical)
-            return False, f"Unerwarteter Fehler: {str(e)}"
-    
+            QgsMessageLog.logMessage(f"Fehler beim Anlegen des Layers: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+            return False, f"Fehler beim Anlegen des Layers: {str(e)}"
+        return True, f"Flurstück gefunden: {layer_name}"
+
+    def registriere_task(self, task):
+        """Übergibt einen Task an den Taskmanager und hält eine Referenz"""
+        self.tasks.append(task)
+        task.taskCompleted.connect(lambda: self.entferne_task(task))
+        task.taskTerminated.connect(lambda: self.entferne_task(task))
+        QgsApplication.taskManager().addTask(task)
+
+    def entferne_task(self, task):
+        """Entfernt einen beendeten Task aus der Liste"""
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+    def laufende_tasks(self):
+        """Anzahl der laufenden oder wartenden Suchen"""
+        return len(self.tasks)
+
+    def breche_tasks_ab(self):
+        """Bricht alle laufenden Suchen ab"""
+        for task in list(self.tasks):
+            task.cancel()
+
     def suche_rheinland_pfalz(self, gem_schluessel, gem_full_name, gemarkungen_data, 
                               flur_text, zaehler_text, nenner_text, gemarkung_name, bundesland):
-        """Spezielle Suchfunktion für Rheinland-Pfalz mit kombinierter Filterung"""
-        try:
-            wfs_url = self.wfs_urls.get("Rheinland-Pfalz")
-            if not wfs_url:
-                return False, "Keine WFS-URL für Rheinland-Pfalz konfiguriert!"
-            
-            gemarkung_value = gemarkungen_data[gem_schluessel]["name"]
-            flur_value = f"Flur {flur_text}"
-            
-            url = self.erstelle_wfs_request_rlp(gemarkung_value, flur_value, zaehler_text, nenner_text, wfs_url)
-            QgsMessageLog.logMessage(f"RLP WFS-URL: {url}", "Flurstück-Suche")
-            
-            response = requests.get(url, timeout=30)
-            
-            if response.status_code != 200:
-                return False, f"Fehler beim Abruf: HTTP {response.status_code}"
-            
-            return self.verarbeite_wfs_antwort(response, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text)
-            
-        except Exception as e:
-            QgsMessageLog.logMessage(f"Fehler RLP-Suche: {str(e)}", "Flurstück-Suche", Qgis.Critical)
-            return False, f"Fehler bei RLP-Suche: {str(e)}"
-    
-    def erstelle_wfs_request_rlp(self, gemarkung, flur, zaehler, nenner, wfs_url):
-        """Erstellt WFS-Request für Rheinland-Pfalz mit kombinierter Filterung"""
-        url = f"{wfs_url}?SERVICE=WFS&VERSION=2.0.0&REQUEST=GetFeature"
-        url += "&TYPENAMES=ave:Flurstueck"
-        url += "&SRSNAME=urn:ogc:def:crs:EPSG::25832"
-        url += "&OUTPUTFORMAT=application/x-zip-shapefile"
-        
-        filter_xml = f'''<Filter xmlns="http://www.opengis.net/fes/2.0">
-  <And>
-    <PropertyIsEqualTo>
-      <ValueReference>gemarkung</ValueReference>
-      <Literal>{gemarkung}</Literal>
-    </PropertyIsEqualTo>
-    <PropertyIsEqualTo>
-      <ValueReference>flur</ValueReference>
-      <Literal>{flur}</Literal>
-    </PropertyIsEqualTo>
-    <PropertyIsEqualTo>
-      <ValueReference>flstnrzae</ValueReference>
-      <Literal>{zaehler}</Literal>
-    </PropertyIsEqualTo>'''
-    
-        if nenner and nenner.strip():
-            filter_xml += f'''
-    <PropertyIsEqualTo>
-      <ValueReference>flstnrnen</ValueReference>
-      <Literal>{nenner}</Literal>
-    </PropertyIsEqualTo>'''
-        
-        filter_xml += '''
-  </And>
-</Filter>'''
-        
-        filter_encoded = urllib.parse.quote(filter_xml)
-        url += f"&FILTER={filter_encoded}"
-        
-        return url
-    
-    def erstelle_wfs_request_standard(self, flstkennz, wfs_url, bundesland):
-        """Erstellt WFS-Request für NRW, Niedersachsen und Hessen"""
-        
-        config = {
-            "Nordrhein-Westfalen": {
-                "version": "1.1.0",
-                "typename": "TYPENAME",
-                "filter_ns": "ogc_with_ave",
-                "output_format": "application/x-zip-shapefile"
-            },
-            "Niedersachsen": {
-                "version": "1.1.0",
-                "typename": "typename",
-                "filter_ns": "ogc_with_ave",
-                "output_format": "application/x-zip-shapefile"
-            },
-            "Hessen": {
-                "version": "2.0.0", 
-                "typename": "TYPENAMES",
-                "filter_ns": "fes",
-                "output_format": "application/x-zip-shapefile"
-            }
-        }
-        
-        cfg = config.get(bundesland)
-        if not cfg:
-            return None
-        
-        url = f"{wfs_url}?SERVICE=WFS&VERSION={cfg['version']}"
-        url += f"&REQUEST=GetFeature&{cfg['typename']}=ave:Flurstueck"
-        url += f"&OUTPUTFORMAT={cfg['output_format']}"
-        
-        if cfg['filter_ns'] == "fes":
-            filter_xml = f'''<fes:Filter xmlns:fes="http://www.opengis.net/fes/2.0" 
-                     xmlns:ave="http://repository.gdi-de.org/schemas/adv/produkt/alkis-vereinfacht/2.0">
-                      <fes:PropertyIsEqualTo>
-                        <fes:ValueReference>ave:flstkennz</fes:ValueReference>
-                        <fes:Literal>{flstkennz}</fes:Literal>
-                      </fes:PropertyIsEqualTo>
-                    </fes:Filter>'''
-        else:
-            filter_xml = f'''<Filter xmlns="http://www.opengis.net/ogc" 
-                     xmlns:ave="http://repository.gdi-de.org/schemas/adv/produkt/alkis-vereinfacht/2.0">
-                      <PropertyIsEqualTo>
-                        <PropertyName>ave:flstkennz</PropertyName>
-                        <Literal>{flstkennz}</Literal>
-                      </PropertyIsEqualTo>
-                    </Filter>'''
-        
-        filter_encoded = urllib.parse.quote(filter_xml)
-        url += f"&FILTER={filter_encoded}"
-        
-        return url
-    
-    def erstelle_flurstueckskennzeichen(self, bundesland, gem_schluessel, flur, zaehler, nenner_text):
-        """Erstellt flstkennz je nach Bundesland-Format"""
-        
-        zaehler_formatted = zaehler.zfill(5)
-        
-        # Alle Bundesländer außer RLP verwenden das gleiche Format
-        if nenner_text and nenner_text.strip():
-            nenner_formatted = nenner_text.zfill(5)
-            return f"{gem_schluessel}{flur}{zaehler_formatted}/{nenner_formatted}______"
-        else:
-            return f"{gem_schluessel}{flur}{zaehler_formatted}______"
-    
+        """Spezielle Suchfunktion für Rheinland-Pfalz mit kombinierter Filterung
+
+        Die RLP-Filterung steckt in bereite_anfrage_vor; diese Methode bleibt
+        für bestehende Aufrufer erhalten.
+        """
+        return self.suche_flurstueck("Rheinland-Pfalz", gemarkung_name, flur_text, zaehler_text, nenner_text)
+
     def verarbeite_wfs_antwort(self, response, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text):
         """Verarbeitet die WFS-Antwort (ZIP oder XML)"""
-        
-        content_type = response.headers.get('Content-Type', '').lower()
-        
-        # Alle Bundesländer verwenden jetzt Shapefiles
-        # XML-Verarbeitung nur als Fallback bei Problemen
-        if 'xml' in content_type and 'shapefile' not in content_type:
-            return self.verarbeite_xml_antwort(response, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text)
-        else:
-            return self.verarbeite_shapefile_antwort(response, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text)
-    
+        with self.metriken.messung(bundesland) as messung:
+            messung.bytes = len(response.content)
+            if self.ist_xml_antwort(response):
+                success, meldung = self.verarbeite_xml_antwort(response, bundesland, gem_full_name, flur_text,
+                                                               zaehler_text, nenner_text)
+            else:
+                success, meldung = self.verarbeite_shapefile_antwort(response, bundesland, gem_full_name, flur_text,
+                                                                     zaehler_text, nenner_text)
+            messung.erfolg = success
+            messung.meldung = "" if success else meldung
+            return success, meldung
+
     def verarbeite_shapefile_antwort(self, response, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text):
         """Verarbeitet Shapefile-Antwort"""
+        with self.metriken.stufe("dekodierung"):
+            success, ergebnis = self.lese_shapefile_antwort(response)
+        if not success:
+            return False, ergebnis
+        self.metriken.zaehle_features(len(ergebnis["features"]))
+
         try:
-            with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as tmp_zip:
-                tmp_zip.write(response.content)
-                zip_path = tmp_zip.name
-                
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(tmp_dir)
-                    
-                shape_files = [f for f in os.listdir(tmp_dir) if f.endswith('.shp')]
-                if not shape_files:
-                    for root, dirs, files in os.walk(tmp_dir):
-                        shape_files = [f for f in files if f.endswith('.shp')]
-                        if shape_files:
-                            tmp_dir = root
-                            break
-                            
-                if not shape_files:
-                    os.unlink(zip_path)
-                    return False, "Kein Shapefile gefunden!"
-                    
-                shape_path = os.path.join(tmp_dir, shape_files[0])
-                ortsteil = gem_full_name.split('(')[0].strip()
-
-                bundesland_kuerzel = {
-                    "Nordrhein-Westfalen": "NRW",
-                    "Niedersachsen": "NI", 
-                    "Hessen": "HE",
-                    "Rheinland-Pfalz": "RLP"
-                }.get(bundesland, "")
-                
-                memory_layer_name = f"{bundesland_kuerzel} - {ortsteil} - Flur {flur_text} - Flurstück {zaehler_text}"
-                if nenner_text:
-                    memory_layer_name += f"/{nenner_text}"
-                    
-                source_memory_layer = QgsVectorLayer(shape_path, "temp_source", "ogr")
-
-                if not source_memory_layer.isValid():
-                    if zip_path and os.path.exists(zip_path):
-                        os.unlink(zip_path)
-                    return False, "Shapefile konnte nicht geladen werden!"
-
-                if source_memory_layer.featureCount() == 0:
-                    if zip_path and os.path.exists(zip_path):
-                        os.unlink(zip_path)
-                    return False, "Keine Geometrien im Shapefile!"
-
-                memory_layer = QgsVectorLayer(
-                    f"Polygon?crs={source_memory_layer.crs().authid()}",
-                    memory_layer_name,
-                    "memory"
-                )
-
-                provider = memory_layer.dataProvider()
-                provider.addAttributes(source_memory_layer.fields())
-                memory_layer.updateFields()
-
-                features = list(source_memory_layer.getFeatures())
-                provider.addFeatures(features)
-                memory_layer.updateExtents()
-
-                QgsMessageLog.logMessage(
-                    f"Memory-Layer erstellt: {memory_layer.name()}",
-                    "Flurstück-Suche"
-                )
-
-                QgsProject.instance().addMapLayer(memory_layer)                    
-                
-                canvas = self.iface.mapCanvas()
-                extent = memory_layer.extent()
-
-                if extent.isNull() or not extent.isFinite():
-                    center = memory_layer.extent().center()
-                    canvas.setCenter(center)
-                    canvas.zoomScale(1000)
-                else:
-                    extent_buffered = extent.buffered(50)
-                    canvas.setExtent(extent_buffered)
-
-                canvas.refresh()
-                
-            os.unlink(zip_path)
-            
+            memory_layer_name = self.erstelle_layer_name(bundesland, gem_full_name, flur_text, zaehler_text, nenner_text)
+            memory_layer = self.erstelle_memory_layer(memory_layer_name, ergebnis)
+
+            QgsMessageLog.logMessage(
+                f"Memory-Layer erstellt: {memory_layer.name()}",
+                "Flurstück-Suche"
+            )
+
+            self.zeige_layer(memory_layer)
+
             return True, f"Flurstück erfolgreich geladen: {memory_layer_name}"
-            
-        except zipfile.BadZipFile:
-            return False, "Ungültige ZIP-Datei empfangen"
+
         except Exception as e:
             QgsMessageLog.logMessage(f"Shapefile-Verarbeitungsfehler: {str(e)}", "Flurstück-Suche", Qgis.Critical)
             return False, f"Fehler bei Shapefile-Verarbeitung: {str(e)}"
-    
+
     def verarbeite_xml_antwort(self, response, bundesland, gem_full_name, flur_text, zaehler_text, nenner_text):
         """Verarbeitet XML-Antwort (Fallback)"""
+        with self.metriken.stufe("dekodierung"):
+            success, ergebnis = self.lese_xml_antwort(response)
+        if not success:
+            return False, ergebnis
+        self.metriken.zaehle_features(len(ergebnis["features"]))
+
         try:
-            with tempfile.NamedTemporaryFile(suffix='.xml', delete=False, mode='w', encoding='utf-8') as tmp_xml:
-                tmp_xml.write(response.text)
-                xml_path = tmp_xml.name
-            
-            ortsteil = gem_full_name.split('(')[0].strip()
-            
-            bundesland_kuerzel = {
-                "Nordrhein-Westfalen": "NRW",
-                "Niedersachsen": "NI", 
-                "Hessen": "HE",
-                "Rheinland-Pfalz": "RLP"
-            }.get(bundesland, "")
-            
-            memory_layer_name = f"{bundesland_kuerzel} - {ortsteil} - Flur {flur_text} - Flurstück {zaehler_text}"
-            if nenner_text:
-                memory_layer_name += f"/{nenner_text}"
-            
-            source_layer = QgsVectorLayer(xml_path, "temp_xml_source", "ogr")
-            
-            if not source_layer.isValid():
-                os.unlink(xml_path)
-                return False, "XML konnte nicht geladen werden!"
-            
-            if source_layer.featureCount() == 0:
-                os.unlink(xml_path)
-                return False, "Keine Geometrien in XML gefunden!"
-            
-            memory_layer = QgsVectorLayer(
-                f"Polygon?crs={source_layer.crs().authid()}",
-                memory_layer_name,
-                "memory"
-            )
-            
-            provider = memory_layer.dataProvider()
-            provider.addAttributes(source_layer.fields())
-            memory_layer.updateFields()
-            
-            features = list(source_layer.getFeatures())
-            provider.addFeatures(features)
-            memory_layer.updateExtents()
+            memory_layer_name = self.erstelle_layer_name(bundesland, gem_full_name, flur_text, zaehler_text, nenner_text)
+            memory_layer = self.erstelle_memory_layer(memory_layer_name, ergebnis)
             
             QgsMessageLog.logMessage(
                 f"Memory-Layer aus XML erstellt: {memory_layer.name()}",
                 "Flurstück-Suche"
             )
             
-            QgsProject.instance().addMapLayer(memory_layer)
-            
-            canvas = self.iface.mapCanvas()
-            extent = memory_layer.extent()
-            
-            if extent.isNull() or not extent.isFinite():
-                center = memory_layer.extent().center()
-                canvas.setCenter(center)
-                canvas.zoomScale(1000)
-            else:
-                extent_buffered = extent.buffered(50)
-                canvas.setExtent(extent_buffered)
-            
-            canvas.refresh()
-            
-            os.unlink(xml_path)
+            self.zeige_layer(memory_layer)
             
             return True, f"Flurstück erfolgreich geladen: {memory_layer_name}"
             
         except Exception as e:
             QgsMessageLog.logMessage(f"XML-Verarbeitungsfehler: {str(e)}", "Flurstück-Suche", Qgis.Critical)
             return False, f"Fehler bei XML-Verarbeitung: {str(e)}"
-        
-    def find_gemarkung_by_name(self, gemarkung_input, gemarkungen_data):
-        """Findet passende Gemarkung"""
-        if not gemarkung_input or not gemarkungen_data:
-            return None, None
-        
-        input_lower = gemarkung_input.lower().strip()
-        
-        if input_lower.isdigit() and len(input_lower) == 4:
-            for schluessel, data in gemarkungen_data.items():
-                if data["nummer"] == input_lower:
-                    return schluessel, data["full_name"]
-            
-        for schluessel, data in gemarkungen_data.items():
-            if input_lower == data["name"].lower():
-                return schluessel, data["full_name"]
 
-        return None, None
-    
-    def validate_gemarkungsschluessel(self, schluessel, bundesland):
-        """Validiert Gemarkungsschlüssel"""
-        validators = {
-            "Nordrhein-Westfalen": lambda s: len(s) == 6 and s.startswith('05'),
-            "Niedersachsen": lambda s: len(s) == 6 and s.startswith('03'),
-            "Hessen": lambda s: len(s) == 6 and s.startswith('06'),
-            "Rheinland-Pfalz": lambda s: len(s) == 6 and s.startswith('07')
-        }
-        validator = validators.get(bundesland)
-        return validator(schluessel) if validator else False
+    def zeige_layer(self, layer, zoomen=True):
+        """Fügt den Layer zum Projekt hinzu und zoomt darauf"""
+        QgsProject.instance().addMapLayer(layer)
+
+        if not zoomen:
+            self.iface.mapCanvas().refresh()
+            return
+
+        self.zoome_auf(layer.extent())
+
+    def zoome_auf(self, extent):
+        """Zoomt auf ein Rechteck (mit 50 m Rand) und zeichnet die Karte einmal neu"""
+        canvas = self.iface.mapCanvas()
+
+        if extent.isNull() or not extent.isFinite():
+            center = extent.center()
+            canvas.setCenter(center)
+            canvas.zoomScale(1000)
+        else:
+            extent_buffered = extent.buffered(50)
+            canvas.setExtent(extent_buffered)
+
+        canvas.refresh()
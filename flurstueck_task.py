@@ -0,0 +1,205 @@
+from qgis.core import QgsTask, QgsMessageLog, Qgis
+
+
+class FlurstueckSucheTask(QgsTask):
+    """Ruft ein Flurstück im Hintergrund ab
+
+    run() läuft in einem Worker-Thread und erledigt Download und
+    Dekodierung. finished() läuft im Hauptthread und legt nur noch den
+    Layer an und zoomt darauf. Enthält die Anfrage "kandidaten" (Gemarkung
+    in mehreren Bundesländern), wird in allen zugleich gesucht.
+    """
+
+    def __init__(self, plugin, anfrage, fertig=None):
+        layer_name = plugin.erstelle_layer_name(anfrage["bundesland"], anfrage["gem_full_name"],
+                                                anfrage["flur_text"], anfrage["zaehler_text"],
+                                                anfrage["nenner_text"])
+        if anfrage.get("kandidaten"):
+            layer_name += f" ({len(anfrage['kandidaten'])} Bundesländer)"
+        super().__init__(f"Flurstück-Suche: {layer_name}", QgsTask.CanCancel)
+        self.plugin = plugin
+        self.anfrage = anfrage
+        self.fertig = fertig
+        self.ergebnis = None
+
+    def run(self):
+        """Download und Dekodierung (Worker-Thread)"""
+        if self.anfrage.get("kandidaten"):
+            success, self.ergebnis = self.plugin.lade_erstes_flurstueck(self.anfrage["kandidaten"],
+                                                                        self.setProgress, self.isCanceled)
+            if success:
+                self.anfrage = self.ergebnis.pop("anfrage")
+        else:
+            success, self.ergebnis = self.plugin.lade_flurstueck(self.anfrage, self.setProgress, self.isCanceled)
+        return success and not self.isCanceled()
+
+    def finished(self, result):
+        """Layer anlegen und anzeigen (Hauptthread)"""
+        if self.isCanceled():
+            success, message = False, "Suche abgebrochen"
+        elif not result:
+            success, message = False, self.ergebnis or "Suche fehlgeschlagen"
+        else:
+            success, message = self.plugin.zeige_ergebnis(self.anfrage, self.ergebnis)
+
+        self.ergebnis = None
+        if self.fertig:
+            self.fertig(success, message)
+
+
+class FlurstueckBatchTask(QgsTask):
+    """Führt eine Stapelsuche im Hintergrund aus"""
+
+    def __init__(self, batch, zeilen, fertig=None):
+        super().__init__(f"Flurstück-Stapelsuche ({len(zeilen)} Flurstücke)", QgsTask.CanCancel)
+        self.batch = batch
+        self.zeilen = zeilen
+        self.fertig = fertig
+        self.treffer = []
+        self.bericht = []
+
+    def run(self):
+        """Sammel-Requests abrufen (Worker-Thread)"""
+        def fortschritt(erledigt, gesamt):
+            self.setProgress(100 * erledigt / gesamt if gesamt else 100)
+
+        self.treffer, self.bericht = self.batch.fuehre_aus(self.zeilen, fortschritt, self.isCanceled)
+        if self.batch.senke is not None:
+            self.batch.senke.schliesse()
+        return not self.isCanceled()
+
+    def finished(self, result):
+        """Treffer zu einem Layer zusammenführen (Hauptthread)"""
+        layer = None
+        if self.batch.senke is not None and self.batch.senke.anzahl:
+            try:
+                layer = self.batch.senke.als_layer("Stapelsuche Flurstücke")
+                self.batch.plugin.zeige_layer(layer)
+            except Exception as e:
+                QgsMessageLog.logMessage(f"Fehler beim Laden der Ergebnisdatei: {str(e)}", "Flurstück-Suche",
+                                         Qgis.Critical)
+        elif self.treffer:
+            try:
+                if self.batch.plugin.ergebnis_layer.aktiv():
+                    layer = self.batch.plugin.sammle_treffer(self.treffer)
+                else:
+                    layer = self.batch.fuehre_treffer_zusammen(self.treffer)
+                    self.batch.plugin.zeige_layer(layer)
+            except Exception as e:
+                QgsMessageLog.logMessage(f"Fehler beim Zusammenführen: {str(e)}", "Flurstück-Suche", Qgis.Critical)
+
+        self.treffer = []
+        if self.fertig:
+            self.fertig(layer, self.bericht, not result)
+
+
+class FlurstueckBereichTask(QgsTask):
+    """Lädt alle Flurstücke einer Flur oder Gemarkung im Hintergrund"""
+
+    def __init__(self, download, fertig=None):
+        super().__init__(f"Flurstück-Download: {download.layer_name}", QgsTask.CanCancel)
+        self.download = download
+        self.fertig = fertig
+        self.ergebnis = None
+
+    def run(self):
+        """Seiten abrufen und in den Layer schreiben (Worker-Thread)"""
+        success, self.ergebnis = self.download.fuehre_aus(self.setProgress, self.isCanceled)
+        if not success and self.download.senke is not None:
+            self.download.senke.verwerfe()
+        return success and not self.isCanceled()
+
+    def finished(self, result):
+        """Layer anzeigen (Hauptthread)"""
+        if self.isCanceled():
+            success, message = False, "Download abgebrochen"
+        elif not result:
+            success, message = False, self.ergebnis or "Download fehlgeschlagen"
+        else:
+            layer = self.ergebnis["layer"]
+            try:
+                self.download.plugin.zeige_layer(layer)
+                self.download.plugin.flurstueck_index.fuege_hinzu(self.download.bundesland, layer.getFeatures(),
+                                                                  layer.crs())
+                success, message = True, f"{self.ergebnis['anzahl']} Flurstücke geladen: {layer.name()}"
+            except Exception as e:
+                QgsMessageLog.logMessage(f"Fehler beim Anlegen des Layers: {str(e)}", "Flurstück-Suche",
+                                         Qgis.Critical)
+                success, message = False, f"Fehler beim Anlegen des Layers: {str(e)}"
+
+        self.ergebnis = None
+        if self.fertig:
+            self.fertig(success, message)
+
+
+class FlurstueckPunktTask(QgsTask):
+    """Sucht das Flurstück an einem Kartenpunkt im Hintergrund"""
+
+    def __init__(self, plugin, bundesland, punkt, fertig=None):
+        super().__init__(f"Flurstück-Suche per Klick ({bundesland})", QgsTask.CanCancel)
+        self.plugin = plugin
+        self.bundesland = bundesland
+        self.punkt = punkt
+        self.fertig = fertig
+        self.ergebnis = None
+
+    def run(self):
+        """BBOX-Request am Punkt (Worker-Thread)"""
+        success, self.ergebnis = self.plugin.lade_flurstueck_an_punkt(self.bundesland, self.punkt, self.isCanceled)
+        return success and not self.isCanceled()
+
+    def finished(self, result):
+        """Gefundenes Flurstück anzeigen (Hauptthread)"""
+        if self.isCanceled():
+            success, message = False, "Suche abgebrochen"
+        elif not result:
+            success, message = False, self.ergebnis or "Suche fehlgeschlagen"
+        else:
+            success, message = self.plugin.zeige_punkt_ergebnis(self.bundesland, self.ergebnis["features"],
+                                                                self.ergebnis["crs"])
+
+        self.ergebnis = None
+        if self.fertig:
+            self.fertig(success, message)
+
+
+class FlurstueckKatalogTask(QgsTask):
+    """Gleicht den Gemarkungskatalog im Hintergrund mit den WFS der Länder ab"""
+
+    def __init__(self, plugin, fertig=None):
+        super().__init__("Gemarkungen aktualisieren", QgsTask.CanCancel)
+        self.plugin = plugin
+        self.fertig = fertig
+        self.berichte = None
+        self.fehler = None
+
+    def run(self):
+        """Gemarkungslisten abrufen und geänderte Länder schreiben (Worker-Thread)"""
+        try:
+            self.berichte = self.plugin.katalog.aktualisiere(fortschritt=self.setProgress,
+                                                             abgebrochen=self.isCanceled)
+        except Exception as e:
+            QgsMessageLog.logMessage(f"Fehler beim Aktualisieren der Gemarkungen: {str(e)}", "Flurstück-Suche",
+                                     Qgis.Critical)
+            self.fehler = str(e)
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        """Ergebnis melden (Hauptthread)"""
+        if self.isCanceled():
+            success, message = False, "Aktualisierung der Gemarkungen abgebrochen"
+        elif not result:
+            success, message = False, f"Fehler beim Aktualisieren der Gemarkungen: {self.fehler}"
+        else:
+            geaendert = [f"{bundesland} ({bericht['meldung']})" for bundesland, bericht in self.berichte.items()
+                         if bericht["status"] == "aktualisiert"]
+            fehler = [bundesland for bundesland, bericht in self.berichte.items() if bericht["status"] == "fehler"]
+            success = not fehler
+            message = f"Gemarkungen aktualisiert: {', '.join(geaendert)}" if geaendert else \
+                "Gemarkungen sind aktuell"
+            if fehler:
+                message += f"; fehlgeschlagen: {', '.join(fehler)}"
+
+        if self.fertig:
+            self.fertig(success, message)
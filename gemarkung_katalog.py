@@ -0,0 +1,459 @@
+from qgis.core import QgsMessageLog, Qgis
+from collections.abc import Mapping
+from .gemarkungen_kompilieren import GEMARKUNG_DATEIEN, SQLITE_DATEI, FORMAT_VERSION
+from .gemarkungen_aktualisieren import aktualisiere
+import bisect
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+import urllib.parse
+
+UMLAUTE = str.maketrans({"ä": "a", "ö": "o", "ü": "u", "ß": "ss"})
+
+# Stufen von GemarkungTabelle.finde_mit_stufe, von eindeutig bis unscharf
+STUFE_KLAMMER, STUFE_NUMMER, STUFE_NAME, STUFE_GEFALTET, STUFE_PRAEFIX, STUFE_UNSCHARF = range(6)
+
+# Position, wenn der gefaltete Name auf mehrere Gemarkungen passt
+MEHRDEUTIG = -2
+
+
+def normiere_name(text):
+    """Normiert Gemarkungsnamen für den Vergleich
+
+    Kleinschreibung, Umlaute und ß gefaltet (Rönsahl, Roensahl und Ronsahl
+    ergeben denselben Schlüssel), Akzente entfernt, Satzzeichen zu
+    Leerzeichen. Die Faltung ist verlustbehaftet (Neuenkirchen und
+    Neunkirchen ergeben ebenfalls denselben Schlüssel); für die Auflösung
+    zählt deshalb zuerst der exakte Name (exakter_name).
+    """
+    text = text.lower().translate(UMLAUTE)
+    text = text.replace("ae", "a").replace("oe", "o").replace("ue", "u")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c if c.isalnum() else " " for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+def exakter_name(text):
+    """Gemarkungsname ohne Groß-/Kleinschreibung und überzählige Leerzeichen"""
+    return " ".join(text.casefold().split())
+
+
+class GemarkungTabelle(Mapping):
+    """Kompakte, nach Schlüssel sortierte Gemarkungstabelle eines Bundeslands
+
+    Statt eines verschachtelten Dicts je Eintrag werden nur zwei parallele
+    Listen (Schlüssel, Name) gehalten. Nummer und full_name werden beim
+    Zugriff aus dem Schlüssel abgeleitet. Verhält sich wie das bisherige
+    Dict {schluessel: {"name", "nummer", "full_name"}}.
+    """
+
+    def __init__(self, schluessel, namen):
+        self.schluessel = schluessel
+        self.namen = namen
+        self.indizes = None
+        self.lock = threading.Lock()
+
+    def position(self, schluessel):
+        """Index eines Schlüssels oder -1"""
+        i = bisect.bisect_left(self.schluessel, schluessel)
+        if i < len(self.schluessel) and self.schluessel[i] == schluessel:
+            return i
+        return -1
+
+    def eintrag(self, i):
+        """Eintrag an Position i als Dict"""
+        name = self.namen[i]
+        nummer = self.schluessel[i][2:]
+        return {"name": name, "nummer": nummer, "full_name": f"{name} ({nummer})"}
+
+    def __getitem__(self, schluessel):
+        i = self.position(schluessel)
+        if i < 0:
+            raise KeyError(schluessel)
+        return self.eintrag(i)
+
+    def __contains__(self, schluessel):
+        return self.position(schluessel) >= 0
+
+    def __iter__(self):
+        return iter(self.schluessel)
+
+    def __len__(self):
+        return len(self.schluessel)
+
+    def index(self):
+        """Baut die Suchindizes beim ersten Zugriff auf
+
+        nummer:   Gemarkungsnummer -> Positionen
+        exakt:    exakter Name (exakter_name) -> Positionen
+        name:     normierter Name -> Positionen
+        praefix:  sortierte Liste (Wortanfang, Position) für die Präfixsuche;
+                  enthält den ganzen Namen und jedes Teilwort, damit auch
+                  "Wiblingw" auf "Nachrodt-Wiblingwerde" passt
+        """
+        if self.indizes is not None:
+            return self.indizes
+
+        with self.lock:
+            if self.indizes is None:
+                nummer_index = {}
+                exakt_index = {}
+                name_index = {}
+                praefix = []
+                normiert = []
+                for i, (schluessel, name) in enumerate(zip(self.schluessel, self.namen)):
+                    nummer_index.setdefault(schluessel[2:], []).append(i)
+                    exakt_index.setdefault(exakter_name(name), []).append(i)
+                    norm = normiere_name(name)
+                    normiert.append(norm)
+                    name_index.setdefault(norm, []).append(i)
+                    praefix.append((norm, i))
+                    woerter = norm.split()
+                    for wort in woerter[1:]:
+                        praefix.append((wort, i))
+                praefix.sort()
+                self.indizes = {
+                    "nummer": nummer_index,
+                    "exakt": exakt_index,
+                    "name": name_index,
+                    "praefix": praefix,
+                    "praefix_schluessel": [eintrag[0] for eintrag in praefix],
+                    "normiert": normiert
+                }
+        return self.indizes
+
+    def suche_nummer(self, nummer):
+        """Positionen mit der vierstelligen Gemarkungsnummer"""
+        return list(self.index()["nummer"].get(nummer.strip(), []))
+
+    def suche_exakt(self, name):
+        """Positionen mit exakt passendem Namen (ohne Groß-/Kleinschreibung)"""
+        return list(self.index()["exakt"].get(exakter_name(name), []))
+
+    def suche_name(self, name):
+        """Positionen mit passendem normiertem (gefaltetem) Namen"""
+        return list(self.index()["name"].get(normiere_name(name), []))
+
+    def suche_praefix(self, text, limit=None):
+        """Positionen, deren Name oder ein Teilwort mit text beginnt
+
+        Treffer am Namensanfang stehen vor Treffern auf Teilwörtern.
+        """
+        norm = normiere_name(text)
+        if not norm:
+            return []
+        idx = self.index()
+        anfang = []
+        teilwort = []
+        gesehen = set()
+        start = bisect.bisect_left(idx["praefix_schluessel"], norm)
+        for wort, i in idx["praefix"][start:]:
+            if not wort.startswith(norm):
+                break
+            if i in gesehen:
+                continue
+            gesehen.add(i)
+            (anfang if idx["normiert"][i].startswith(norm) else teilwort).append(i)
+        treffer = sorted(anfang, key=lambda i: (len(self.namen[i]), self.namen[i])) + \
+            sorted(teilwort, key=lambda i: (len(self.namen[i]), self.namen[i]))
+        return treffer[:limit] if limit else treffer
+
+    def suche_unscharf(self, text, limit=10, min_score=0.6):
+        """Tippfehlertolerante Suche; gibt [(score, position), ...] absteigend zurück
+
+        Verglichen wird mit dem ganzen Namen und mit dem gleich langen
+        Namensanfang, damit auch unvollständige Eingaben mit Tippfehler
+        gefunden werden.
+        """
+        norm = normiere_name(text)
+        if not norm:
+            return []
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        matcher.set_seq2(norm)
+        bewertet = []
+        for i, name in enumerate(self.index()["normiert"]):
+            # Präfix-Treffer werden leicht abgewertet
+            kandidaten = [(name, 1.0)]
+            if len(name) > len(norm):
+                kandidaten.append((name[:len(norm)], 0.95))
+            score = 0.0
+            for kandidat, faktor in kandidaten:
+                matcher.set_seq1(kandidat)
+                if matcher.real_quick_ratio() < min_score or matcher.quick_ratio() < min_score:
+                    continue
+                score = max(score, matcher.ratio() * faktor)
+            if score >= min_score:
+                bewertet.append((score, i))
+        bewertet.sort(key=lambda eintrag: (-eintrag[0], len(self.namen[eintrag[1]])))
+        return bewertet[:limit]
+
+    def vorschlaege(self, text, limit=20):
+        """Rangierte Vorschläge (full_name) für die Autovervollständigung"""
+        text = text.strip()
+        if not text:
+            return []
+
+        positionen = []
+        if text.isdigit():
+            positionen += [i for i in range(len(self.schluessel)) if self.schluessel[i][2:].startswith(text)][:limit]
+        positionen += self.suche_exakt(text)
+        positionen += self.suche_name(text)
+        positionen += self.suche_praefix(text, limit)
+        if len(positionen) < limit and not text.isdigit():
+            positionen += [i for _, i in self.suche_unscharf(text, limit)]
+
+        ergebnis = []
+        gesehen = set()
+        for i in positionen:
+            if i not in gesehen:
+                gesehen.add(i)
+                ergebnis.append(self.eintrag(i)["full_name"])
+            if len(ergebnis) >= limit:
+                break
+        return ergebnis
+
+    def finde(self, eingabe):
+        """Löst eine Eingabe eindeutig auf; gibt die Position, -1 oder MEHRDEUTIG zurück
+
+        Reihenfolge: "Name (1234)" aus der Autovervollständigung, Nummer,
+        exakter Name, eindeutiger gefalteter Name (normiere_name), eindeutiger
+        Präfix, eindeutig bester unscharfer Treffer. Passt der gefaltete Name
+        auf mehrere Gemarkungen, wird MEHRDEUTIG zurückgegeben statt einer
+        davon; die Auswahl liefert suche_name.
+        """
+        return self.finde_mit_stufe(eingabe)[0]
+
+    def finde_mit_stufe(self, eingabe):
+        """Wie finde, gibt aber (position, stufe) zurück; stufe ist eine der STUFE_*-Konstanten"""
+        eingabe = eingabe.strip()
+        if not eingabe:
+            return -1, None
+
+        klammer = re.match(r"^(.*?)\s*\((\d{4})\)$", eingabe)
+        if klammer:
+            positionen = self.suche_nummer(klammer.group(2))
+            passend = [i for i in positionen if normiere_name(self.namen[i]) == normiere_name(klammer.group(1))]
+            if passend or positionen:
+                return (passend or positionen)[0], STUFE_KLAMMER
+
+        if eingabe.isdigit() and len(eingabe) == 4:
+            positionen = self.suche_nummer(eingabe)
+            if positionen:
+                return positionen[0], STUFE_NUMMER
+
+        positionen = self.suche_exakt(eingabe)
+        if positionen:
+            return positionen[0], STUFE_NAME
+
+        positionen = self.suche_name(eingabe)
+        if len(positionen) == 1:
+            return positionen[0], STUFE_GEFALTET
+        if positionen:
+            return MEHRDEUTIG, STUFE_GEFALTET
+
+        positionen = self.suche_praefix(eingabe)
+        if len(positionen) == 1:
+            return positionen[0], STUFE_PRAEFIX
+        if positionen:
+            return -1, None
+
+        bewertet = self.suche_unscharf(eingabe, limit=2, min_score=0.85)
+        if len(bewertet) == 1 or (len(bewertet) == 2 and bewertet[0][0] - bewertet[1][0] >= 0.05):
+            return bewertet[0][1], STUFE_UNSCHARF
+        return -1, None
+
+
+class GemarkungKatalog:
+    """Lädt Gemarkungstabellen erst bei der ersten Verwendung
+
+    Gelesen wird die vorkompilierte gemarkungen.sqlite (nur lesend, mit
+    Memory-Mapping). Fehlt sie oder passt sie nicht mehr zur JSON-Datei
+    (Dateigröße), wird die JSON-Datei direkt gelesen.
+    """
+
+    def __init__(self, verzeichnis):
+        self.verzeichnis = verzeichnis
+        self.tabellen = {}
+        self.lock = threading.Lock()
+
+    def tabelle(self, bundesland):
+        """Gibt die Gemarkungstabelle eines Bundeslands zurück (leer, falls unbekannt)"""
+        tabelle = self.tabellen.get(bundesland)
+        if tabelle is not None:
+            return tabelle
+
+        with self.lock:
+            tabelle = self.tabellen.get(bundesland)
+            if tabelle is None:
+                if bundesland not in GEMARKUNG_DATEIEN:
+                    return GemarkungTabelle([], [])
+                tabelle = self.lade_sqlite(bundesland)
+                if tabelle is None:
+                    tabelle = self.lade_json(bundesland)
+                self.tabellen[bundesland] = tabelle
+            return tabelle
+
+    def alle_tabellen(self):
+        """Tabellen aller Bundesländer mit aufgebauten Suchindizes (einmalig)
+
+        Bildet zusammen den länderübergreifenden Index für kandidaten und
+        vorschlaege; jede Tabelle wird nur beim ersten Aufruf geladen.
+        """
+        tabellen = {bundesland: self.tabelle(bundesland) for bundesland in GEMARKUNG_DATEIEN}
+        for tabelle in tabellen.values():
+            tabelle.index()
+        return tabellen
+
+    def kandidaten(self, eingabe):
+        """Löst eine Gemarkung in allen Bundesländern zugleich auf
+
+        Gibt [(bundesland, schluessel, full_name), ...] zurück. Verglichen
+        wird wie bei GemarkungTabelle.finde; es bleiben nur die Treffer der
+        besten Stufe, damit z.B. ein exakter Name in einem Land nicht mit
+        einem bloßen Präfix in einem anderen konkurriert. Angenommen werden
+        auch der sechsstellige Gemarkungsschlüssel und Vorschläge aus
+        vorschlaege ("Name (1234) – Bundesland"). Ist der gefaltete Name in
+        einem Land mehrdeutig, stehen alle passenden Gemarkungen des Lands in
+        der Liste; der Aufrufer muss dann nachfragen.
+        """
+        eingabe = eingabe.strip()
+        if not eingabe:
+            return []
+
+        tabellen = self.alle_tabellen()
+        zusatz = re.match(r"^(.*?)\s+[–-]\s+(\S.*)$", eingabe)
+        if zusatz and zusatz.group(2) in tabellen:
+            eingabe = zusatz.group(1)
+            tabellen = {zusatz.group(2): tabellen[zusatz.group(2)]}
+
+        if eingabe.isdigit() and len(eingabe) == 6:
+            return [(bundesland, eingabe, tabelle[eingabe]["full_name"])
+                    for bundesland, tabelle in tabellen.items() if eingabe in tabelle]
+
+        treffer = []
+        for bundesland, tabelle in tabellen.items():
+            position, stufe = tabelle.finde_mit_stufe(eingabe)
+            positionen = tabelle.suche_name(eingabe) if position == MEHRDEUTIG else [position]
+            treffer += [(stufe, bundesland, tabelle.schluessel[i], tabelle.eintrag(i)["full_name"])
+                        for i in positionen if i >= 0]
+        if not treffer:
+            return []
+        beste = min(eintrag[0] for eintrag in treffer)
+        return [eintrag[1:] for eintrag in treffer if eintrag[0] == beste]
+
+    def vorschlaege(self, text, limit=20):
+        """Vorschläge aus allen Bundesländern ("Name (1234) – Bundesland")
+
+        Die Listen der Länder werden abwechselnd zusammengeführt, sodass
+        der beste Treffer jedes Lands vorn steht.
+        """
+        listen = [[f"{vorschlag} – {bundesland}" for vorschlag in tabelle.vorschlaege(text, limit)]
+                  for bundesland, tabelle in self.alle_tabellen().items()]
+        ergebnis = []
+        for rang in range(limit):
+            for liste in listen:
+                if rang < len(liste):
+                    ergebnis.append(liste[rang])
+        return ergebnis[:limit]
+
+    def sqlite_path(self):
+        return os.path.join(self.verzeichnis, SQLITE_DATEI)
+
+    def lade_sqlite(self, bundesland):
+        """Liest eine Tabelle aus gemarkungen.sqlite; None, wenn nicht nutzbar"""
+        db_path = self.sqlite_path()
+        if not os.path.exists(db_path):
+            return None
+
+        dateiname = GEMARKUNG_DATEIEN[bundesland]
+        json_path = os.path.join(self.verzeichnis, dateiname)
+        try:
+            con = sqlite3.connect(f"file:{urllib.parse.quote(db_path)}?mode=ro", uri=True)
+            try:
+                con.execute("PRAGMA mmap_size=4194304")
+                meta = dict(con.execute("SELECT schluessel, wert FROM meta"))
+                if meta.get("format") != FORMAT_VERSION:
+                    return None
+                if os.path.exists(json_path) and meta.get(f"groesse:{dateiname}") != str(os.path.getsize(json_path)):
+                    QgsMessageLog.logMessage(
+                        f"{SQLITE_DATEI} ist veraltet für {dateiname}, lese JSON",
+                        "Flurstück-Suche",
+                        Qgis.Warning
+                    )
+                    return None
+
+                rows = con.execute("SELECT schluessel, name FROM gemarkungen WHERE bundesland = ? ORDER BY schluessel",
+                                   (bundesland,)).fetchall()
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            QgsMessageLog.logMessage(f"Fehler beim Lesen von {SQLITE_DATEI}: {str(e)}", "Flurstück-Suche", Qgis.Warning)
+            return None
+
+        if not rows:
+            return None
+
+        QgsMessageLog.logMessage(f"Gemarkungen geladen: {bundesland} ({len(rows)} Einträge)", "Flurstück-Suche")
+        return GemarkungTabelle([row[0] for row in rows], [row[1] for row in rows])
+
+    def lade_json(self, bundesland):
+        """Lädt Gemarkungen aus JSON-Datei"""
+        filename = GEMARKUNG_DATEIEN[bundesland]
+        try:
+            json_path = os.path.join(self.verzeichnis, filename)
+
+            if not os.path.exists(json_path):
+                QgsMessageLog.logMessage(
+                    f"Warnung: {filename} nicht gefunden",
+                    "Flurstück-Suche",
+                    Qgis.Warning
+                )
+                return GemarkungTabelle([], [])
+
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            schluessel = sorted(data)
+            QgsMessageLog.logMessage(
+                f"Gemarkungen geladen: {filename} ({len(data)} Einträge)",
+                "Flurstück-Suche"
+            )
+            return GemarkungTabelle(schluessel, [data[s]["name"] for s in schluessel])
+
+        except Exception as e:
+            QgsMessageLog.logMessage(
+                f"Fehler beim Laden von {filename}: {str(e)}",
+                "Flurstück-Suche",
+                Qgis.Critical
+            )
+            return GemarkungTabelle([], [])
+
+    def verwerfe(self, bundeslaender=None):
+        """Verwirft geladene Tabellen, damit sie neu gelesen werden"""
+        with self.lock:
+            for bundesland in (bundeslaender or list(self.tabellen)):
+                self.tabellen.pop(bundesland, None)
+
+    def aktualisiere(self, dumps=None, fortschritt=None, abgebrochen=None):
+        """Gleicht die Gemarkungsdateien mit den WFS der Länder ab
+
+        Nur geänderte Länder werden neu geschrieben und kompiliert (siehe
+        gemarkungen_aktualisieren); ihre Tabellen werden verworfen und beim
+        nächsten Zugriff neu geladen. Gibt den Bericht je Bundesland zurück.
+        """
+        berichte = aktualisiere(self.verzeichnis, dumps=dumps, fortschritt=fortschritt, abgebrochen=abgebrochen)
+        geaendert = [bundesland for bundesland, bericht in berichte.items() if bericht["status"] == "aktualisiert"]
+        if geaendert:
+            self.verwerfe(geaendert)
+
+        for bundesland, bericht in berichte.items():
+            QgsMessageLog.logMessage(
+                f"Gemarkungen {bundesland}: {bericht['status']} {bericht['meldung']}".rstrip(),
+                "Flurstück-Suche",
+                Qgis.Warning if bericht["status"] == "fehler" else Qgis.Info
+            )
+        return berichte
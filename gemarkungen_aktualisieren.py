@@ -0,0 +1,410 @@
+"""Aktualisiert die Gemarkungs-JSON-Dateien aus den WFS der Länder
+
+Je Bundesland wird die Gemarkungsliste beim WFS (oder aus einer lokalen
+Dump-Datei) geholt und mit dem vorhandenen Katalog verglichen. Nur Länder,
+deren Inhalt sich geändert hat, werden neu geschrieben; danach wird
+gemarkungen.sqlite für diese Länder neu kompiliert:
+
+    python gemarkungen_aktualisieren.py [verzeichnis] [--land NAME] [--dump NAME=DATEI] [--erzwingen]
+
+Unveränderte Daten werden nicht erneut übertragen: ETag und Last-Modified
+der letzten Abfrage liegen in der meta-Tabelle von gemarkungen.sqlite und
+werden als bedingte Anfrage mitgeschickt (304 = unverändert). Server ohne
+Validatoren liefern die Liste zwar erneut, geschrieben wird aber nur, wenn
+sich der Inhalt vom bisherigen Katalog unterscheidet. Die
+Validatoren gehören zu den Daten, die sie beschreiben, und werden daher
+zusammen mit gemarkungen.sqlite ausgeliefert.
+
+Dieses Modul verwendet nur die Standardbibliothek und läuft auch ohne QGIS.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+
+try:
+    from .gemarkungen_kompilieren import GEMARKUNG_DATEIEN, SQLITE_DATEI, datei_hash, kompiliere
+except ImportError:
+    from gemarkungen_kompilieren import GEMARKUNG_DATEIEN, SQLITE_DATEI, datei_hash, kompiliere
+
+# Bundesland -> Gemarkungsquelle im WFS (ALKIS vereinfacht, Objektart
+# KatasterBezirk ohne Geometrie). None: nur über eine Dump-Datei, da der
+# Dienst keine Gemarkungsschlüssel liefert (Rheinland-Pfalz).
+GEMARKUNG_QUELLEN = {
+    "Nordrhein-Westfalen": {
+        "url": "https://www.wfs.nrw.de/geobasis/wfs_nw_alkis_vereinfacht",
+        "version": "1.1.0",
+        "typename": "TYPENAME",
+    },
+    "Niedersachsen": {
+        "url": "https://opendata.lgln.niedersachsen.de/doorman/noauth/alkis_wfs_einfach",
+        "version": "1.1.0",
+        "typename": "typename",
+    },
+    "Hessen": {
+        "url": "https://www.gds.hessen.de/wfs2/aaa-suite/cgi-bin/alkis/vereinf/wfs",
+        "version": "2.0.0",
+        "typename": "TYPENAMES",
+    },
+    "Rheinland-Pfalz": None,
+}
+
+AVE_NAMESPACE = "http://repository.gdi-de.org/schemas/adv/produkt/alkis-vereinfacht/2.0"
+OBJEKTART = "KatasterBezirk"
+SCHLUESSEL_FELD = "gemaschl"
+NAME_FELD = "gemarkung"
+
+# Spaltennamen, unter denen Dump-Dateien (CSV) Schlüssel und Namen führen
+SCHLUESSEL_SPALTEN = ("schluessel", "gemaschl", "gemarkungsschluessel")
+NAME_SPALTEN = ("name", "gemarkung", "gemarkungsname")
+
+SEITEN_GROESSE = 10000
+TIMEOUT = 60
+
+# Schrumpft eine Liste unter diesen Anteil, wird sie ohne --erzwingen nicht
+# übernommen (z.B. ein Dienst, der wegen einer Störung zu wenig liefert)
+MIN_ANTEIL = 0.5
+
+
+def lokaler_name(tag):
+    """Elementname ohne Namensraum"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def normiere_eintraege(paare):
+    """{schluessel: name} aus (schluessel, name)-Paaren; ungültige Schlüssel entfallen"""
+    eintraege = {}
+    for schluessel, name in paare:
+        schluessel = (schluessel or "").strip()
+        name = " ".join((name or "").split())
+        if len(schluessel) == 6 and schluessel.isdigit() and name:
+            eintraege[schluessel] = name
+    return eintraege
+
+
+def lese_objekte(quelle):
+    """(schluessel, name) je Objekt einer GetFeature-Antwort (Datei oder Datei-Objekt)"""
+    paare = []
+    werte = {}
+    for _, element in ET.iterparse(quelle, events=("end",)):
+        name = lokaler_name(element.tag)
+        if name in (SCHLUESSEL_FELD, NAME_FELD):
+            werte[name] = element.text
+        elif name == OBJEKTART:
+            paare.append((werte.get(SCHLUESSEL_FELD), werte.get(NAME_FELD)))
+            werte = {}
+            element.clear()
+    return paare
+
+
+def lese_gml(quelle):
+    """Gemarkungen aus einer GetFeature-Antwort
+
+    Jede Flur ist ein eigenes Objekt; mehrfach vorkommende Gemarkungen
+    werden zusammengefasst.
+    """
+    return normiere_eintraege(lese_objekte(quelle))
+
+
+def lese_dump(pfad):
+    """Gemarkungen aus einer lokalen Datei
+
+    Unterstützt werden das Katalogformat (JSON), CSV mit Kopfzeile (Komma
+    oder Semikolon) und gespeicherte GetFeature-Antworten (XML/GML).
+    """
+    endung = os.path.splitext(pfad)[1].lower()
+    if endung == ".json":
+        with open(pfad, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return normiere_eintraege((schluessel, eintrag["name"] if isinstance(eintrag, dict) else eintrag)
+                                  for schluessel, eintrag in data.items())
+    if endung == ".csv":
+        with open(pfad, "r", encoding="utf-8-sig", newline="") as f:
+            dialekt = csv.Sniffer().sniff(f.read(4096), delimiters=",;")
+            f.seek(0)
+            reader = csv.DictReader(f, dialect=dialekt)
+            spalten = {spalte.strip().lower(): spalte for spalte in reader.fieldnames or []}
+            schluessel_spalte = next((spalten[s] for s in SCHLUESSEL_SPALTEN if s in spalten), None)
+            name_spalte = next((spalten[s] for s in NAME_SPALTEN if s in spalten), None)
+            if schluessel_spalte is None or name_spalte is None:
+                raise ValueError(f"{os.path.basename(pfad)}: Spalten für Schlüssel und Name fehlen")
+            return normiere_eintraege((zeile[schluessel_spalte], zeile[name_spalte]) for zeile in reader)
+    return lese_gml(pfad)
+
+
+def katalog_json(eintraege):
+    """Inhalt einer Gemarkungs-JSON-Datei im Format des Katalogs (deterministisch)"""
+    data = {}
+    for schluessel in sorted(eintraege):
+        name = eintraege[schluessel]
+        data[schluessel] = {"name": name, "nummer": schluessel[2:], "full_name": f"{name} ({schluessel[2:]})"}
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def lese_katalog(pfad):
+    """Bisheriger Inhalt einer JSON-Datei als {schluessel: name} (leer, wenn nicht vorhanden)"""
+    if not os.path.exists(pfad):
+        return {}
+    with open(pfad, "r", encoding="utf-8") as f:
+        return {schluessel: eintrag["name"] for schluessel, eintrag in json.load(f).items()}
+
+
+def vergleiche(alt, neu):
+    """Anzahl neuer, entfallener und umbenannter Gemarkungen"""
+    return {
+        "neu": len(neu.keys() - alt.keys()),
+        "entfallen": len(alt.keys() - neu.keys()),
+        "umbenannt": sum(1 for schluessel in alt.keys() & neu.keys() if alt[schluessel] != neu[schluessel]),
+    }
+
+
+def schreibe_atomar(pfad, inhalt):
+    """Schreibt eine Datei über eine temporäre Datei, damit Leser nie eine halbe Datei sehen"""
+    fd, temp_pfad = tempfile.mkstemp(dir=os.path.dirname(pfad), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(inhalt)
+        os.replace(temp_pfad, pfad)
+    except BaseException:
+        if os.path.exists(temp_pfad):
+            os.remove(temp_pfad)
+        raise
+
+
+def lese_meta(db_path):
+    """meta-Tabelle von gemarkungen.sqlite als Dict (leer, wenn nicht vorhanden)"""
+    if not os.path.exists(db_path):
+        return {}
+    con = sqlite3.connect(db_path)
+    try:
+        return dict(con.execute("SELECT schluessel, wert FROM meta"))
+    except sqlite3.Error:
+        return {}
+    finally:
+        con.close()
+
+
+def schreibe_meta(db_path, werte):
+    """Ergänzt bzw. ersetzt Einträge der meta-Tabelle"""
+    con = sqlite3.connect(db_path)
+    try:
+        con.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", werte.items())
+        con.commit()
+    finally:
+        con.close()
+
+
+def erstelle_url(quelle, start):
+    """GetFeature-URL für eine Seite der Gemarkungsliste (nur Schlüssel und Name)"""
+    version = quelle["version"]
+    parameter = {
+        "SERVICE": "WFS",
+        "VERSION": version,
+        "REQUEST": "GetFeature",
+        quelle["typename"]: f"ave:{OBJEKTART}",
+        "PROPERTYNAME": f"ave:{SCHLUESSEL_FELD},ave:{NAME_FELD}",
+        "COUNT" if version.startswith("2") else "MAXFEATURES": str(SEITEN_GROESSE),
+        "STARTINDEX": str(start),
+    }
+    if version.startswith("2"):
+        parameter["NAMESPACES"] = f"xmlns(ave,{AVE_NAMESPACE})"
+    else:
+        parameter["NAMESPACE"] = f"xmlns(ave={AVE_NAMESPACE})"
+    return f"{quelle['url']}?{urllib.parse.urlencode(parameter)}"
+
+
+def hole_seite(url, validator=None):
+    """Ruft eine Seite ab; gibt (inhalt, validator) zurück, inhalt None bei 304
+
+    validator ist [etag, last_modified] der letzten Abfrage derselben Seite.
+    """
+    headers = {"Accept-Encoding": "gzip", "User-Agent": "ALKIS-Suchmodul Gemarkungsaktualisierung"}
+    if validator and validator[0]:
+        headers["If-None-Match"] = validator[0]
+    if validator and validator[1]:
+        headers["If-Modified-Since"] = validator[1]
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=TIMEOUT) as response:
+            inhalt = response.read()
+            if response.headers.get("Content-Encoding") == "gzip":
+                inhalt = gzip.decompress(inhalt)
+            return inhalt, [response.headers.get("ETag", ""), response.headers.get("Last-Modified", "")]
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, validator
+        raise
+
+
+def lade_wfs(quelle, validatoren, abgebrochen=None):
+    """Lädt die Gemarkungsliste seitenweise
+
+    Gibt (eintraege, validatoren) zurück; eintraege ist None, wenn alle
+    bekannten Seiten mit 304 beantwortet wurden. Hat sich nur eine Seite
+    geändert, werden die übrigen ohne Bedingung nachgeladen, da ihr
+    Inhalt für die neue Liste gebraucht wird.
+    """
+    seiten = []
+    neue_validatoren = []
+    start = 0
+    while True:
+        if abgebrochen and abgebrochen():
+            raise InterruptedError("Aktualisierung abgebrochen")
+        nummer = len(seiten)
+        validator = validatoren[nummer] if nummer < len(validatoren) else None
+        inhalt, validator = hole_seite(erstelle_url(quelle, start), validator)
+        neue_validatoren.append(validator)
+        if inhalt is None:
+            seiten.append(None)
+            # Unveränderte Seiten waren voll, außer der letzten bekannten
+            if nummer == len(validatoren) - 1:
+                break
+        else:
+            paare = lese_objekte(io.BytesIO(inhalt))
+            seiten.append(paare)
+            if len(paare) < SEITEN_GROESSE:
+                break
+        start += SEITEN_GROESSE
+
+    if all(paare is None for paare in seiten):
+        return None, neue_validatoren
+
+    for nummer, paare in enumerate(seiten):
+        if paare is None:
+            inhalt, neue_validatoren[nummer] = hole_seite(erstelle_url(quelle, nummer * SEITEN_GROESSE))
+            seiten[nummer] = lese_objekte(io.BytesIO(inhalt))
+    return normiere_eintraege(paar for paare in seiten for paar in paare), neue_validatoren
+
+
+def aktualisiere_land(verzeichnis, bundesland, meta, dump=None, erzwingen=False, abgebrochen=None):
+    """Aktualisiert die JSON-Datei eines Bundeslands
+
+    Gibt (bericht, meta_wert) zurück; bericht["status"] ist "unveraendert",
+    "aktualisiert", "uebersprungen" oder "fehler". meta_wert enthält die
+    Validatoren bzw. den Stand der Dump-Datei für die nächste Abfrage.
+    """
+    dateiname = GEMARKUNG_DATEIEN[bundesland]
+    json_path = os.path.join(verzeichnis, dateiname)
+    stand = json.loads(meta.get(f"quelle:{dateiname}", "{}"))
+    katalog_aktuell = os.path.exists(json_path) and meta.get(f"sha256:{dateiname}") == datei_hash(json_path)
+
+    if dump:
+        dump_stand = [os.path.abspath(dump), os.path.getsize(dump), os.stat(dump).st_mtime_ns]
+        if stand.get("dump") == dump_stand and katalog_aktuell and not erzwingen:
+            return {"status": "unveraendert", "meldung": "Dump-Datei unverändert"}, stand
+        eintraege = lese_dump(dump)
+        neuer_stand = {"dump": dump_stand}
+    else:
+        quelle = GEMARKUNG_QUELLEN.get(bundesland)
+        if quelle is None:
+            return {"status": "uebersprungen", "meldung": "keine WFS-Quelle, nur per Dump-Datei"}, stand
+        validatoren = [] if erzwingen or not katalog_aktuell else stand.get("validatoren", [])
+        eintraege, validatoren = lade_wfs(quelle, validatoren, abgebrochen)
+        neuer_stand = {"validatoren": validatoren}
+        if eintraege is None:
+            return {"status": "unveraendert", "meldung": "vom Server als unverändert gemeldet (304)"}, neuer_stand
+
+    alt = lese_katalog(json_path)
+    if not eintraege:
+        return {"status": "fehler", "meldung": "Quelle lieferte keine Gemarkungen"}, stand
+    if len(eintraege) < MIN_ANTEIL * len(alt) and not erzwingen:
+        return {"status": "fehler", "meldung": f"nur {len(eintraege)} statt bisher {len(alt)} Gemarkungen "
+                                               f"(mit --erzwingen übernehmen)"}, stand
+
+    bericht = dict(vergleiche(alt, eintraege), anzahl=len(eintraege))
+    if eintraege == alt:
+        return dict(bericht, status="unveraendert", meldung="Inhalt unverändert"), neuer_stand
+    schreibe_atomar(json_path, katalog_json(eintraege))
+    return dict(bericht, status="aktualisiert",
+                meldung=f"{bericht['neu']} neu, {bericht['entfallen']} entfallen, "
+                        f"{bericht['umbenannt']} umbenannt"), neuer_stand
+
+
+def aktualisiere(verzeichnis, bundeslaender=None, dumps=None, erzwingen=False, fortschritt=None,
+                 abgebrochen=None):
+    """Aktualisiert die Gemarkungsdateien und kompiliert geänderte Länder neu
+
+    dumps ordnet Bundesländern eine lokale Datei zu, die statt des WFS
+    gelesen wird. Neu kompiliert werden die geänderten Länder sowie
+    solche, deren Eintrag in gemarkungen.sqlite nicht zur JSON-Datei passt.
+    Gibt den Bericht je Bundesland zurück.
+    """
+    bundeslaender = bundeslaender or list(GEMARKUNG_DATEIEN)
+    dumps = dumps or {}
+    db_path = os.path.join(verzeichnis, SQLITE_DATEI)
+    meta = lese_meta(db_path)
+
+    berichte = {}
+    staende = {}
+    for i, bundesland in enumerate(bundeslaender):
+        if abgebrochen and abgebrochen():
+            break
+        try:
+            berichte[bundesland], staende[bundesland] = aktualisiere_land(
+                verzeichnis, bundesland, meta, dumps.get(bundesland), erzwingen, abgebrochen)
+        except InterruptedError:
+            break
+        except (OSError, ValueError, ET.ParseError, urllib.error.URLError) as e:
+            berichte[bundesland] = {"status": "fehler", "meldung": str(e)}
+        if fortschritt:
+            fortschritt(100 * (i + 1) / len(bundeslaender))
+
+    # Geänderte Länder und solche mit veraltetem Index neu kompilieren
+    neu_kompilieren = []
+    for bundesland, dateiname in GEMARKUNG_DATEIEN.items():
+        json_path = os.path.join(verzeichnis, dateiname)
+        if os.path.exists(json_path) and meta.get(f"sha256:{dateiname}") != datei_hash(json_path):
+            neu_kompilieren.append(bundesland)
+    if neu_kompilieren:
+        kompiliere(verzeichnis, bundeslaender=neu_kompilieren)
+        for bundesland in neu_kompilieren:
+            berichte.setdefault(bundesland, {"status": "unveraendert", "meldung": ""})["kompiliert"] = True
+
+    # Validatoren erst nach erfolgreichem Schreiben sichern, sonst verdeckt
+    # ein späteres 304 eine nicht übernommene Änderung
+    werte = {f"quelle:{GEMARKUNG_DATEIEN[bundesland]}": json.dumps(stand)
+             for bundesland, stand in staende.items() if berichte[bundesland]["status"] != "fehler"}
+    if werte and os.path.exists(db_path):
+        schreibe_meta(db_path, werte)
+    return berichte
+
+
+def lese_argumente(argumente):
+    """Kommandozeile -> (verzeichnis, bundeslaender, dumps, erzwingen)"""
+    verzeichnis = os.path.dirname(os.path.abspath(__file__))
+    bundeslaender = []
+    dumps = {}
+    erzwingen = False
+    argumente = list(argumente)
+    while argumente:
+        argument = argumente.pop(0)
+        if argument == "--land":
+            bundeslaender.append(argumente.pop(0))
+        elif argument == "--dump":
+            bundesland, _, pfad = argumente.pop(0).partition("=")
+            dumps[bundesland] = pfad
+            if bundesland not in bundeslaender:
+                bundeslaender.append(bundesland)
+        elif argument == "--erzwingen":
+            erzwingen = True
+        else:
+            verzeichnis = argument
+    for bundesland in bundeslaender:
+        if bundesland not in GEMARKUNG_DATEIEN:
+            raise SystemExit(f"Unbekanntes Bundesland: {bundesland} ({', '.join(GEMARKUNG_DATEIEN)})")
+    return verzeichnis, bundeslaender, dumps, erzwingen
+
+
+if __name__ == "__main__":
+    verzeichnis, bundeslaender, dumps, erzwingen = lese_argumente(sys.argv[1:])
+    for bundesland, bericht in aktualisiere(verzeichnis, bundeslaender, dumps, erzwingen).items():
+        zusatz = " (neu kompiliert)" if bericht.get("kompiliert") else ""
+        print(f"{bundesland}: {bericht['status']} {bericht['meldung']}{zusatz}".rstrip())
@@ -0,0 +1,84 @@
+"""Kompiliert die Gemarkungs-JSON-Dateien in die kompakte SQLite-Datei
+
+Die JSON-Dateien bleiben das Quellformat. Das Plugin liest zur Laufzeit
+gemarkungen.sqlite; nach jeder Änderung an einer JSON-Datei muss die
+Datei neu erzeugt werden:
+
+    python gemarkungen_kompilieren.py
+
+Dieses Modul verwendet nur die Standardbibliothek und läuft auch ohne QGIS.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+# Bundesland -> Quelldatei
+GEMARKUNG_DATEIEN = {
+    "Nordrhein-Westfalen": "gemarkungen_nrw.json",
+    "Niedersachsen": "gemarkungen_nieder.json",
+    "Hessen": "gemarkungen_hessen.json",
+    "Rheinland-Pfalz": "gemarkungen_rlp.json"
+}
+
+SQLITE_DATEI = "gemarkungen.sqlite"
+FORMAT_VERSION = "1"
+
+
+def datei_hash(pfad):
+    """SHA-256 einer Datei"""
+    sha = hashlib.sha256()
+    with open(pfad, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def kompiliere(verzeichnis, ziel=None, bundeslaender=None):
+    """Erzeugt bzw. aktualisiert gemarkungen.sqlite aus den JSON-Dateien
+
+    Mit bundeslaender werden nur diese Länder neu geschrieben; die übrigen
+    bleiben unverändert. Gibt die Anzahl der Einträge je Bundesland zurück.
+    """
+    ziel = ziel or os.path.join(verzeichnis, SQLITE_DATEI)
+    bundeslaender = bundeslaender or list(GEMARKUNG_DATEIEN)
+
+    con = sqlite3.connect(ziel)
+    try:
+        con.execute("CREATE TABLE IF NOT EXISTS meta (schluessel TEXT PRIMARY KEY, wert TEXT) WITHOUT ROWID")
+        con.execute("""CREATE TABLE IF NOT EXISTS gemarkungen (
+                           bundesland TEXT NOT NULL,
+                           schluessel TEXT NOT NULL,
+                           name TEXT NOT NULL,
+                           PRIMARY KEY (bundesland, schluessel)) WITHOUT ROWID""")
+
+        anzahl = {}
+        for bundesland in bundeslaender:
+            dateiname = GEMARKUNG_DATEIEN[bundesland]
+            json_path = os.path.join(verzeichnis, dateiname)
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            con.execute("DELETE FROM gemarkungen WHERE bundesland = ?", (bundesland,))
+            con.executemany("INSERT INTO gemarkungen VALUES (?, ?, ?)",
+                            ((bundesland, schluessel, eintrag["name"]) for schluessel, eintrag in data.items()))
+            con.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                (f"groesse:{dateiname}", str(os.path.getsize(json_path))),
+                (f"sha256:{dateiname}", datei_hash(json_path)),
+            ])
+            anzahl[bundesland] = len(data)
+
+        con.execute("INSERT OR REPLACE INTO meta VALUES ('format', ?)", (FORMAT_VERSION,))
+        con.commit()
+        con.execute("VACUUM")
+    finally:
+        con.close()
+
+    return anzahl
+
+
+if __name__ == "__main__":
+    verzeichnis = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    for bundesland, n in kompiliere(verzeichnis).items():
+        print(f"{bundesland}: {n} Gemarkungen")
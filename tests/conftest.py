@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Plugin-Verzeichnis für "from benchmark import lade_plugin_modul"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,105 @@
+"""Auflösung von Gemarkungsnamen (gemarkung_katalog)
+
+Die Paare stammen aus dem ausgelieferten NRW-Katalog; sie ergeben nach
+normiere_name denselben Schlüssel und dürfen sich trotzdem nicht
+gegenseitig verdrängen.
+"""
+import pytest
+
+pytest.importorskip("qgis.core")
+
+from benchmark import PLUGIN_DIR, lade_plugin_modul  # noqa: E402
+
+katalog = lade_plugin_modul("gemarkung_katalog")
+
+NRW = {
+    "051008": "Rönsahl",
+    "051203": "Udorf",
+    "051278": "Horstmar",
+    "051573": "Burbach",
+    "051578": "Neunkirchen",
+    "051674": "Bürbach",
+    "051751": "Lohne",
+    "052094": "Hörstmar",
+    "052534": "Neuenkirchen",
+    "052633": "Löhne",
+    "054159": "Uedorf",
+    "055195": "Horstmar",
+    "055206": "Neuenkirchen",
+}
+
+
+@pytest.fixture
+def tabelle():
+    schluessel = sorted(NRW)
+    return katalog.GemarkungTabelle(schluessel, [NRW[s] for s in schluessel])
+
+
+def schluessel_von(tabelle, eingabe):
+    position, stufe = tabelle.finde_mit_stufe(eingabe)
+    return (tabelle.schluessel[position] if position >= 0 else position), stufe
+
+
+def test_normiere_name_faltet_umlaute():
+    assert katalog.normiere_name("Rönsahl") == katalog.normiere_name("Roensahl") == "ronsahl"
+    assert katalog.normiere_name("Ronsahl") == "ronsahl"
+    assert katalog.normiere_name("Straße") == "strasse"
+
+
+def test_normiere_name_satzzeichen_und_leerzeichen():
+    assert katalog.normiere_name("Nachrodt-Wiblingwerde") == "nachrodt wiblingwerde"
+    assert katalog.normiere_name("  St.  Tönis ") == "st tonis"
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Neuenkirchen", "Neunkirchen"),
+    ("Löhne", "Lohne"),
+    ("Uedorf", "Udorf"),
+    ("Bürbach", "Burbach"),
+    ("Hörstmar", "Horstmar"),
+])
+def test_normiere_name_ist_verlustbehaftet(a, b):
+    assert katalog.normiere_name(a) == katalog.normiere_name(b)
+    assert katalog.exakter_name(a) != katalog.exakter_name(b)
+
+
+@pytest.mark.parametrize("eingabe, erwartet", [
+    ("Neuenkirchen", "052534"),
+    ("neuenkirchen", "052534"),
+    ("Neunkirchen", "051578"),
+    ("Löhne", "052633"),
+    ("LÖHNE", "052633"),
+    ("Lohne", "051751"),
+    ("Uedorf", "054159"),
+    ("Udorf", "051203"),
+    ("Bürbach", "051674"),
+    ("Burbach", "051573"),
+    ("Hörstmar", "052094"),
+    ("Horstmar", "051278"),
+])
+def test_exakter_name_geht_vor(tabelle, eingabe, erwartet):
+    assert schluessel_von(tabelle, eingabe) == (erwartet, katalog.STUFE_NAME)
+
+
+def test_eindeutig_gefalteter_name(tabelle):
+    assert schluessel_von(tabelle, "Roensahl") == ("051008", katalog.STUFE_GEFALTET)
+    assert schluessel_von(tabelle, "Ronsahl") == ("051008", katalog.STUFE_GEFALTET)
+
+
+@pytest.mark.parametrize("eingabe", ["Loehne", "Hoerstmar", "Buerbach", "Neuenkirchén"])
+def test_mehrdeutig_gefalteter_name(tabelle, eingabe):
+    assert tabelle.finde_mit_stufe(eingabe) == (katalog.MEHRDEUTIG, katalog.STUFE_GEFALTET)
+    assert len(tabelle.suche_name(eingabe)) > 1
+
+
+def test_klammer_und_nummer(tabelle):
+    assert schluessel_von(tabelle, "Horstmar (5195)") == ("055195", katalog.STUFE_KLAMMER)
+    assert schluessel_von(tabelle, "2633") == ("052633", katalog.STUFE_NUMMER)
+
+
+def test_kandidaten_im_ausgelieferten_katalog():
+    gemarkungen = katalog.GemarkungKatalog(PLUGIN_DIR)
+    namen = [full_name for _, _, full_name in gemarkungen.kandidaten("Neuenkirchen")]
+    assert namen
+    assert all(name.startswith("Neuenkirchen (") for name in namen)
+    assert all(name.startswith("Löhne (") for _, _, name in gemarkungen.kandidaten("Löhne"))
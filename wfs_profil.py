@@ -0,0 +1,269 @@
+from qgis.core import QgsApplication, QgsMessageLog, Qgis
+from qgis.PyQt.QtCore import QSettings
+from .wfs_stream import lokaler_name
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+# Ausgabeformate, die der WfsStreamDecoder direkt liest, je WFS-Version
+# nach Aufwand geordnet (GeoJSON nur bei 2.0, da nur dort SRSNAME gesendet wird,
+# siehe FlurstueckKern.sende_srsname)
+STREAM_FORMATE = {
+    "2": (("json",), ("gml", "3.2"), ("gml", "3.1")),
+    "1": (("gml", "3.1"), ("gml",)),
+}
+SHAPE_FORMATE = ("application/x-zip-shapefile", "shape-zip", "shapezip")
+
+# Obergrenze für die Seitengröße, auch wenn der Server mehr erlaubt
+MAX_SEITEN_GROESSE = 5000
+
+
+def lese_capabilities(inhalt):
+    """Liest die für GetFeature relevanten Fähigkeiten aus einem Capabilities-Dokument"""
+    wurzel = ET.fromstring(inhalt)
+    if lokaler_name(wurzel.tag) == "ExceptionReport":
+        texte = [e.text.strip() for e in wurzel.iter() if lokaler_name(e.tag) == "ExceptionText" and e.text]
+        raise ValueError(texte[0] if texte else "ExceptionReport")
+    if not lokaler_name(wurzel.tag).endswith("Capabilities"):
+        raise ValueError(f"Kein Capabilities-Dokument ({lokaler_name(wurzel.tag)})")
+
+    profil = {"version": wurzel.get("version"), "formate": [], "post": False, "paging": None,
+              "max_anzahl": None, "typename": None}
+
+    for operation in wurzel.iter():
+        if lokaler_name(operation.tag) != "Operation" or operation.get("name") != "GetFeature":
+            continue
+        for elem in operation.iter():
+            name = lokaler_name(elem.tag)
+            if name == "Post":
+                profil["post"] = True
+            elif name == "Parameter" and elem.get("name", "").lower() == "outputformat":
+                profil["formate"].extend(wert.text.strip() for wert in elem.iter()
+                                         if lokaler_name(wert.tag) == "Value" and wert.text)
+
+    for constraint in wurzel.iter():
+        if lokaler_name(constraint.tag) != "Constraint":
+            continue
+        werte = [e.text.strip() for e in constraint.iter()
+                 if lokaler_name(e.tag) in ("DefaultValue", "Value") and e.text]
+        if not werte:
+            continue
+        if constraint.get("name") == "ImplementsResultPaging":
+            profil["paging"] = werte[0].upper() == "TRUE"
+        elif constraint.get("name") == "CountDefault" and werte[0].isdigit():
+            profil["max_anzahl"] = int(werte[0])
+
+    for feature_type in wurzel.iter():
+        if lokaler_name(feature_type.tag) != "FeatureType":
+            continue
+        namen = [e.text.strip() for e in feature_type if lokaler_name(e.tag) == "Name" and e.text]
+        if namen and namen[0].split(":")[-1] == "Flurstueck":
+            profil["typename"] = namen[0]
+            # WFS 1.1 nennt die Formate zusätzlich je FeatureType
+            profil["formate"].extend(e.text.strip() for e in feature_type.iter()
+                                     if lokaler_name(e.tag) == "Format" and e.text)
+
+    profil["formate"] = list(dict.fromkeys(profil["formate"]))
+    return profil
+
+
+def lese_feature_typ(inhalt):
+    """Eigenschaften, ihre XSD-Typen und Geometrie-Eigenschaft aus DescribeFeatureType (XSD)"""
+    wurzel = ET.fromstring(inhalt)
+    eigenschaften = []
+    typen = {}
+    geometrie = None
+    for elem in wurzel.iter():
+        if lokaler_name(elem.tag) != "element" or not elem.get("name"):
+            continue
+        typ = elem.get("type", "")
+        if typ.split(":")[-1] == "FlurstueckType" or elem.get("substitutionGroup"):
+            continue
+        eigenschaften.append(elem.get("name"))
+        typen[elem.get("name")] = lese_xsd_typ(elem)
+        if geometrie is None and typ.startswith("gml:") and typ.endswith("PropertyType"):
+            geometrie = elem.get("name")
+    return {"eigenschaften": eigenschaften, "typen": typen, "geometrie": geometrie}
+
+
+def lese_xsd_typ(elem):
+    """XSD-Typ eines Elements, auch bei anonymem simpleType mit restriction"""
+    if elem.get("type"):
+        return elem.get("type")
+    basis = next((e.get("base") for e in elem.iter() if lokaler_name(e.tag) == "restriction"), None)
+    return basis or ""
+
+
+def waehle_formate(formate, version):
+    """(stream_format, output_format) aus den angebotenen Formaten; None, wenn nichts passt"""
+    klein = [(f, f.lower()) for f in formate]
+
+    stream_format = None
+    for merkmale in STREAM_FORMATE["2" if version.startswith("2") else "1"]:
+        passend = [f for f, k in klein if all(m in k for m in merkmale) and "zip" not in k]
+        if passend:
+            stream_format = passend[0]
+            break
+
+    output_format = next((f for f, k in klein if any(s in k for s in SHAPE_FORMATE)), None)
+    return stream_format, output_format
+
+
+class WfsProfilCache:
+    """Fähigkeiten der WFS-Endpunkte, bei Bedarf ermittelt und auf Platte gespeichert
+
+    Je Endpunkt werden GetCapabilities und DescribeFeatureType einmal
+    abgefragt, sobald eine Suche im Hintergrund den Endpunkt zum ersten Mal
+    braucht; beim Start des Plugins passiert nichts. Profile gelten
+    alkis_suchmodul/profil/max_alter_stunden (Standard 168), fehlgeschlagene
+    Abfragen werden nach einer Stunde wiederholt. Abschaltbar über
+    alkis_suchmodul/profil/aktiv.
+    """
+
+    SETTINGS_PREFIX = "alkis_suchmodul/profil"
+    FEHLER_ALTER = 3600
+
+    def __init__(self, http, pfad=None):
+        if pfad is None:
+            verzeichnis = os.path.join(QgsApplication.qgisSettingsDirPath(), "alkis_suchmodul")
+            os.makedirs(verzeichnis, exist_ok=True)
+            pfad = os.path.join(verzeichnis, "wfs_profile.json")
+        self.http = http
+        self.pfad = pfad
+        self.profile = None
+        self.lock = threading.Lock()
+        self.endpunkt_locks = {}
+
+    @property
+    def aktiv(self):
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/aktiv", True, type=bool)
+
+    @property
+    def max_alter(self):
+        return QSettings().value(f"{self.SETTINGS_PREFIX}/max_alter_stunden", 168, type=float) * 3600
+
+    def lade(self):
+        """Liest die gespeicherten Profile (einmal je Sitzung)"""
+        if self.profile is None:
+            try:
+                with open(self.pfad, "r", encoding="utf-8") as f:
+                    self.profile = json.load(f)
+            except (OSError, ValueError):
+                self.profile = {}
+        return self.profile
+
+    def speichere(self):
+        try:
+            with open(self.pfad, "w", encoding="utf-8") as f:
+                json.dump(self.profile, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            QgsMessageLog.logMessage(f"WFS-Profile konnten nicht gespeichert werden: {str(e)}",
+                                     "Flurstück-Suche", Qgis.Warning)
+
+    def gueltig(self, eintrag):
+        if eintrag is None:
+            return False
+        alter = time.time() - eintrag["zeit"]
+        return alter < (self.max_alter if eintrag["profil"] else self.FEHLER_ALTER)
+
+    def hole(self, wfs_url, cfg, proben=True):
+        """Profil des Endpunkts oder None
+
+        Ohne proben wird nur ein gespeichertes Profil geliefert (auch ein
+        abgelaufenes), damit der Hauptthread nie auf das Netz wartet.
+        """
+        if not self.aktiv:
+            return None
+        with self.lock:
+            eintrag = self.lade().get(wfs_url)
+            if self.gueltig(eintrag) or not proben:
+                return eintrag["profil"] if eintrag else None
+            endpunkt_lock = self.endpunkt_locks.setdefault(wfs_url, threading.Lock())
+
+        # Nur ein Thread fragt den Endpunkt ab; die anderen warten auf sein Ergebnis
+        with endpunkt_lock:
+            with self.lock:
+                eintrag = self.profile.get(wfs_url)
+                if self.gueltig(eintrag):
+                    return eintrag["profil"]
+            profil = self.probe(wfs_url, cfg)
+            with self.lock:
+                self.profile[wfs_url] = {"zeit": time.time(), "profil": profil}
+                self.speichere()
+            return profil
+
+    def probe(self, wfs_url, cfg):
+        """Fragt GetCapabilities und DescribeFeatureType ab; None bei Fehlern"""
+        try:
+            url = f"{wfs_url}?SERVICE=WFS&VERSION={cfg['version']}&REQUEST=GetCapabilities"
+            response = self.http.request("GET", url, timeout=15)
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            profil = lese_capabilities(response.content)
+        except Exception as e:
+            QgsMessageLog.logMessage(f"GetCapabilities für {wfs_url} fehlgeschlagen: {str(e)}",
+                                     "Flurstück-Suche", Qgis.Warning)
+            return None
+
+        profil["eigenschaften"] = []
+        profil["typen"] = {}
+        profil["geometrie"] = None
+        try:
+            url = (f"{wfs_url}?SERVICE=WFS&VERSION={cfg['version']}&REQUEST=DescribeFeatureType"
+                   f"&{cfg['typename']}={profil['typename'] or 'ave:Flurstueck'}")
+            response = self.http.request("GET", url, timeout=15)
+            if response.status_code == 200:
+                profil.update(lese_feature_typ(response.content))
+        except Exception as e:
+            QgsMessageLog.logMessage(f"DescribeFeatureType für {wfs_url} fehlgeschlagen: {str(e)}",
+                                     "Flurstück-Suche", Qgis.Warning)
+
+        QgsMessageLog.logMessage(
+            f"WFS-Profil {wfs_url}: {len(profil['formate'])} Formate, POST {'ja' if profil['post'] else 'nein'}, "
+            f"Blättern {profil['paging']}, max. {profil['max_anzahl'] or '?'} Features",
+            "Flurstück-Suche"
+        )
+        return profil
+
+    def verwerfe(self, wfs_url=None):
+        """Verwirft ein bzw. alle Profile, damit sie neu abgefragt werden"""
+        with self.lock:
+            self.lade()
+            if wfs_url is None:
+                self.profile.clear()
+            else:
+                self.profile.pop(wfs_url, None)
+            self.speichere()
+
+    def wende_an(self, basis_cfg, profil):
+        """Request-Konfiguration aus der Grundkonfiguration und einem Profil
+
+        Version, Typename-Schlüssel und Filter-Namespace bleiben wie
+        konfiguriert. Übernommen werden das günstigste Stream-Format, das
+        Shapefile-Format als Rückfall, POST-Unterstützung, Blättern, die
+        maximale Seitengröße und die Feldtypen für den Stream-Decoder.
+        """
+        cfg = dict(basis_cfg)
+        if not profil:
+            return cfg
+
+        if profil["formate"]:
+            stream_format, output_format = waehle_formate(profil["formate"], cfg["version"])
+            cfg["stream_format"] = stream_format
+            if output_format:
+                cfg["output_format"] = output_format
+            elif stream_format:
+                # Ohne Shapefile-ZIP bleibt nur das Stream-Format, gelesen über OGR
+                cfg["output_format"] = stream_format
+        cfg["post"] = profil["post"]
+        if profil["paging"] is not None:
+            cfg["paging"] = profil["paging"]
+        if profil["max_anzahl"]:
+            cfg["seiten_groesse"] = min(profil["max_anzahl"], MAX_SEITEN_GROESSE)
+        if profil.get("eigenschaften"):
+            cfg["eigenschaften"] = profil["eigenschaften"]
+            cfg["feld_typen"] = profil.get("typen") or {}
+            cfg["geometrie"] = profil["geometrie"]
+        return cfg
@@ -0,0 +1,120 @@
+from qgis.core import QgsMessageLog, Qgis
+from qgis.PyQt.QtCore import QSettings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+import threading
+import time
+import urllib.parse
+
+
+class RatenBegrenzer:
+    """Begrenzt die Anzahl der Requests pro Sekunde (gleichmäßiger Abstand)"""
+
+    def __init__(self, max_pro_sekunde):
+        self.abstand = 1.0 / max_pro_sekunde if max_pro_sekunde > 0 else 0.0
+        self.naechster = 0.0
+        self.lock = threading.Lock()
+
+    def warte(self):
+        """Blockiert, bis der nächste Request erlaubt ist"""
+        if not self.abstand:
+            return
+        with self.lock:
+            jetzt = time.monotonic()
+            start = max(jetzt, self.naechster)
+            self.naechster = start + self.abstand
+        if start > jetzt:
+            time.sleep(start - jetzt)
+
+
+class WfsSessionManager:
+    """Hält je WFS-Endpunkt eine requests.Session
+
+    Die Sessions nutzen Keep-Alive-Verbindungen aus einem Pool, fordern
+    komprimierte Antworten an und wiederholen Requests bei 5xx-Antworten
+    und Timeouts mit exponentiellem Backoff. Je Bundesland kann die
+    Request-Rate begrenzt werden (QSettings
+    alkis_suchmodul/http/max_requests_pro_sekunde/<Bundesland>, 0 = aus).
+    """
+
+    SETTINGS_PREFIX = "alkis_suchmodul/http"
+    STANDARD_RATE = 5.0
+
+    def __init__(self, pool_groesse=16, wiederholungen=3, backoff=0.5):
+        self.pool_groesse = pool_groesse
+        self.wiederholungen = wiederholungen
+        self.backoff = backoff
+        self.sessions = {}
+        self.begrenzer = {}
+        self.lock = threading.Lock()
+
+    def erstelle_retry(self):
+        """Retry-Strategie für 5xx-Antworten und Verbindungsfehler"""
+        optionen = dict(
+            total=self.wiederholungen,
+            connect=self.wiederholungen,
+            read=self.wiederholungen,
+            status=self.wiederholungen,
+            backoff_factor=self.backoff,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False
+        )
+        try:
+            return Retry(allowed_methods=frozenset(["GET", "POST"]), **optionen)
+        except TypeError:
+            # urllib3 < 1.26
+            return Retry(method_whitelist=frozenset(["GET", "POST"]), **optionen)
+
+    def session(self, url):
+        """Gibt die Session für den Host der URL zurück"""
+        endpunkt = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            session = self.sessions.get(endpunkt)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_groesse,
+                                      max_retries=self.erstelle_retry())
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Accept-Encoding": "gzip, deflate",
+                    "User-Agent": "ALKIS-Suchmodul (QGIS-Plugin)"
+                })
+                self.sessions[endpunkt] = session
+                QgsMessageLog.logMessage(f"HTTP-Session angelegt: {endpunkt}", "Flurstück-Suche")
+            return session
+
+    def ratenbegrenzer(self, bundesland):
+        """Gibt den Ratenbegrenzer für ein Bundesland zurück"""
+        with self.lock:
+            begrenzer = self.begrenzer.get(bundesland)
+            if begrenzer is None:
+                rate = QSettings().value(f"{self.SETTINGS_PREFIX}/max_requests_pro_sekunde/{bundesland}",
+                                         self.STANDARD_RATE, type=float)
+                begrenzer = RatenBegrenzer(rate)
+                self.begrenzer[bundesland] = begrenzer
+            return begrenzer
+
+    def request(self, methode, url, bundesland=None, **kwargs):
+        """Führt einen Request über die Session des Endpunkts aus"""
+        if bundesland:
+            self.ratenbegrenzer(bundesland).warte()
+        return self.session(url).request(methode, url, **kwargs)
+
+    def setze_rate(self, bundesland, max_pro_sekunde):
+        """Setzt die maximale Request-Rate eines Bundeslands"""
+        QSettings().setValue(f"{self.SETTINGS_PREFIX}/max_requests_pro_sekunde/{bundesland}", max_pro_sekunde)
+        with self.lock:
+            self.begrenzer.pop(bundesland, None)
+
+    def schliesse(self):
+        """Schließt alle Sessions und ihre Verbindungen"""
+        with self.lock:
+            for session in self.sessions.values():
+                try:
+                    session.close()
+                except Exception as e:
+                    QgsMessageLog.logMessage(f"Fehler beim Schließen der Session: {str(e)}",
+                                             "Flurstück-Suche", Qgis.Warning)
+            self.sessions.clear()
@@ -0,0 +1,388 @@
+from qgis.core import (QgsCoordinateReferenceSystem, QgsFeature, QgsField, QgsFields, QgsGeometry,
+                       QgsVectorLayer, QgsWkbTypes)
+from qgis.PyQt.QtCore import QCoreApplication, QThread, QVariant
+from osgeo import ogr
+import codecs
+import json
+import re
+import xml.etree.ElementTree as ET
+
+GML_NAMESPACES = ("http://www.opengis.net/gml", "http://www.opengis.net/gml/3.2")
+MEMBER_TAGS = ("member", "featureMember", "featureMembers")
+
+# Die Landesdienste liefern ALKIS in UTM 32; gilt, wenn die Antwort kein KBS nennt
+STANDARD_CRS = "EPSG:25832"
+
+# XSD-Typen aus DescribeFeatureType und ihre Feldtypen; wie beim Shapefile
+# (OGR) werden nur Zahlen typisiert, alles andere bleibt Text
+XSD_FELD_TYPEN = {
+    "int": QVariant.Int, "short": QVariant.Int, "byte": QVariant.Int,
+    "long": QVariant.LongLong, "integer": QVariant.LongLong, "nonNegativeInteger": QVariant.LongLong,
+    "positiveInteger": QVariant.LongLong,
+    "double": QVariant.Double, "float": QVariant.Double, "decimal": QVariant.Double,
+}
+
+
+class WfsStreamFehler(Exception):
+    """Fehler beim Dekodieren einer GML/GeoJSON-Antwort"""
+
+
+def lokaler_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def namespace(tag):
+    return tag[1:].split("}", 1)[0] if tag.startswith("{") else ""
+
+
+def reduziere_geometrie(geometrie, crs, raster=None, toleranz=None):
+    """Vereinfacht eine Geometrie (toleranz) und rundet sie auf ein Gitter (raster)
+
+    Beide Werte sind Meter; bei geographischen KBS bleibt die Geometrie
+    unverändert. Führt die Vereinfachung zu einer leeren Geometrie, wird
+    nur gerundet.
+    """
+    if geometrie is None or (crs is not None and crs.isGeographic()):
+        return geometrie
+    if toleranz:
+        vereinfacht = geometrie.simplify(toleranz)
+        if not vereinfacht.isEmpty():
+            geometrie = vereinfacht
+    if raster:
+        gerundet = geometrie.snappedToGrid(raster, raster)
+        if not gerundet.isEmpty():
+            geometrie = gerundet
+    return geometrie
+
+
+def feld_typ(xsd_typ):
+    """Feldtyp zu einem XSD-Typ wie "xs:int" (sonst Text)"""
+    return XSD_FELD_TYPEN.get((xsd_typ or "").split(":")[-1], QVariant.String)
+
+
+def erkenne_feld_typ(werte):
+    """Leitet den Feldtyp aus Werten ab, wenn der Dienst keine Typen nennt
+
+    Ganzzahlen werden Int bzw. LongLong, Dezimalzahlen Double; Werte mit
+    führender Null (z. B. Kennzeichen) bleiben Text.
+    """
+    werte = [w for w in werte if w is not None and w != ""]
+    if not werte or any(isinstance(w, (bool, dict, list)) for w in werte):
+        return QVariant.String
+    if any(isinstance(w, str) and re.match(r"^[+-]?0\d", w.strip()) for w in werte):
+        return QVariant.String
+    try:
+        zahlen = [int(w) for w in werte if not isinstance(w, float)]
+        if len(zahlen) == len(werte):
+            return QVariant.Int if all(-2 ** 31 <= z < 2 ** 31 for z in zahlen) else QVariant.LongLong
+    except ValueError:
+        pass
+    try:
+        for wert in werte:
+            float(wert)
+        return QVariant.Double
+    except ValueError:
+        return QVariant.String
+
+
+def wandle_wert(wert, typ):
+    """Wandelt einen dekodierten Wert in den Feldtyp um (None, wenn das nicht geht)"""
+    if wert is None:
+        return None
+    try:
+        if typ in (QVariant.Int, QVariant.LongLong):
+            try:
+                return int(wert)
+            except ValueError:
+                return int(float(wert))
+        if typ == QVariant.Double:
+            return float(wert)
+    except (TypeError, ValueError):
+        return None
+    return wert if isinstance(wert, str) else str(wert)
+
+
+def verschiebe_in_hauptthread(layer):
+    """Übergibt einen im Worker-Thread erzeugten Layer an den Hauptthread"""
+    haupt_thread = QCoreApplication.instance().thread()
+    if QThread.currentThread() != haupt_thread:
+        layer.moveToThread(haupt_thread)
+
+
+class BlockLeser:
+    """Dateiartige Hülle um einen Iterator von Byte-Blöcken (für iterparse)"""
+
+    def __init__(self, bloecke):
+        self.bloecke = iter(bloecke)
+        self.rest = b""
+
+    def read(self, n=-1):
+        while n < 0 or len(self.rest) < n:
+            try:
+                self.rest += next(self.bloecke)
+            except StopIteration:
+                break
+        if n < 0:
+            daten, self.rest = self.rest, b""
+        else:
+            daten, self.rest = self.rest[:n], self.rest[n:]
+        return daten
+
+
+class WfsStreamDecoder:
+    """Dekodiert GML- oder GeoJSON-Antworten blockweise in QgsFeatures
+
+    Die Antwort wird beim Herunterladen gelesen; es entstehen weder
+    temporäre Dateien noch ein OGR-Quelllayer. Feldnamen werden in voller
+    Länge übernommen (kein 10-Zeichen-Limit wie beim Shapefile). Die
+    Feldtypen kommen aus typen ({name: XSD-Typ} aus DescribeFeatureType);
+    fehlt ein Name dort, wird der Typ aus den Werten des ersten Blocks
+    abgeleitet, damit Stream und Shapefile dasselbe Schema liefern. Felder,
+    die erst in späteren Features auftauchen, werden ergänzt. Mit raster bzw. toleranz werden
+    die Geometrien beim Dekodieren reduziert (siehe reduziere_geometrie).
+    """
+
+    def __init__(self, art, batch_groesse=500, raster=None, toleranz=None, typen=None):
+        self.art = art
+        self.typen = typen or {}
+        self.batch_groesse = batch_groesse
+        self.raster = raster
+        self.toleranz = toleranz
+        self.felder = QgsFields()
+        self.crs = None
+
+    def datensaetze(self, bloecke):
+        """Liefert (attribute, geometrie) je Feature"""
+        if self.art == "geojson":
+            return self.geojson_datensaetze(bloecke)
+        return self.gml_datensaetze(bloecke)
+
+    def gml_datensaetze(self, bloecke):
+        """Liest GML-Features inkrementell mit iterparse"""
+        stapel = []
+        wurzel = None
+        try:
+            for ereignis, elem in ET.iterparse(BlockLeser(bloecke), events=("start", "end")):
+                if ereignis == "start":
+                    if wurzel is None:
+                        wurzel = elem
+                    stapel.append(elem)
+                    continue
+
+                stapel.pop()
+                if elem is wurzel and lokaler_name(elem.tag) == "ExceptionReport":
+                    text = " ".join(t.strip() for t in elem.itertext() if t.strip())
+                    raise WfsStreamFehler(f"WFS-Fehler: {text}")
+
+                # Verarbeitete Elemente aus dem Baum lösen, damit der Speicher konstant bleibt
+                if stapel and lokaler_name(stapel[-1].tag) in MEMBER_TAGS:
+                    yield self.lese_gml_feature(elem)
+                    stapel[-1].remove(elem)
+                elif stapel and lokaler_name(elem.tag) in MEMBER_TAGS:
+                    stapel[-1].remove(elem)
+        except ET.ParseError as e:
+            raise WfsStreamFehler(f"Ungültiges XML empfangen: {str(e)}")
+
+    def lese_gml_feature(self, elem):
+        """Attribute und Geometrie eines GML-Features"""
+        attribute = {}
+        geometrie = None
+        for kind in elem:
+            name = lokaler_name(kind.tag)
+            if name == "boundedBy":
+                continue
+            geom_elem = next((g for g in kind if namespace(g.tag) in GML_NAMESPACES), None)
+            if geom_elem is not None:
+                if geometrie is None:
+                    geometrie = self.gml_geometrie(geom_elem)
+                continue
+            text = (kind.text or "").strip()
+            attribute[name] = text if text else None
+        return attribute, geometrie
+
+    def gml_geometrie(self, elem):
+        """Wandelt ein GML-Geometrieelement über OGR in eine QgsGeometry um"""
+        if self.crs is None and elem.get("srsName"):
+            self.crs = QgsCoordinateReferenceSystem.fromOgcWmsCrs(elem.get("srsName"))
+        ogr_geometrie = ogr.CreateGeometryFromGML(ET.tostring(elem, encoding="unicode"))
+        if ogr_geometrie is None:
+            return None
+        geometrie = QgsGeometry()
+        geometrie.fromWkb(bytes(ogr_geometrie.ExportToIsoWkb()))
+        return geometrie
+
+    def geojson_datensaetze(self, bloecke):
+        """Liest GeoJSON-Features inkrementell aus dem features-Array"""
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        bloecke = iter(bloecke)
+        puffer = ""
+        pos = -1
+        ende = False
+
+        def nachladen():
+            try:
+                return utf8.decode(next(bloecke))
+            except StopIteration:
+                return None
+
+        while True:
+            if pos < 0:
+                treffer = re.search(r'"features"\s*:\s*\[', puffer)
+                if treffer is None:
+                    mehr = nachladen()
+                    if mehr is None:
+                        raise WfsStreamFehler("Ungültiges GeoJSON empfangen (kein features-Array)")
+                    puffer += mehr
+                    continue
+                self.lese_geojson_crs(puffer[:treffer.start()])
+                puffer = puffer[treffer.end():]
+                pos = 0
+
+            while pos < len(puffer) and puffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(puffer) and puffer[pos] == "]":
+                return
+
+            try:
+                if pos >= len(puffer):
+                    raise ValueError()
+                objekt, pos = decoder.raw_decode(puffer, pos)
+            except ValueError:
+                if ende:
+                    raise WfsStreamFehler("Unvollständiges GeoJSON empfangen")
+                mehr = nachladen()
+                if mehr is None:
+                    ende = True
+                else:
+                    puffer = puffer[pos:] + mehr
+                    pos = 0
+                continue
+
+            yield self.lese_geojson_feature(objekt)
+
+    def lese_geojson_crs(self, kopf):
+        """Liest ein optionales crs-Mitglied vor dem features-Array"""
+        treffer = re.search(r'"crs"\s*:\s*\{.*?"name"\s*:\s*"([^"]+)"', kopf, re.S)
+        if treffer and self.crs is None:
+            self.crs = QgsCoordinateReferenceSystem.fromOgcWmsCrs(treffer.group(1))
+
+    def lese_geojson_feature(self, objekt):
+        """Attribute und Geometrie eines GeoJSON-Features"""
+        attribute = dict(objekt.get("properties") or {})
+        geometrie = None
+        if objekt.get("geometry"):
+            ogr_geometrie = ogr.CreateGeometryFromJson(json.dumps(objekt["geometry"]))
+            if ogr_geometrie is not None:
+                geometrie = QgsGeometry()
+                geometrie.fromWkb(bytes(ogr_geometrie.ExportToIsoWkb()))
+        return attribute, geometrie
+
+    def feature_bloecke(self, bloecke):
+        """Liefert (features, neue_felder) in Blöcken von batch_groesse"""
+        block = []
+        for datensatz in self.datensaetze(bloecke):
+            block.append(datensatz)
+            if len(block) >= self.batch_groesse:
+                yield self.baue_features(block)
+                block = []
+        if block:
+            yield self.baue_features(block)
+
+    def baue_features(self, datensaetze):
+        """Erzeugt QgsFeatures; ergänzt dabei neu auftauchende Felder"""
+        neue_felder = []
+        for attribute, _ in datensaetze:
+            for name in attribute:
+                if self.felder.indexFromName(name) == -1:
+                    if name in self.typen:
+                        typ = feld_typ(self.typen[name])
+                    else:
+                        typ = erkenne_feld_typ(a.get(name) for a, _ in datensaetze)
+                    feld = QgsField(name, typ)
+                    self.felder.append(feld)
+                    neue_felder.append(feld)
+
+        reduzieren = self.raster or self.toleranz
+        crs = self.crs or QgsCoordinateReferenceSystem(STANDARD_CRS)
+        features = []
+        for attribute, geometrie in datensaetze:
+            feature = QgsFeature(self.felder)
+            if geometrie is not None:
+                if reduzieren:
+                    geometrie = reduziere_geometrie(geometrie, crs, self.raster, self.toleranz)
+                feature.setGeometry(geometrie)
+            for name, wert in attribute.items():
+                feature[name] = wandle_wert(wert, self.felder.field(name).type())
+            features.append(feature)
+        return features, neue_felder
+
+    def lade_ergebnis(self, bloecke):
+        """Dekodiert die Antwort in ein Ergebnis-Dict mit Feature-Liste"""
+        features = []
+        for block, _ in self.feature_bloecke(bloecke):
+            features.extend(block)
+
+        if not features:
+            return False, "Keine Geometrien in der Antwort gefunden!"
+
+        # Features vor später ergänzten Feldern auf die volle Feldliste bringen
+        anzahl = self.felder.count()
+        for feature in features:
+            if len(feature.attributes()) < anzahl:
+                werte = feature.attributes() + [None] * (anzahl - len(feature.attributes()))
+                feature.setFields(self.felder, False)
+                feature.setAttributes(werte)
+
+        return True, {
+            "felder": self.felder,
+            "crs": self.crs or QgsCoordinateReferenceSystem(STANDARD_CRS),
+            "features": features
+        }
+
+    def lade_in_layer(self, bloecke, layer_name):
+        """Schreibt die Features blockweise direkt in einen neuen Memory-Layer
+
+        Der Layer wird beim ersten Block angelegt und bleibt im aufrufenden
+        Thread; der Aufrufer übergibt ihn mit verschiebe_in_hauptthread,
+        sobald er ihn nicht mehr liest. Felder, KBS, Ausdehnung und Anzahl
+        werden zusätzlich als einfache Werte geliefert.
+        """
+        layer = None
+        for features, neue_felder in self.feature_bloecke(bloecke):
+            if layer is None:
+                geometrie_typ = next((f.geometry().wkbType() for f in features if f.hasGeometry()),
+                                     QgsWkbTypes.MultiPolygon)
+                crs = self.crs or QgsCoordinateReferenceSystem(STANDARD_CRS)
+                layer = QgsVectorLayer(
+                    f"{QgsWkbTypes.displayString(QgsWkbTypes.multiType(geometrie_typ))}?crs={crs.authid()}",
+                    layer_name,
+                    "memory"
+                )
+                neue_felder = list(self.felder)
+
+            provider = layer.dataProvider()
+            if neue_felder:
+                provider.addAttributes(neue_felder)
+                layer.updateFields()
+
+            for feature in features:
+                if feature.hasGeometry():
+                    geometrie = feature.geometry()
+                    geometrie.convertToMultiType()
+                    feature.setGeometry(geometrie)
+            provider.addFeatures(features)
+
+        if layer is None:
+            return False, "Keine Geometrien in der Antwort gefunden!"
+
+        layer.updateExtents()
+
+        return True, {
+            "felder": layer.fields(),
+            "crs": layer.crs(),
+            "extent": layer.extent(),
+            "anzahl": layer.featureCount(),
+            "features": None,
+            "layer": layer
+        }